@@ -1,12 +1,36 @@
+import hashlib
+import json
+import multiprocessing
 import os
 import tensorflow as tf
 import sonnet as snt
 
 from luminoth.datasets.exceptions import InvalidDataDirectory
+from luminoth.utils.dataset import get_split_files
+
+
+INPUT_PIPELINES = ('tf_data', 'queue')
+
+# Largest size of the decoded images when caching them in memory, unless set
+# through `dataset.cache_max_mb`.
+DEFAULT_CACHE_MAX_MB = 4096
 
 
 class BaseDataset(snt.AbstractModule):
-    def __init__(self, config, **kwargs):
+    def __init__(self, config, num_readers=20, num_workers=1, worker_index=0,
+                 **kwargs):
+        """
+        Args:
+            config: Config object with all the session properties.
+            num_readers (int): Number of threads reading and preprocessing
+                records in parallel when using the queue-based pipeline.
+                Records are only returned in the order they are stored (when
+                not shuffling) with a single reader.
+            num_workers (int): Number of workers reading the dataset (when
+                training in a distributed fashion). Each one reads a
+                different part of it.
+            worker_index (int): Index of the worker reading the dataset.
+        """
         super(BaseDataset, self).__init__(**kwargs)
         self._dataset_dir = config.dataset.dir
         self._num_epochs = config.train.num_epochs
@@ -15,6 +39,32 @@ class BaseDataset(snt.AbstractModule):
         self._random_shuffle = config.train.random_shuffle
         self._seed = config.train.seed
 
+        self._input_pipeline = config.dataset.get('input_pipeline', 'tf_data')
+        if self._input_pipeline not in INPUT_PIPELINES:
+            raise ValueError(
+                'Invalid input_pipeline "{}". Must be one of: {}'.format(
+                    self._input_pipeline, ', '.join(INPUT_PIPELINES)
+                )
+            )
+        self._num_parallel_calls = (
+            config.dataset.get('num_parallel_calls') or
+            multiprocessing.cpu_count()
+        )
+        self._shuffle_buffer_size = config.dataset.get(
+            'shuffle_buffer_size', 1000
+        )
+        self._prefetch_buffer_size = config.dataset.get(
+            'prefetch_buffer_size', 4
+        )
+        self._num_parallel_reads = config.dataset.get(
+            'num_parallel_reads', 8
+        )
+        self._cache = config.dataset.get('cache')
+        self._cache_max_mb = config.dataset.get(
+            'cache_max_mb', DEFAULT_CACHE_MAX_MB
+        )
+        self._image_preprocessing = config.dataset.image_preprocessing
+
         self._fixed_resize = (
             'fixed_height' in config.dataset.image_preprocessing and
             'fixed_width' in config.dataset.image_preprocessing
@@ -27,21 +77,197 @@ class BaseDataset(snt.AbstractModule):
                 config.dataset.image_preprocessing.fixed_width
             )
 
-        self._total_queue_ops = 20
+        self._total_queue_ops = num_readers
+        self._num_workers = num_workers
+        self._worker_index = worker_index
+
+        # Op that (re)starts reading the dataset from the beginning, which
+        # must be run before reading any record.
+        self.initializer = None
+        # Fraction of the records queue that is full (only available when
+        # using the queue-based pipeline).
+        self.queue_occupancy = None
 
     def _build(self):
-        # Find split file from which we are going to read.
-        split_path = os.path.join(
-            self._dataset_dir, '{}.tfrecords'.format(self._split)
-        )
-        if not tf.gfile.Exists(split_path):
+        # Find the split files (a single one or its shards) we are going to
+        # read from.
+        filenames = get_split_files(self._dataset_dir, self._split)
+        if not filenames:
             raise InvalidDataDirectory(
-                '"{}" does not exist.'.format(split_path)
+                '"{}" does not exist.'.format(os.path.join(
+                    self._dataset_dir, '{}.tfrecords'.format(self._split)
+                ))
             )
+
+        # Assign whole files to each worker when there are enough of them.
+        shard_records = False
+        if self._num_workers > 1:
+            if len(filenames) >= self._num_workers:
+                filenames = filenames[self._worker_index::self._num_workers]
+            else:
+                shard_records = True
+
+        if self._input_pipeline == 'queue':
+            if self._batch_size > 1:
+                raise ValueError(
+                    'Batches of more than one image are only supported by the '
+                    '`tf_data` input pipeline.'
+                )
+            if self._cache:
+                tf.logging.warning(
+                    'Caching decoded images is only supported by the '
+                    '`tf_data` input pipeline. Ignoring.'
+                )
+            if shard_records:
+                tf.logging.warning(
+                    'Fewer files than workers; every worker will read the '
+                    'whole dataset.'
+                )
+            return self._build_queue(filenames)
+
+        return self._build_tf_data(filenames, shard_records=shard_records)
+
+    def _build_tf_data(self, filenames, shard_records=False):
+        """Builds the input pipeline using `tf.data`.
+
+        Files are read interleaved, while records are parsed, decoded and
+        augmented in parallel (keeping their order), and prefetched so they're
+        ready when the model needs them.
+
+        When caching, the images are decoded (and resized) only during the
+        first epoch, and read from the cache afterwards. Data augmentation is
+        still applied to them every epoch.
+        """
+        dataset = tf.data.Dataset.from_tensor_slices(filenames)
+        if self._random_shuffle:
+            dataset = dataset.shuffle(len(filenames), seed=self._seed)
+        dataset = dataset.interleave(
+            tf.data.TFRecordDataset,
+            cycle_length=min(len(filenames), self._num_parallel_reads)
+        )
+
+        if shard_records:
+            # Not enough files for every worker, so split them by records.
+            dataset = dataset.shard(self._num_workers, self._worker_index)
+
+        read_fn = self.read_record
+        if self._cache == 'memory':
+            self._check_memory_cache(filenames, shard_records=shard_records)
+        if self._cache:
+            dataset = dataset.map(
+                lambda record: self.decode_record(record, resize=True),
+                num_parallel_calls=self._num_parallel_calls
+            )
+            dataset = dataset.cache(self._get_cache_filename(filenames))
+            read_fn = self.read_decoded_record
+
+        # Shuffle the records before they're preprocessed (and, when not
+        # caching, decoded), which is considerably cheaper in memory.
+        if self._random_shuffle:
+            dataset = dataset.shuffle(
+                self._shuffle_buffer_size, seed=self._seed
+            )
+        dataset = dataset.repeat(self._num_epochs)
+
+        dataset = dataset.map(
+            lambda record: read_fn(record)[0],
+            num_parallel_calls=self._num_parallel_calls
+        )
+        if self._batch_size > 1:
+            dataset = self._batch(dataset)
+        dataset = dataset.prefetch(self._prefetch_buffer_size)
+
+        iterator = dataset.make_initializable_iterator()
+        self.initializer = iterator.initializer
+
+        return iterator.get_next()
+
+    def _batch(self, dataset):
+        """Groups the preprocessed records of `dataset` into batches.
+
+        Only called when `batch_size` is larger than one. Datasets that
+        support batches must override it.
+        """
+        raise ValueError(
+            'Batches of more than one image are not supported by {} (got a '
+            '`batch_size` of {}).'.format(
+                type(self).__name__, self._batch_size
+            )
+        )
+
+    def _get_cache_filename(self, filenames):
+        """Returns the filename to cache the decoded images to.
+
+        An empty string (meaning the images are kept in memory) is returned
+        when the cache is `memory`. Otherwise, the cache is a directory, and
+        the filename identifies the files read (including their size and
+        modification time, which change when they're written again) and how
+        images are resized, so that an outdated cache is never used.
+        """
+        if self._cache == 'memory':
+            return ''
+
+        if not tf.gfile.Exists(self._cache):
+            tf.gfile.MakeDirs(self._cache)
+
+        files = []
+        for filename in filenames:
+            stat = tf.gfile.Stat(filename)
+            files.append([filename, stat.length, stat.mtime_nsec])
+
+        key = hashlib.sha1(json.dumps({
+            'files': files,
+            'image_preprocessing': self._image_preprocessing,
+            'worker': [self._num_workers, self._worker_index],
+        }, sort_keys=True).encode('utf-8')).hexdigest()
+
+        return os.path.join(
+            self._cache, '{}-{}'.format(self._split, key[:16])
+        )
+
+    def _check_memory_cache(self, filenames, shard_records=False):
+        """Checks the decoded images fit in `cache_max_mb` before caching
+        them in memory.
+
+        The size of each image is computed from the dimensions stored in its
+        record, so only the records (and not the images) are read.
+
+        Raises:
+            ValueError: When the decoded images of the split (or of the
+                worker's part of it) take more than `cache_max_mb`.
+        """
+        max_bytes = self._cache_max_mb * 1024 * 1024
+        # When sharding records, each worker only caches about
+        # `1 / num_workers` of them.
+        max_bytes *= self._num_workers if shard_records else 1
+
+        total_bytes = 0
+        for filename in filenames:
+            for record in tf.python_io.tf_record_iterator(filename):
+                total_bytes += self.get_decoded_size(record)
+                if total_bytes > max_bytes:
+                    raise ValueError(
+                        'The decoded images of the "{}" split take more than '
+                        '`cache_max_mb` ({} MB) of memory. Use a directory '
+                        'as `cache` instead.'.format(
+                            self._split, self._cache_max_mb
+                        )
+                    )
+
+    def get_decoded_size(self, record):
+        """Returns the size in bytes of the decoded (and resized) image of
+        the serialized `record`, as cached by `decode_record`.
+        """
+        raise NotImplementedError()
+
+    def _build_queue(self, filenames):
+        """Builds the input pipeline using queue runners.
+        """
         # String input producer allows for a variable number of files to read
-        # from. We just know we have a single file.
+        # from.
         filename_queue = tf.train.string_input_producer(
-            [split_path], num_epochs=self._num_epochs, seed=self._seed
+            filenames, num_epochs=self._num_epochs,
+            shuffle=self._random_shuffle, seed=self._seed
         )
 
         # Define reader to parse records.
@@ -50,9 +276,10 @@ class BaseDataset(snt.AbstractModule):
 
         values, dtypes, names = self.read_record(raw_record)
 
+        queue_capacity = 100
         if self._random_shuffle:
             queue = tf.RandomShuffleQueue(
-                capacity=100,
+                capacity=queue_capacity,
                 min_after_dequeue=0,
                 dtypes=dtypes,
                 names=names,
@@ -61,7 +288,7 @@ class BaseDataset(snt.AbstractModule):
             )
         else:
             queue = tf.FIFOQueue(
-                capacity=100,
+                capacity=queue_capacity,
                 dtypes=dtypes,
                 names=names,
                 name='tfrecord_fifo_queue'
@@ -72,5 +299,7 @@ class BaseDataset(snt.AbstractModule):
         self.queue_runner = tf.train.QueueRunner(queue, enqueue_ops)
 
         tf.train.add_queue_runner(self.queue_runner)
+        self.initializer = tf.no_op()
+        self.queue_occupancy = tf.to_float(queue.size()) / queue_capacity
 
         return queue.dequeue()
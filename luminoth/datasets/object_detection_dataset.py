@@ -15,6 +15,11 @@ DATA_AUGMENTATION_STRATEGIES = {
 }
 
 
+# Boundaries of the aspect ratio (width / height) buckets images are grouped in
+# when batching.
+DEFAULT_ASPECT_RATIO_BOUNDARIES = [0.6, 0.8, 1.0, 1.2, 1.4, 1.6, 1.8]
+
+
 class ObjectDetectionDataset(BaseDataset):
     """Abstract object detector dataset module.
 
@@ -67,6 +72,9 @@ class ObjectDetectionDataset(BaseDataset):
             'max_size')
         # In case no keys are defined, default to empty list.
         self._data_augmentation = config.dataset.data_augmentation or []
+        self._aspect_ratio_boundaries = config.dataset.get(
+            'aspect_ratio_boundaries', DEFAULT_ASPECT_RATIO_BOUNDARIES
+        )
 
     def preprocess(self, image, bboxes=None):
         """Apply transformations to image and bboxes (if available).
@@ -91,6 +99,23 @@ class ObjectDetectionDataset(BaseDataset):
             - queue_names: Names for each tensor.
             - queue_types: Types for each tensor.
         """
+        return self.read_decoded_record(self.decode_record(record))
+
+    def decode_record(self, record, resize=False):
+        """Parses a TFRecord and decodes its image.
+
+        The result doesn't depend on the data augmentation (which is random),
+        so it can be cached and reused across epochs.
+
+        Args:
+            record: Serialized `tf.train.SequenceExample`.
+            resize (bool): Resize the image (and bounding boxes) as done by
+                `preprocess`, so it's stored in its final size.
+
+        Returns:
+            Dict with the `uint8` image, its bounding boxes and filename. When
+            resizing, it also has the scale factor used.
+        """
         # We parse variable length features (bboxes in a image) as sequence
         # features
         context_example, sequence_example = tf.parse_single_sequence_example(
@@ -100,12 +125,10 @@ class ObjectDetectionDataset(BaseDataset):
         )
 
         # Decode image
-        image_raw = tf.image.decode_image(
+        image = tf.image.decode_image(
             context_example['image_raw'], channels=3
         )
 
-        image = tf.cast(image_raw, tf.float32)
-
         height = tf.cast(context_example['height'], tf.int32)
         width = tf.cast(context_example['width'], tf.int32)
         image_shape = tf.stack([height, width, 3])
@@ -120,24 +143,153 @@ class ObjectDetectionDataset(BaseDataset):
         # Stack parsed tensors to define bounding boxes of shape (num_boxes, 5)
         bboxes = tf.stack([xmin, ymin, xmax, ymax, label], axis=1)
 
-        image, bboxes, preprocessing_details = self.preprocess(image, bboxes)
-
         filename = tf.cast(context_example['filename'], tf.string)
 
+        decoded = {
+            'image': image,
+            'bboxes': bboxes,
+            'filename': filename,
+        }
+        if resize:
+            image, bboxes, scale_factor = self._resize_image(image, bboxes)
+            decoded.update({
+                'image': image,
+                'bboxes': bboxes,
+                'scale_factor': scale_factor,
+            })
+
+        return decoded
+
+    def get_decoded_size(self, record):
+        """Returns the size in bytes of the `uint8` image `decode_record`
+        returns for the serialized `record` when resizing it.
+
+        The new size is computed as done by `_resize_image`, without decoding
+        the image.
+        """
+        context = tf.train.SequenceExample.FromString(record).context
+        height = context.feature['height'].int64_list.value[0]
+        width = context.feature['width'].int64_list.value[0]
+
+        if self._fixed_resize:
+            height = self._image_fixed_height
+            width = self._image_fixed_width
+        else:
+            scale_factor = 1.
+            if self._image_min_size is not None:
+                scale_factor *= max(
+                    float(self._image_min_size) / min(height, width), 1.
+                )
+            if self._image_max_size is not None:
+                scale_factor *= min(
+                    float(self._image_max_size) / max(height, width), 1.
+                )
+            height = int(height * scale_factor)
+            width = int(width * scale_factor)
+
+        return height * width * 3
+
+    def read_decoded_record(self, decoded):
+        """Preprocesses a record returned by `decode_record`.
+
+        Returns the same as `read_record`. The image is kept as `uint8`
+        (also during data augmentation), as it's four times smaller than
+        `float32`. Models convert it before feeding it to the base network.
+        """
+        image, bboxes, preprocessing_details = self.preprocess(
+            decoded['image'], decoded['bboxes']
+        )
+
+        scale_factor = preprocessing_details['scale_factor']
+        if 'scale_factor' in decoded:
+            # The image was already resized when decoding it.
+            if isinstance(scale_factor, tuple):
+                scale_factor = tuple(
+                    factor * decoded_factor for factor, decoded_factor in zip(
+                        scale_factor, decoded['scale_factor']
+                    )
+                )
+            else:
+                scale_factor = scale_factor * decoded['scale_factor']
+
         # TODO: Send additional metadata through the queue (scale_factor,
         # applied_augmentations)
 
-        queue_dtypes = [tf.float32, tf.int32, tf.string, tf.float32]
+        queue_dtypes = [tf.uint8, tf.int32, tf.string, tf.float32]
         queue_names = ['image', 'bboxes', 'filename', 'scale_factor']
         queue_values = {
             'image': image,
             'bboxes': bboxes,
-            'filename': filename,
-            'scale_factor': preprocessing_details['scale_factor'],
+            'filename': decoded['filename'],
+            'scale_factor': scale_factor,
         }
 
         return queue_values, queue_dtypes, queue_names
 
+    def _batch(self, dataset):
+        """Groups images with similar aspect ratios into padded batches.
+
+        Images are padded with zeros (at the bottom and right) to the size of
+        the largest one in their batch, and their bounding boxes with rows of
+        -1 to the largest number of them. The `image_shape` key holds the
+        (height, width) of each image before padding.
+
+        As the model needs a static batch size, records left over at the end
+        of the dataset that don't fill a batch are dropped.
+        """
+        def add_image_shape(values):
+            values = dict(values)
+            values['image_shape'] = tf.shape(values['image'])[:2]
+            return values
+
+        dataset = dataset.map(add_image_shape)
+
+        def get_bucket(values):
+            image_shape = tf.to_float(values['image_shape'])
+            aspect_ratio = image_shape[1] / image_shape[0]
+            return tf.reduce_sum(tf.to_int64(tf.greater(
+                aspect_ratio, self._aspect_ratio_boundaries
+            )))
+
+        def get_padding_value(key, dtype):
+            if dtype == tf.string:
+                return tf.constant('', dtype)
+            return tf.constant(-1 if key == 'bboxes' else 0, dtype)
+
+        padded_shapes = dataset.output_shapes
+        padding_values = {}
+        for key, dtype in dataset.output_types.items():
+            if isinstance(dtype, tuple):
+                padding_values[key] = tuple(
+                    get_padding_value(key, value_dtype)
+                    for value_dtype in dtype
+                )
+            else:
+                padding_values[key] = get_padding_value(key, dtype)
+
+        dataset = dataset.apply(tf.contrib.data.group_by_window(
+            key_func=get_bucket,
+            reduce_func=lambda key, window: window.padded_batch(
+                self._batch_size, padded_shapes=padded_shapes,
+                padding_values=padding_values
+            ),
+            window_size=self._batch_size
+        ))
+
+        def has_batch_size(values):
+            return tf.equal(tf.shape(values['image'])[0], self._batch_size)
+
+        def set_batch_size(values):
+            for value in values.values():
+                # Fixed-size resizing returns a tuple as scale factor.
+                for tensor in value if isinstance(value, tuple) else [value]:
+                    tensor.set_shape(
+                        [self._batch_size] + tensor.shape.as_list()[1:]
+                    )
+            return values
+
+        return dataset.filter(has_batch_size).map(set_batch_size)
+
     def _augment(self, image, bboxes=None, default_prob=0.5):
         """Applies different data augmentation techniques.
 
@@ -1,9 +1,16 @@
+import io
+import os
+import tempfile
 import tensorflow as tf
 import numpy as np
 
 from easydict import EasyDict
+from PIL import Image
 
 from luminoth.datasets.object_detection_dataset import ObjectDetectionDataset
+from luminoth.utils.dataset import (
+    to_int64, to_string, to_bytes, get_shard_filename, write_manifest
+)
 
 
 class ObjectDetectionDatasetTest(tf.test.TestCase):
@@ -87,6 +94,289 @@ class ObjectDetectionDatasetTest(tf.test.TestCase):
         self.assertAllEqual(image, image_aug)
         self.assertAllEqual(bboxes, bboxes_aug)
 
+    def _write_records(self, num_records, num_shards=None):
+        """Writes a split with `num_records` small images into a temp dir.
+
+        When `num_shards` is set, the records are split into that many files,
+        listed in the split's manifest.
+        """
+        dataset_dir = tempfile.mkdtemp()
+        if num_shards:
+            filenames = [
+                get_shard_filename('train', idx, num_shards)
+                for idx in range(num_shards)
+            ]
+        else:
+            filenames = ['train.tfrecords']
+
+        shards = []
+        records_per_shard = -(-num_records // len(filenames))
+        for shard_idx, filename in enumerate(filenames):
+            writer = tf.python_io.TFRecordWriter(
+                os.path.join(dataset_dir, filename)
+            )
+            first_record = shard_idx * records_per_shard
+            last_record = min(first_record + records_per_shard, num_records)
+            for idx in range(first_record, last_record):
+                writer.write(self._create_record(idx).SerializeToString())
+            writer.close()
+
+            shards.append({
+                'filename': filename,
+                'num_records': last_record - first_record,
+            })
+
+        if num_shards:
+            write_manifest(dataset_dir, 'train', shards)
+
+        return dataset_dir
+
+    def _create_record(self, idx):
+        image = Image.fromarray(
+            np.random.randint(0, 255, size=(40, 50, 3), dtype=np.uint8)
+        )
+        image_raw = io.BytesIO()
+        image.save(image_raw, format='PNG')
+
+        gt_box = [idx, 1, 2, 20, 30]
+        feature_lists = tf.train.FeatureLists(feature_list={
+            name: tf.train.FeatureList(feature=[to_int64(value)])
+            for name, value in zip(
+                ['label', 'xmin', 'ymin', 'xmax', 'ymax'], gt_box
+            )
+        })
+        context = tf.train.Features(feature={
+            'width': to_int64(50),
+            'height': to_int64(40),
+            'depth': to_int64(3),
+            'filename': to_string('{}.png'.format(idx)),
+            'image_raw': to_bytes(image_raw.getvalue()),
+        })
+        return tf.train.SequenceExample(
+            feature_lists=feature_lists, context=context
+        )
+
+    def _read_filenames(self, sess, train_dataset):
+        filenames = []
+        try:
+            while True:
+                filenames.append(
+                    sess.run(train_dataset['filename']).decode('utf-8')
+                )
+        except tf.errors.OutOfRangeError:
+            pass
+        return filenames
+
+    def testInputPipelines(self):
+        """
+        Tests that both input pipelines read every record, in order, for every
+        epoch.
+        """
+        self.base_config['dataset']['dir'] = self._write_records(5)
+        self.base_config['train']['num_epochs'] = 2
+        expected = ['{}.png'.format(idx) for idx in range(5)] * 2
+
+        for input_pipeline in ('tf_data', 'queue'):
+            tf.reset_default_graph()
+            self.base_config['dataset']['input_pipeline'] = input_pipeline
+
+            dataset = ObjectDetectionDataset(
+                self.base_config, num_readers=1
+            )
+            train_dataset = dataset()
+
+            with self.test_session() as sess:
+                sess.run([
+                    tf.local_variables_initializer(), dataset.initializer
+                ])
+                coord = tf.train.Coordinator()
+                threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+
+                self.assertEqual(
+                    self._read_filenames(sess, train_dataset),
+                    expected
+                )
+
+                coord.request_stop()
+                coord.join(threads)
+
+                if input_pipeline == 'tf_data':
+                    # The `tf.data` pipeline can be read again from the start.
+                    sess.run(dataset.initializer)
+                    self.assertEqual(
+                        self._read_filenames(sess, train_dataset),
+                        expected
+                    )
+
+    def testShardedInput(self):
+        """
+        Tests that sharded splits are read whole, or split among workers.
+        """
+        self.base_config['dataset']['dir'] = self._write_records(
+            10, num_shards=4
+        )
+        self.base_config['dataset']['num_parallel_reads'] = 1
+
+        def read_split(**kwargs):
+            tf.reset_default_graph()
+            dataset = ObjectDetectionDataset(self.base_config, **kwargs)
+            train_dataset = dataset()
+            with self.test_session() as sess:
+                sess.run(dataset.initializer)
+                return self._read_filenames(sess, train_dataset)
+
+        self.assertEqual(
+            read_split(), ['{}.png'.format(idx) for idx in range(10)]
+        )
+
+        # Every worker reads whole shards (3 records each, but the last).
+        self.assertEqual(
+            read_split(num_workers=2, worker_index=1),
+            ['{}.png'.format(idx) for idx in (3, 4, 5, 9)]
+        )
+
+        # With more workers than shards, every worker reads some records.
+        worker_filenames = [
+            read_split(num_workers=5, worker_index=idx) for idx in range(5)
+        ]
+        self.assertEqual(
+            sorted(sum(worker_filenames, [])),
+            sorted('{}.png'.format(idx) for idx in range(10))
+        )
+
+    def testCache(self):
+        """
+        Tests that cached images are the same as the decoded ones, for every
+        epoch.
+        """
+        self.base_config['dataset']['dir'] = self._write_records(3)
+        self.base_config['train']['num_epochs'] = 2
+
+        def read_split(cache=None):
+            tf.reset_default_graph()
+            self.base_config['dataset']['cache'] = cache
+            dataset = ObjectDetectionDataset(self.base_config)
+            train_dataset = dataset()
+            results = []
+            with self.test_session() as sess:
+                sess.run(dataset.initializer)
+                try:
+                    while True:
+                        results.append(sess.run(train_dataset))
+                except tf.errors.OutOfRangeError:
+                    pass
+            return results
+
+        expected = read_split()
+        cache_dir = tempfile.mkdtemp()
+        for cache in ('memory', cache_dir):
+            results = read_split(cache)
+            self.assertEqual(len(results), 6)
+            for result, expected_result in zip(results, expected):
+                self.assertEqual(
+                    result['filename'], expected_result['filename']
+                )
+                # Cached images (and boxes) are resized twice, when decoding
+                # and when preprocessing them, which may change some values.
+                self.assertAllClose(
+                    result['bboxes'], expected_result['bboxes'], atol=1
+                )
+                self.assertAllClose(
+                    result['scale_factor'], expected_result['scale_factor']
+                )
+                self.assertAllClose(
+                    result['image'], expected_result['image'], atol=1.
+                )
+
+        self.assertTrue(os.listdir(cache_dir))
+
+    def testCacheKey(self):
+        """
+        Tests the cache isn't reused after the records are written again.
+        """
+        dataset_dir = self._write_records(3)
+        self.base_config['dataset']['dir'] = dataset_dir
+        self.base_config['dataset']['cache'] = tempfile.mkdtemp()
+
+        dataset = ObjectDetectionDataset(self.base_config)
+        filenames = [os.path.join(dataset_dir, 'train.tfrecords')]
+        cache_filename = dataset._get_cache_filename(filenames)
+        self.assertEqual(
+            dataset._get_cache_filename(filenames), cache_filename
+        )
+
+        # Write the same filename with a different number of records.
+        new_dir = self._write_records(4)
+        tf.gfile.Rename(
+            os.path.join(new_dir, 'train.tfrecords'), filenames[0],
+            overwrite=True
+        )
+        self.assertNotEqual(
+            dataset._get_cache_filename(filenames), cache_filename
+        )
+
+    def testMemoryCacheSize(self):
+        """
+        Tests caching in memory is rejected when the resized images take
+        more than `cache_max_mb`.
+        """
+        self.base_config['dataset']['dir'] = self._write_records(3)
+        self.base_config['dataset']['cache'] = 'memory'
+
+        # Each 50x40 image is upscaled to 750x600 pixels, about 1.3 MB.
+        dataset = ObjectDetectionDataset(self.base_config)
+        filenames = [os.path.join(
+            self.base_config['dataset']['dir'], 'train.tfrecords'
+        )]
+        record = next(tf.python_io.tf_record_iterator(filenames[0]))
+        self.assertEqual(dataset.get_decoded_size(record), 600 * 750 * 3)
+
+        self.base_config['dataset']['cache_max_mb'] = 2
+        with self.assertRaises(ValueError):
+            ObjectDetectionDataset(self.base_config)()
+
+        self.base_config['dataset']['cache_max_mb'] = 4
+        ObjectDetectionDataset(self.base_config)()
+
+    def testBatch(self):
+        """
+        Tests that images are read in batches, dropping the incomplete one.
+        """
+        self.base_config['dataset']['dir'] = self._write_records(5)
+        self.base_config['train']['batch_size'] = 2
+
+        dataset = ObjectDetectionDataset(self.base_config)
+        train_dataset = dataset()
+        self.assertEqual(train_dataset['image'].shape[0], 2)
+
+        batches = []
+        with self.test_session() as sess:
+            sess.run(dataset.initializer)
+            try:
+                while True:
+                    batches.append(sess.run(train_dataset))
+            except tf.errors.OutOfRangeError:
+                pass
+
+        self.assertEqual(len(batches), 2)
+        for batch in batches:
+            self.assertEqual(batch['image'].shape, (2, 600, 750, 3))
+            self.assertAllEqual(batch['image_shape'], [[600, 750]] * 2)
+            self.assertEqual(batch['bboxes'].shape, (2, 1, 5))
+
+        self.assertEqual(
+            sorted(
+                filename.decode('utf-8')
+                for batch in batches for filename in batch['filename']
+            ),
+            ['{}.png'.format(idx) for idx in range(4)]
+        )
+
+    def testInvalidInputPipeline(self):
+        self.base_config['dataset']['input_pipeline'] = 'invalid'
+        with self.assertRaises(ValueError):
+            ObjectDetectionDataset(self.base_config)
+
 
 if __name__ == '__main__':
     tf.test.main()
@@ -9,7 +9,18 @@ from luminoth.datasets import get_dataset
 from luminoth.models import get_model
 from luminoth.utils.bbox_overlap import bbox_overlap
 from luminoth.utils.config import get_config
-from luminoth.utils.image_vis import image_vis_summaries
+from luminoth.utils.dataset import get_split_files, read_manifest
+from luminoth.utils.image_vis import ImageVisWorker
+
+
+# IoU thresholds used for matching detections: [0.50, 0.55, ..., 0.95].
+IOU_THRESHOLDS = np.linspace(
+    0.50, 0.95, int(np.round((0.95 - 0.50) / 0.05)) + 1
+)
+# 101 recall levels, same as COCO evaluation.
+RECALL_THRESHOLDS = np.linspace(
+    0.00, 1.00, int(np.round((1.00 - 0.00) / 0.01)) + 1
+)
 
 
 @click.command(help='Evaluate trained (or training) models')
@@ -54,6 +65,9 @@ def eval(dataset_split, config_files, watch, from_global_step, override_params,
     # Disable data augmentation.
     config.dataset.data_augmentation = []
 
+    # Images are evaluated one at a time.
+    config.train.batch_size = 1
+
     # Attempt to get class names, if available.
     classes_file = os.path.join(config.dataset.dir, 'classes.json')
     if tf.gfile.Exists(classes_file):
@@ -78,8 +92,18 @@ def eval(dataset_split, config_files, watch, from_global_step, override_params,
             "Model type '{}' not supported".format(config.model.type)
         )
 
-    # Only a single run over the dataset to calculate metrics.
-    config.train.num_epochs = 1
+    # The `tf.data` pipeline can be restarted for every checkpoint, while the
+    # queue-based one can't once it reaches the end of the dataset.
+    restart_input = config.dataset.get('input_pipeline') != 'queue'
+
+    if watch and not restart_input:
+        # Keep the input pipeline going over the dataset indefinitely and in
+        # order, so the same session can be used for every checkpoint.
+        config.train.num_epochs = None
+        config.train.random_shuffle = False
+    else:
+        # Only a single run over the dataset to calculate metrics.
+        config.train.num_epochs = 1
 
     # Seed setup.
     if config.train.seed:
@@ -89,9 +113,14 @@ def eval(dataset_split, config_files, watch, from_global_step, override_params,
     config.model.base_network.trainable = False
 
     model_class = get_model(config.model.type)
-    model = model_class(config)
+    model = model_class(config, with_summaries=False)
     dataset_class = get_dataset(config.dataset.type)
-    dataset = dataset_class(config)
+    if watch and not restart_input:
+        # A single reader thread keeps the records in order, so consecutive
+        # passes over the dataset don't get mixed.
+        dataset = dataset_class(config, num_readers=1)
+    else:
+        dataset = dataset_class(config)
     train_dataset = dataset()
 
     train_image = train_dataset['image']
@@ -133,10 +162,19 @@ def eval(dataset_split, config_files, watch, from_global_step, override_params,
         losses[full_loss_name] = loss_mean
 
     metric_ops = tf.get_collection('metric_ops')
+    # Resets the streaming means and restarts the input, so they can be
+    # reused for each checkpoint.
+    reset_op = tf.group(
+        tf.variables_initializer(
+            tf.get_collection(tf.GraphKeys.METRIC_VARIABLES)
+        ),
+        dataset.initializer
+    )
 
     init_op = tf.group(
         tf.global_variables_initializer(),
-        tf.local_variables_initializer()
+        tf.local_variables_initializer(),
+        dataset.initializer
     )
 
     # Using a global saver instead of the one for the model.
@@ -145,6 +183,7 @@ def eval(dataset_split, config_files, watch, from_global_step, override_params,
     # Aggregate the required ops to evaluate into a dict.
     ops = {
         'init_op': init_op,
+        'reset_op': reset_op,
         'metric_ops': metric_ops,
         'pred_objects': pred_objects,
         'pred_objects_classes': pred_objects_classes,
@@ -164,6 +203,47 @@ def eval(dataset_split, config_files, watch, from_global_step, override_params,
 
     files_to_visualize = {}
 
+    evaluator = None
+    if watch and restart_input:
+        evaluator = PersistentEvaluator(saver, ops)
+    elif watch:
+        # Count the examples in the split, as the input never runs out.
+        manifest = read_manifest(config.dataset.dir, dataset_split)
+        if manifest is not None:
+            num_examples = manifest['num_records']
+        else:
+            num_examples = sum(
+                1
+                for split_file in get_split_files(
+                    config.dataset.dir, dataset_split
+                )
+                for _ in tf.python_io.tf_record_iterator(split_file)
+            )
+        evaluator = PersistentEvaluator(saver, ops, num_examples)
+
+    try:
+        watch_checkpoints(
+            config, writer, saver, ops, run_dir, from_global_step, watch,
+            evaluator=evaluator,
+            class_labels=class_labels,
+            metrics_scope=metrics_scope,
+            image_vis=config.eval.image_vis,
+            files_per_class=files_per_class,
+            files_to_visualize=files_to_visualize,
+        )
+    finally:
+        if evaluator is not None:
+            evaluator.close()
+
+
+def watch_checkpoints(config, writer, saver, ops, run_dir, from_global_step,
+                      watch, evaluator=None, **kwargs):
+    """Evaluate the checkpoints in `run_dir` as they become available.
+
+    Uses `evaluator` to evaluate each checkpoint when given, or a new session
+    for each one (see `evaluate_once`) otherwise. Extra keyword arguments are
+    passed on to the evaluation.
+    """
     last_global_step = from_global_step
     while True:
         # Get the checkpoint files to evaluate.
@@ -190,18 +270,20 @@ def eval(dataset_split, config_files, watch, from_global_step, override_params,
             )
             try:
                 start = time.time()
-                evaluate_once(
-                    config, writer, saver, ops, checkpoint,
-                    class_labels=class_labels,
-                    metrics_scope=metrics_scope,
-                    image_vis=config.eval.image_vis,
-                    files_per_class=files_per_class,
-                    files_to_visualize=files_to_visualize,
-                )
+                if evaluator is not None:
+                    cycle = 'warm' if evaluator.is_warm else 'cold'
+                    evaluator.evaluate(config, writer, checkpoint, **kwargs)
+                    tf.logging.info('Evaluated in {:.2f}s ({} cycle)'.format(
+                        time.time() - start, cycle
+                    ))
+                else:
+                    evaluate_once(
+                        config, writer, saver, ops, checkpoint, **kwargs
+                    )
+                    tf.logging.info('Evaluated in {:.2f}s'.format(
+                        time.time() - start
+                    ))
                 last_global_step = checkpoint['global_step']
-                tf.logging.info('Evaluated in {:.2f}s'.format(
-                    time.time() - start
-                ))
             except tf.errors.NotFoundError:
                 # The checkpoint is not ready yet. It was written in the
                 # checkpoints file, but it still hasn't been completely saved.
@@ -300,15 +382,6 @@ def evaluate_once(config, writer, saver, ops, checkpoint,
         checkpoint (dict): Checkpoint-related data.
             Expects the following keys: ``global_step``, ``file``.
     """
-    # Output of the detector, per batch.
-    output_per_batch = {
-        'bboxes': [],  # Bounding boxes detected.
-        'classes': [],  # Class associated to each bounding box.
-        'scores': [],  # Score for each detection.
-        'gt_bboxes': [],  # Ground-truth bounding boxes for the batch.
-        'gt_classes': [],  # Ground-truth classes for each bounding box.
-    }
-
     with tf.Session() as sess:
         sess.run(ops['init_op'])
         saver.restore(sess, checkpoint['file'])
@@ -316,172 +389,300 @@ def evaluate_once(config, writer, saver, ops, checkpoint,
         coord = tf.train.Coordinator()
         threads = tf.train.start_queue_runners(sess=sess, coord=coord)
 
-        total_evaluated = 0
-        start_time = time.time()
-
         try:
-            track_start = start_time
-            track_count = 0
-            while not coord.should_stop():
-                fetches = {
-                    'metric_ops': ops['metric_ops'],
-                    'bboxes': ops['pred_objects'],
-                    'classes': ops['pred_objects_classes'],
-                    'scores': ops['pred_objects_scores'],
-                    'gt_bboxes': ops['train_objects'],
-                    'losses': ops['losses'],
-                    'filename': ops['filename'],
-                }
-                if image_vis is not None:
-                    fetches['prediction_dict'] = ops['prediction_dict']
-                    fetches['train_image'] = ops['train_image']
-
-                batch_fetched = sess.run(fetches)
-                output_per_batch['bboxes'].append(batch_fetched.get('bboxes'))
-                output_per_batch['classes'].append(batch_fetched['classes'])
-                output_per_batch['scores'].append(batch_fetched['scores'])
-
-                batch_gt_objects = batch_fetched['gt_bboxes']
-                output_per_batch['gt_bboxes'].append(batch_gt_objects[:, :4])
-                batch_gt_classes = batch_gt_objects[:, 4]
-                output_per_batch['gt_classes'].append(batch_gt_classes)
-
-                val_losses = batch_fetched['losses']
-
-                if image_vis is not None:
-                    filename = batch_fetched['filename'].decode('utf-8')
-                    visualize_file = False
-                    for gt_class in batch_gt_classes:
-                        cls_files = files_to_visualize.get(
-                            gt_class, set()
-                        )
-                        if len(cls_files) < files_per_class:
-                            files_to_visualize.setdefault(
-                                gt_class, set()
-                            ).add(filename)
-                            visualize_file = True
-                            break
-                        elif filename in cls_files:
-                            visualize_file = True
-                            break
-
-                    if visualize_file:
-                        image_summaries = image_vis_summaries(
-                            batch_fetched['prediction_dict'],
-                            config=config.model,
-                            extra_tag=filename,
-                            image_visualization_mode=image_vis,
-                            image=batch_fetched['train_image'],
-                            gt_bboxes=batch_fetched['gt_bboxes']
-                        )
-                        for image_summary in image_summaries:
-                            writer.add_summary(
-                                image_summary, checkpoint['global_step']
-                            )
-
-                total_evaluated += 1
-                track_count += 1
-
-                track_end = time.time()
-                if track_end - track_start > 20.:
-                    click.echo(
-                        '{} processed in {:.2f}s (global {:.2f} images/s, '
-                        'period {:.2f} images/s)'.format(
-                            total_evaluated, track_end - start_time,
-                            total_evaluated / (track_end - start_time),
-                            track_count / (track_end - track_start),
-                        ))
-                    track_count = 0
-                    track_start = track_end
-
-        except tf.errors.OutOfRangeError:
-
-            # Save final evaluation stats into summary under the checkpoint's
-            # global step.
-            ap_per_class, ar_per_class = calculate_metrics(
-                output_per_batch, config.model.network.num_classes
+            run_evaluation(
+                sess, coord, config, writer, ops, checkpoint,
+                class_labels=class_labels,
+                metrics_scope=metrics_scope,
+                image_vis=image_vis,
+                files_per_class=files_per_class,
+                files_to_visualize=files_to_visualize,
             )
+        finally:
+            coord.request_stop()
 
-            map_at_50 = np.mean(ap_per_class[:, 0])
-            map_at_75 = np.mean(ap_per_class[:, 5])
-            map_at_range = np.mean(ap_per_class)
-            mar_at_range = np.mean(ar_per_class)
+        # Wait for all threads to stop.
+        coord.join(threads)
 
-            tf.logging.info('Finished evaluation at step {}.'.format(
-                checkpoint['global_step']))
-            tf.logging.info('Evaluated {} images.'.format(total_evaluated))
 
-            tf.logging.info(
-                'Average Precision (AP) @ [0.50] = {:.3f}'.format(map_at_50)
-            )
-            tf.logging.info(
-                'Average Precision (AP) @ [0.75] = {:.3f}'.format(map_at_75)
-            )
-            tf.logging.info(
-                'Average Precision (AP) @ [0.50:0.95] = {:.3f}'.format(
-                    map_at_range
-                )
-            )
-            tf.logging.info(
-                'Average Recall (AR) @ [0.50:0.95] = {:.3f}'.format(
-                    mar_at_range
-                )
+def run_evaluation(sess, coord, config, writer, ops, checkpoint,
+                   class_labels, metrics_scope='metrics', image_vis=None,
+                   files_per_class=None, files_to_visualize=None,
+                   num_examples=None):
+    """Run the dataset through a session with the checkpoint restored.
+
+    Calculates the evaluation metrics and writes the corresponding summaries.
+    The input threads must have been started with `coord`.
+
+    Args:
+        sess: Session with the checkpoint's parameters restored.
+        coord: Coordinator of the input threads.
+        num_examples (int): Number of examples to evaluate. If ``None``, the
+            evaluation runs until the input is exhausted.
+
+    See `evaluate_once` for the rest of the arguments.
+    """
+    # Metrics are accumulated as the batches are evaluated, so we don't need
+    # to keep the detector's output in memory.
+    metrics = StreamingMetrics(config.model.network.num_classes)
+
+    total_evaluated = 0
+    start_time = time.time()
+    track_start = start_time
+    track_count = 0
+
+    # Images are drawn in the background while the evaluation goes on.
+    vis_worker = ImageVisWorker(writer) if image_vis is not None else None
+
+    try:
+        while not coord.should_stop():
+            if num_examples is not None and total_evaluated >= num_examples:
+                break
+
+            fetches = {
+                'metric_ops': ops['metric_ops'],
+                'bboxes': ops['pred_objects'],
+                'classes': ops['pred_objects_classes'],
+                'scores': ops['pred_objects_scores'],
+                'gt_bboxes': ops['train_objects'],
+                'losses': ops['losses'],
+                'filename': ops['filename'],
+            }
+            if image_vis is not None:
+                fetches['prediction_dict'] = ops['prediction_dict']
+                fetches['train_image'] = ops['train_image']
+
+            batch_fetched = sess.run(fetches)
+            batch_gt_objects = batch_fetched['gt_bboxes']
+            batch_gt_classes = batch_gt_objects[:, 4]
+            metrics.update(
+                batch_fetched['bboxes'], batch_fetched['classes'],
+                batch_fetched['scores'], batch_gt_objects[:, :4],
+                batch_gt_classes
             )
 
-            for idx, val in enumerate(ap_per_class[:, 0]):
-                class_label = '{} ({})'.format(
-                    class_labels[idx], idx
-                ) if class_labels else idx
-                tf.logging.debug(
-                    'Average Precision (AP) @ [0.50] for {} = {:.3f}'.format(
-                        class_label, val
+            val_losses = batch_fetched['losses']
+
+            if image_vis is not None:
+                filename = batch_fetched['filename'].decode('utf-8')
+                visualize_file = False
+                # Class the file is chosen for, when it's chosen now.
+                new_class = None
+                for gt_class in batch_gt_classes:
+                    cls_files = files_to_visualize.get(
+                        gt_class, set()
                     )
-                )
+                    if len(cls_files) < files_per_class:
+                        new_class = gt_class
+                        visualize_file = True
+                        break
+                    elif filename in cls_files:
+                        visualize_file = True
+                        break
+
+                if visualize_file:
+                    # Only a few files are visualized, so wait for them to be
+                    # queued instead of dropping them.
+                    queued = vis_worker.submit(
+                        checkpoint['global_step'],
+                        batch_fetched['prediction_dict'],
+                        block=True,
+                        config=config.model,
+                        extra_tag=filename,
+                        image_visualization_mode=image_vis,
+                        image=batch_fetched['train_image'],
+                        gt_bboxes=batch_fetched['gt_bboxes']
+                    )
+                    if queued and new_class is not None:
+                        files_to_visualize.setdefault(
+                            new_class, set()
+                        ).add(filename)
+
+            total_evaluated += 1
+            track_count += 1
+
+            track_end = time.time()
+            if track_end - track_start > 20.:
+                running_ap, _ = metrics.get_metrics()
+                click.echo(
+                    '{} processed in {:.2f}s (global {:.2f} images/s, '
+                    'period {:.2f} images/s, running AP@0.50 '
+                    '{:.3f})'.format(
+                        total_evaluated, track_end - start_time,
+                        total_evaluated / (track_end - start_time),
+                        track_count / (track_end - track_start),
+                        np.mean(running_ap[:, 0]),
+                    ))
+                track_count = 0
+                track_start = track_end
+        else:
+            # Stopped by the coordinator (because of an error in the input
+            # threads), so there are no metrics to report.
+            return
+    except tf.errors.OutOfRangeError:
+        if num_examples is not None:
+            raise
+    finally:
+        if vis_worker is not None:
+            vis_worker.close()
+
+    # Save final evaluation stats into summary under the checkpoint's
+    # global step.
+    ap_per_class, ar_per_class = metrics.get_metrics()
+
+    map_at_50 = np.mean(ap_per_class[:, 0])
+    map_at_75 = np.mean(ap_per_class[:, 5])
+    map_at_range = np.mean(ap_per_class)
+    mar_at_range = np.mean(ar_per_class)
+
+    tf.logging.info('Finished evaluation at step {}.'.format(
+        checkpoint['global_step']))
+    tf.logging.info('Evaluated {} images.'.format(total_evaluated))
+
+    tf.logging.info(
+        'Average Precision (AP) @ [0.50] = {:.3f}'.format(map_at_50)
+    )
+    tf.logging.info(
+        'Average Precision (AP) @ [0.75] = {:.3f}'.format(map_at_75)
+    )
+    tf.logging.info(
+        'Average Precision (AP) @ [0.50:0.95] = {:.3f}'.format(
+            map_at_range
+        )
+    )
+    tf.logging.info(
+        'Average Recall (AR) @ [0.50:0.95] = {:.3f}'.format(
+            mar_at_range
+        )
+    )
 
-            summary = [
-                tf.Summary.Value(
-                    tag='{}/AP@0.50'.format(metrics_scope),
-                    simple_value=map_at_50
-                ),
-                tf.Summary.Value(
-                    tag='{}/AP@0.75'.format(metrics_scope),
-                    simple_value=map_at_75
-                ),
-                tf.Summary.Value(
-                    tag='{}/AP@[0.50:0.95]'.format(metrics_scope),
-                    simple_value=map_at_range
-                ),
-                tf.Summary.Value(
-                    tag='{}/AR@[0.50:0.95]'.format(metrics_scope),
-                    simple_value=mar_at_range
-                ),
-                tf.Summary.Value(
-                    tag='{}/total_evaluated'.format(metrics_scope),
-                    simple_value=total_evaluated
-                ),
-                tf.Summary.Value(
-                    tag='{}/evaluation_time'.format(metrics_scope),
-                    simple_value=time.time() - start_time
-                ),
-            ]
-
-            for loss_name, loss_value in val_losses.items():
-                tf.logging.debug('{} loss = {:.4f}'.format(
-                    loss_name, loss_value))
-                summary.append(tf.Summary.Value(
-                    tag=loss_name,
-                    simple_value=loss_value
-                ))
-
-            writer.add_summary(
-                tf.Summary(value=summary), checkpoint['global_step']
+    for idx, val in enumerate(ap_per_class[:, 0]):
+        class_label = '{} ({})'.format(
+            class_labels[idx], idx
+        ) if class_labels else idx
+        tf.logging.debug(
+            'Average Precision (AP) @ [0.50] for {} = {:.3f}'.format(
+                class_label, val
             )
+        )
 
-        finally:
-            coord.request_stop()
+    summary = [
+        tf.Summary.Value(
+            tag='{}/AP@0.50'.format(metrics_scope),
+            simple_value=map_at_50
+        ),
+        tf.Summary.Value(
+            tag='{}/AP@0.75'.format(metrics_scope),
+            simple_value=map_at_75
+        ),
+        tf.Summary.Value(
+            tag='{}/AP@[0.50:0.95]'.format(metrics_scope),
+            simple_value=map_at_range
+        ),
+        tf.Summary.Value(
+            tag='{}/AR@[0.50:0.95]'.format(metrics_scope),
+            simple_value=mar_at_range
+        ),
+        tf.Summary.Value(
+            tag='{}/total_evaluated'.format(metrics_scope),
+            simple_value=total_evaluated
+        ),
+        tf.Summary.Value(
+            tag='{}/evaluation_time'.format(metrics_scope),
+            simple_value=time.time() - start_time
+        ),
+    ]
+
+    for loss_name, loss_value in val_losses.items():
+        tf.logging.debug('{} loss = {:.4f}'.format(
+            loss_name, loss_value))
+        summary.append(tf.Summary.Value(
+            tag=loss_name,
+            simple_value=loss_value
+        ))
+
+    writer.add_summary(
+        tf.Summary(value=summary), checkpoint['global_step']
+    )
 
-        # Wait for all threads to stop.
-        coord.join(threads)
+
+class PersistentEvaluator(object):
+    """Evaluates checkpoints one after the other using a single session.
+
+    Creating the session, initializing the graph and starting the input
+    threads is only done for the first checkpoint (the *cold* cycle). For the
+    following ones, only the model's variables are restored and the streaming
+    means and the input pipeline are reset.
+
+    When the input pipeline can't be restarted (as with queue runners), it
+    must go over the dataset indefinitely and in order instead, so every
+    `num_examples` consecutive examples make up exactly one pass over the
+    dataset.
+    """
+
+    def __init__(self, saver, ops, num_examples=None):
+        """
+        Args:
+            saver: Saver object to restore checkpoint parameters.
+            ops (dict): All the operations needed to run the model, as for
+                `evaluate_once`, plus ``reset_op``.
+            num_examples (int): Number of examples in the dataset, when the
+                input pipeline can't be restarted. If ``None``, each
+                evaluation runs until the input is exhausted.
+        """
+        self._saver = saver
+        self._ops = ops
+        self._num_examples = num_examples
+
+        self._sess = None
+        self._coord = None
+        self._threads = None
+
+    @property
+    def is_warm(self):
+        """Whether the session and input threads are already running."""
+        return self._sess is not None
+
+    def evaluate(self, config, writer, checkpoint, **kwargs):
+        """Evaluates a checkpoint, same as `evaluate_once` does.
+
+        Extra keyword arguments are passed on to `run_evaluation`.
+        """
+        if self._sess is None:
+            start = time.time()
+            self._sess = tf.Session()
+            self._sess.run(self._ops['init_op'])
+            self._coord = tf.train.Coordinator()
+            self._threads = tf.train.start_queue_runners(
+                sess=self._sess, coord=self._coord
+            )
+            tf.logging.info('Session started in {:.2f}s'.format(
+                time.time() - start
+            ))
+
+        start = time.time()
+        self._saver.restore(self._sess, checkpoint['file'])
+        self._sess.run(self._ops['reset_op'])
+        tf.logging.info('Checkpoint restored in {:.2f}s'.format(
+            time.time() - start
+        ))
+
+        run_evaluation(
+            self._sess, self._coord, config, writer, self._ops, checkpoint,
+            num_examples=self._num_examples, **kwargs
+        )
+        # Raise any errors that happened on the input threads.
+        self._coord.raise_requested_exception()
+
+    def close(self):
+        """Stops the input threads and closes the session."""
+        if self._sess is None:
+            return
+
+        self._coord.request_stop()
+        self._coord.join(self._threads)
+        self._sess.close()
+        self._sess = None
 
 
 def calculate_metrics(output_per_batch, num_classes):
@@ -523,92 +724,55 @@ def calculate_metrics(output_per_batch, num_classes):
     .. _VOC mAP metric:
         http://host.robots.ox.ac.uk/pascal/VOC/pubs/everingham10.pdf
     """
-    iou_thresholds = np.linspace(
-        0.50, 0.95, np.round((0.95 - 0.50) / 0.05) + 1
-    )
-    # 101 recall levels, same as COCO evaluation.
-    rec_thresholds = np.linspace(
-        0.00, 1.00, np.round((1.00 - 0.00) / 0.01) + 1
-    )
-
-    # List; first by class, then by example. Each entry is a tuple of ndarrays
-    # of size (D_{c,i},), for tp/fp labels and for score, where D_{c,i} is the
-    # number of detected boxes for class `c` on image `i`.
-    tp_fp_labels_by_class = [[] for _ in range(num_classes)]
-    num_examples_per_class = [0 for _ in range(num_classes)]
+    iou_thresholds = IOU_THRESHOLDS
+    rec_thresholds = RECALL_THRESHOLDS
 
     # For each image, order predictions by score and classify each as a true
-    # positive or a false positive.
+    # positive or a false positive, for every IoU threshold at once.
+    all_classes = []
+    all_labels = []
+    all_scores = []
+    num_examples_per_class = np.zeros(num_classes, dtype=np.int64)
+
     num_batches = len(output_per_batch['bboxes'])
     for idx in range(num_batches):
-
-        # Get the results of the batch.
-        classes = output_per_batch['classes'][idx]  # (D_{c,i},)
-        bboxes = output_per_batch['bboxes'][idx]  # (D_{c,i}, 4)
-        scores = output_per_batch['scores'][idx]  # (D_{c,i},)
-
         gt_classes = output_per_batch['gt_classes'][idx]
-        gt_bboxes = output_per_batch['gt_bboxes'][idx]
-
-        # Analysis must be made per-class.
-        for cls in range(num_classes):
-            # Get the bounding boxes of `cls` only.
-            cls_bboxes = bboxes[classes == cls, :]
-            cls_scores = scores[classes == cls]
-            cls_gt_bboxes = gt_bboxes[gt_classes == cls, :]
-
-            num_gt = cls_gt_bboxes.shape[0]
-            num_examples_per_class[cls] += num_gt
-
-            # Sort by score descending, so we prioritize higher-confidence
-            # results when matching.
-            sorted_indices = np.argsort(-cls_scores)
-
-            # Whether the ground-truth has been previously detected.
-            is_detected = np.zeros((num_gt, len(iou_thresholds)))
-
-            # TP/FP labels for detected bboxes of (class, image).
-            tp_fp_labels = np.zeros((len(sorted_indices), len(iou_thresholds)))
-
-            if num_gt == 0:
-                # If no ground truth examples for class, all predictions must
-                # be false positives.
-                tp_fp_labels_by_class[cls].append(
-                    (tp_fp_labels, cls_scores[sorted_indices])
-                )
-                continue
-
-            # Get the IoUs for the class' bboxes.
-            ious = bbox_overlap(cls_bboxes, cls_gt_bboxes)
-
-            # Greedily assign bboxes to ground truths (highest score first).
-            for bbox_idx in sorted_indices:
-                gt_match = np.argmax(ious[bbox_idx, :])
-                # TODO: Try to vectorize.
-                for iou_idx, iou_threshold in enumerate(iou_thresholds):
-                    if ious[bbox_idx, gt_match] >= iou_threshold:
-                        # Over IoU threshold.
-                        if not is_detected[gt_match, iou_idx]:
-                            # And first detection: it's a true positive.
-                            tp_fp_labels[bbox_idx, iou_idx] = True
-                            is_detected[gt_match, iou_idx] = True
-
-            tp_fp_labels_by_class[cls].append(
-                (tp_fp_labels, cls_scores[sorted_indices])
-            )
+        num_examples_per_class += np.bincount(
+            gt_classes.astype(np.int64), minlength=num_classes
+        )[:num_classes]
+
+        classes, tp_fp_labels, scores = match_detections(
+            output_per_batch['bboxes'][idx],
+            output_per_batch['classes'][idx],
+            output_per_batch['scores'][idx],
+            output_per_batch['gt_bboxes'][idx],
+            gt_classes,
+            iou_thresholds,
+        )
+        all_classes.append(classes)
+        all_labels.append(tp_fp_labels)
+        all_scores.append(scores)
+
+    all_classes = np.concatenate(all_classes)
+    all_labels = np.concatenate(all_labels)
+    all_scores = np.concatenate(all_scores)
+
+    # Group the results by class, keeping the order of the images and, for
+    # each image, the descending score order.
+    class_order = np.argsort(all_classes, kind='mergesort')
+    all_classes = all_classes[class_order]
+    all_labels = all_labels[class_order]
+    all_scores = all_scores[class_order]
+    class_bounds = np.searchsorted(all_classes, np.arange(num_classes + 1))
 
     # Calculate average precision per class.
     ap_per_class = np.zeros((num_classes, len(iou_thresholds)))
     ar_per_class = np.zeros((num_classes, len(iou_thresholds)))
     for cls in range(num_classes):
-        tp_fp_labels = tp_fp_labels_by_class[cls]
+        labels = all_labels[class_bounds[cls]:class_bounds[cls + 1]]
+        scores = all_scores[class_bounds[cls]:class_bounds[cls + 1]]
         num_examples = num_examples_per_class[cls]
 
-        # Flatten the tp/fp labels into a single ndarray.
-        labels, scores = zip(*tp_fp_labels)
-        labels = np.concatenate(labels)
-        scores = np.concatenate(scores)
-
         # Sort the tp/fp labels by decreasing confidence score and calculate
         # precision and recall at every position of this ranked output.
         sorted_indices = np.argsort(-scores)
@@ -624,33 +788,271 @@ def calculate_metrics(output_per_batch, num_classes):
             cum_true_positives + cum_false_positives
         )
 
-        # Find AP by integrating over PR curve, with interpolated precision.
-        for iou_idx in range(len(iou_thresholds)):
-            p = precision[:, iou_idx]
-            r = recall[:, iou_idx]
+        ap_per_class[cls], ar_per_class[cls] = integrate_pr_curve(
+            precision, recall, rec_thresholds
+        )
+
+    return ap_per_class, ar_per_class
 
-            # Interpolate the precision. (Make it monotonically-increasing.)
-            for i in range(len(p) - 1, 0, -1):
-                if p[i] > p[i-1]:
-                    p[i-1] = p[i]
 
-            ap = 0
-            inds = np.searchsorted(r, rec_thresholds)
-            for ridx, pidx in enumerate(inds):
-                if pidx >= len(r):
-                    # Out of bounds, no recall higher than threshold for any of
-                    # the remaining thresholds (as they're ordered).
-                    break
+def match_detections(bboxes, classes, scores, gt_bboxes, gt_classes,
+                     iou_thresholds):
+    """Greedily matches the detections of an image to its ground truth.
 
-                ap += p[pidx] / len(rec_thresholds)
+    Detections are ranked by decreasing score within each class, and each one
+    is matched to the ground truth box of the same class it overlaps the most.
+    It's a true positive for every IoU threshold it reaches, unless a
+    higher-ranked detection was already matched to that ground truth box for
+    that threshold.
 
-            ap_per_class[cls, iou_idx] = ap
-            if len(r):
-                ar_per_class[cls, iou_idx] = r[-1]
-            else:
-                ar_per_class[cls, iou_idx] = 0
+    Every class and IoU threshold is handled at once, without Python loops.
 
-    return ap_per_class, ar_per_class
+    Args:
+        bboxes (np.ndarray): Detected boxes, of shape (D, 4).
+        classes (np.ndarray): Class of each detection, of shape (D,).
+        scores (np.ndarray): Score of each detection, of shape (D,).
+        gt_bboxes (np.ndarray): Ground truth boxes, of shape (G, 4).
+        gt_classes (np.ndarray): Class of each ground truth box, of shape
+            (G,).
+        iou_thresholds (np.ndarray): IoU thresholds, of shape (T,).
+
+    Returns:
+        (``np.ndarray``, ``np.ndarray``, ``np.ndarray``) tuple with the
+        classes, the tp/fp labels (of shape (D, T)) and the scores of the
+        detections, sorted by class and then by decreasing score.
+    """
+    # Sort by class and then by score descending, so we prioritize
+    # higher-confidence results when matching.
+    order = np.lexsort((-scores, classes))
+    bboxes = bboxes[order]
+    classes = classes[order]
+    scores = scores[order]
+
+    num_detections = len(order)
+    tp_fp_labels = np.zeros((num_detections, len(iou_thresholds)))
+    if num_detections == 0 or len(gt_classes) == 0:
+        # If no ground truth examples, all predictions must be false
+        # positives.
+        return classes, tp_fp_labels, scores
+
+    # Get the IoUs against the ground truth boxes of the same class only.
+    ious = bbox_overlap(bboxes, gt_bboxes)
+    ious[classes[:, np.newaxis] != gt_classes[np.newaxis, :]] = -1.
+
+    gt_match = np.argmax(ious, axis=1)
+    max_ious = ious[np.arange(num_detections), gt_match]
+
+    # Whether each detection is over each of the IoU thresholds.
+    over_threshold = (
+        max_ious[:, np.newaxis] >= iou_thresholds[np.newaxis, :]
+    )
+
+    # For each ground truth box and IoU threshold, find the first (i.e. the
+    # highest-ranked) detection matched to it; that one's the true positive.
+    first_detection = np.full(
+        (len(gt_classes), len(iou_thresholds)), num_detections
+    )
+    det_idx, iou_idx = np.nonzero(over_threshold)
+    np.minimum.at(first_detection, (gt_match[det_idx], iou_idx), det_idx)
+
+    is_first = (
+        first_detection[gt_match, :] ==
+        np.arange(num_detections)[:, np.newaxis]
+    )
+    tp_fp_labels[np.logical_and(over_threshold, is_first)] = True
+
+    return classes, tp_fp_labels, scores
+
+
+def integrate_pr_curve(precision, recall, rec_thresholds):
+    """Integrates the interpolated PR curve for every IoU threshold at once.
+
+    Args:
+        precision (np.ndarray): Precision at every position of the ranked
+            output, of shape (D, T).
+        recall (np.ndarray): Recall at every position of the ranked output,
+            of shape (D, T).
+        rec_thresholds (np.ndarray): Recall levels to integrate over.
+
+    Returns:
+        (``np.ndarray``, ``np.ndarray``) tuple, each of shape (T,), with the
+        average precision and the average recall.
+    """
+    num_thresholds = precision.shape[1]
+    if not len(precision):
+        return np.zeros(num_thresholds), np.zeros(num_thresholds)
+
+    # Interpolate the precision. (Make it monotonically-decreasing.)
+    precision = np.maximum.accumulate(precision[::-1], axis=0)[::-1]
+
+    ap = np.zeros(num_thresholds)
+    for iou_idx in range(num_thresholds):
+        # Positions of the first recall over each recall level. Levels out of
+        # bounds have no recall higher than them, so they don't contribute.
+        inds = np.searchsorted(recall[:, iou_idx], rec_thresholds)
+        inds = inds[inds < len(precision)]
+        if len(inds):
+            # Accumulate sequentially (as opposed to `np.sum`'s pairwise
+            # summation), so results are the same as adding term by term.
+            ap[iou_idx] = np.cumsum(
+                precision[inds, iou_idx] / len(rec_thresholds)
+            )[-1]
+
+    return ap, recall[-1]
+
+
+class StreamingMetrics(object):
+    """Accumulates the mAP and mAR of the detector's output incrementally.
+
+    Instead of keeping every detection until the end of the evaluation (as
+    `calculate_metrics` requires), the detections of each image are matched
+    to its ground truth as they arrive, and only the per-class counts of true
+    positives and detections are kept, bucketed in a fixed number of score
+    bins. Memory usage is therefore constant, regardless of the size of the
+    dataset.
+
+    The PR curve is evaluated at the boundaries of the score bins, so results
+    are an approximation of the exact ones, which gets better as the number of
+    bins increases. Detections scores are expected to lie in ``[0, 1]``.
+
+    Accumulators with the same parameters (for instance, for different shards
+    of a dataset) can be combined with `merge`.
+    """
+
+    def __init__(self, num_classes, num_bins=1000,
+                 iou_thresholds=IOU_THRESHOLDS,
+                 rec_thresholds=RECALL_THRESHOLDS):
+        """
+        Args:
+            num_classes (int): Number of classes on the dataset.
+            num_bins (int): Number of score bins to bucket detections into.
+            iou_thresholds (np.ndarray): IoU thresholds to match detections
+                with.
+            rec_thresholds (np.ndarray): Recall levels to integrate the PR
+                curve over.
+        """
+        self.num_classes = num_classes
+        self.num_bins = num_bins
+        self.iou_thresholds = iou_thresholds
+        self.rec_thresholds = rec_thresholds
+
+        self.num_images = 0
+        self.num_examples = np.zeros(num_classes, dtype=np.int64)
+        # Number of detections and true positives (per IoU threshold), for
+        # each class and score bin.
+        self.num_detections = np.zeros(
+            (num_classes, num_bins), dtype=np.int64
+        )
+        self.true_positives = np.zeros(
+            (num_classes, num_bins, len(iou_thresholds)), dtype=np.int64
+        )
+
+    def update(self, bboxes, classes, scores, gt_bboxes, gt_classes):
+        """Adds the detections of an image to the accumulated counts.
+
+        Args:
+            bboxes (np.ndarray): Detected boxes, of shape (D, 4).
+            classes (np.ndarray): Class of each detection, of shape (D,).
+            scores (np.ndarray): Score of each detection, of shape (D,).
+            gt_bboxes (np.ndarray): Ground truth boxes, of shape (G, 4).
+            gt_classes (np.ndarray): Class of each ground truth box, of shape
+                (G,).
+        """
+        self.num_images += 1
+        self.num_examples += np.bincount(
+            gt_classes.astype(np.int64), minlength=self.num_classes
+        )[:self.num_classes]
+
+        classes, tp_fp_labels, scores = match_detections(
+            bboxes, classes, scores, gt_bboxes, gt_classes,
+            self.iou_thresholds
+        )
+
+        # Ignore detections of unknown classes, same as `calculate_metrics`.
+        valid = np.logical_and(classes >= 0, classes < self.num_classes)
+        classes = classes[valid].astype(np.int64)
+        tp_fp_labels = tp_fp_labels[valid]
+        scores = scores[valid]
+
+        bins = np.clip(
+            (scores * self.num_bins).astype(np.int64), 0, self.num_bins - 1
+        )
+        cells = classes * self.num_bins + bins
+
+        num_cells = self.num_classes * self.num_bins
+        self.num_detections += np.bincount(
+            cells, minlength=num_cells
+        ).reshape(self.num_detections.shape)
+
+        num_thresholds = len(self.iou_thresholds)
+        threshold_cells = (
+            cells[:, np.newaxis] * num_thresholds +
+            np.arange(num_thresholds)[np.newaxis, :]
+        )
+        self.true_positives += np.bincount(
+            threshold_cells.ravel(), weights=tp_fp_labels.ravel(),
+            minlength=num_cells * num_thresholds
+        ).astype(np.int64).reshape(self.true_positives.shape)
+
+    def merge(self, other):
+        """Adds the counts accumulated by another `StreamingMetrics`.
+
+        Args:
+            other (StreamingMetrics): Accumulator to merge, with the same
+                number of classes, score bins and thresholds.
+
+        Raises:
+            ValueError: If the accumulators are not compatible.
+        """
+        if (
+            self.num_classes != other.num_classes or
+            self.num_bins != other.num_bins or
+            not np.array_equal(self.iou_thresholds, other.iou_thresholds) or
+            not np.array_equal(self.rec_thresholds, other.rec_thresholds)
+        ):
+            raise ValueError(
+                'Can\'t merge metrics with different classes, score bins or '
+                'thresholds.'
+            )
+
+        self.num_images += other.num_images
+        self.num_examples += other.num_examples
+        self.num_detections += other.num_detections
+        self.true_positives += other.true_positives
+
+    def get_metrics(self):
+        """Calculates the mAP and mAR of the images seen so far.
+
+        Returns:
+            (``np.ndarray``, ``ndarray``) tuple, same as `calculate_metrics`.
+        """
+        num_thresholds = len(self.iou_thresholds)
+        ap_per_class = np.zeros((self.num_classes, num_thresholds))
+        ar_per_class = np.zeros((self.num_classes, num_thresholds))
+        for cls in range(self.num_classes):
+            # Go through the score bins in decreasing order, skipping the
+            # empty ones, as each bin is a point in the ranked output.
+            num_detections = self.num_detections[cls, ::-1]
+            non_empty = num_detections > 0
+            num_detections = num_detections[non_empty]
+            true_positives = self.true_positives[cls, ::-1][non_empty]
+
+            cum_detections = np.cumsum(num_detections)
+            cum_true_positives = np.cumsum(true_positives, axis=0)
+
+            recall = (
+                cum_true_positives.astype(float) / self.num_examples[cls]
+            )
+            precision = (
+                cum_true_positives.astype(float) /
+                cum_detections[:, np.newaxis]
+            )
+
+            ap_per_class[cls], ar_per_class[cls] = integrate_pr_curve(
+                precision, recall, self.rec_thresholds
+            )
+
+        return ap_per_class, ar_per_class
 
 
 if __name__ == '__main__':
@@ -0,0 +1,288 @@
+import numpy as np
+import tensorflow as tf
+import time
+
+from luminoth.eval import StreamingMetrics, calculate_metrics
+from luminoth.utils.bbox_overlap import bbox_overlap
+from luminoth.utils.test.gt_boxes import generate_gt_boxes
+
+
+def calculate_metrics_loop(output_per_batch, num_classes):
+    """Reference (non-vectorized) implementation of `calculate_metrics`."""
+    iou_thresholds = np.linspace(
+        0.50, 0.95, int(np.round((0.95 - 0.50) / 0.05)) + 1
+    )
+    rec_thresholds = np.linspace(
+        0.00, 1.00, int(np.round((1.00 - 0.00) / 0.01)) + 1
+    )
+
+    tp_fp_labels_by_class = [[] for _ in range(num_classes)]
+    num_examples_per_class = [0 for _ in range(num_classes)]
+
+    num_batches = len(output_per_batch['bboxes'])
+    for idx in range(num_batches):
+        classes = output_per_batch['classes'][idx]
+        bboxes = output_per_batch['bboxes'][idx]
+        scores = output_per_batch['scores'][idx]
+
+        gt_classes = output_per_batch['gt_classes'][idx]
+        gt_bboxes = output_per_batch['gt_bboxes'][idx]
+
+        for cls in range(num_classes):
+            cls_bboxes = bboxes[classes == cls, :]
+            cls_scores = scores[classes == cls]
+            cls_gt_bboxes = gt_bboxes[gt_classes == cls, :]
+
+            num_gt = cls_gt_bboxes.shape[0]
+            num_examples_per_class[cls] += num_gt
+
+            sorted_indices = np.argsort(-cls_scores)
+
+            is_detected = np.zeros((num_gt, len(iou_thresholds)))
+            tp_fp_labels = np.zeros((len(sorted_indices), len(iou_thresholds)))
+
+            if num_gt == 0:
+                tp_fp_labels_by_class[cls].append(
+                    (tp_fp_labels, cls_scores[sorted_indices])
+                )
+                continue
+
+            ious = bbox_overlap(cls_bboxes, cls_gt_bboxes)
+
+            for bbox_idx in sorted_indices:
+                gt_match = np.argmax(ious[bbox_idx, :])
+                for iou_idx, iou_threshold in enumerate(iou_thresholds):
+                    if ious[bbox_idx, gt_match] >= iou_threshold:
+                        if not is_detected[gt_match, iou_idx]:
+                            tp_fp_labels[bbox_idx, iou_idx] = True
+                            is_detected[gt_match, iou_idx] = True
+
+            tp_fp_labels_by_class[cls].append(
+                (tp_fp_labels, cls_scores[sorted_indices])
+            )
+
+    ap_per_class = np.zeros((num_classes, len(iou_thresholds)))
+    ar_per_class = np.zeros((num_classes, len(iou_thresholds)))
+    for cls in range(num_classes):
+        tp_fp_labels = tp_fp_labels_by_class[cls]
+        num_examples = num_examples_per_class[cls]
+
+        labels, scores = zip(*tp_fp_labels)
+        labels = np.concatenate(labels)
+        scores = np.concatenate(scores)
+
+        sorted_indices = np.argsort(-scores)
+        true_positives = labels[sorted_indices, :]
+        false_positives = 1 - true_positives
+
+        cum_true_positives = np.cumsum(true_positives, axis=0)
+        cum_false_positives = np.cumsum(false_positives, axis=0)
+
+        recall = cum_true_positives.astype(float) / num_examples
+        precision = np.divide(
+            cum_true_positives.astype(float),
+            cum_true_positives + cum_false_positives
+        )
+
+        for iou_idx in range(len(iou_thresholds)):
+            p = precision[:, iou_idx]
+            r = recall[:, iou_idx]
+
+            for i in range(len(p) - 1, 0, -1):
+                if p[i] > p[i-1]:
+                    p[i-1] = p[i]
+
+            ap = 0
+            inds = np.searchsorted(r, rec_thresholds)
+            for ridx, pidx in enumerate(inds):
+                if pidx >= len(r):
+                    break
+
+                ap += p[pidx] / len(rec_thresholds)
+
+            ap_per_class[cls, iou_idx] = ap
+            if len(r):
+                ar_per_class[cls, iou_idx] = r[-1]
+            else:
+                ar_per_class[cls, iou_idx] = 0
+
+    return ap_per_class, ar_per_class
+
+
+class CalculateMetricsTest(tf.test.TestCase):
+
+    def setUp(self):
+        # Seeded, so the tolerances of the tests hold on every run.
+        self._random = np.random.RandomState(0)
+
+    def _generate_output(self, num_images, num_classes, num_detections,
+                         max_gt_boxes=10):
+        """Generates synthetic detections, scattered around the ground truth.
+        """
+        output_per_batch = {
+            'bboxes': [], 'classes': [], 'scores': [],
+            'gt_bboxes': [], 'gt_classes': [],
+        }
+        for _ in range(num_images):
+            num_gt = self._random.randint(0, max_gt_boxes + 1)
+            gt_bboxes = generate_gt_boxes(
+                num_gt, image_size=(600, 800), random_state=self._random
+            ).astype(np.float32)
+            gt_classes = self._random.randint(num_classes, size=num_gt)
+
+            # Half of the detections are noisy copies of ground truth boxes
+            # (with either the right or a random class), the rest are random.
+            num_near = num_detections // 2 if num_gt else 0
+            near_idx = self._random.randint(max(num_gt, 1), size=num_near)
+            near_bboxes = gt_bboxes[near_idx] + self._random.normal(
+                scale=15., size=(num_near, 4)
+            )
+            near_classes = np.where(
+                self._random.uniform(size=num_near) < .8,
+                gt_classes[near_idx] if num_gt else 0,
+                self._random.randint(num_classes, size=num_near),
+            )
+            random_bboxes = generate_gt_boxes(
+                num_detections - num_near, image_size=(600, 800),
+                random_state=self._random
+            )
+
+            output_per_batch['bboxes'].append(
+                np.concatenate([near_bboxes, random_bboxes])
+            )
+            output_per_batch['classes'].append(np.concatenate([
+                near_classes,
+                self._random.randint(
+                    num_classes, size=num_detections - num_near
+                )
+            ]))
+            # The detector returns its results sorted by decreasing score.
+            output_per_batch['scores'].append(
+                np.sort(self._random.uniform(size=num_detections))[::-1]
+            )
+            output_per_batch['gt_bboxes'].append(gt_bboxes)
+            output_per_batch['gt_classes'].append(gt_classes)
+
+        return output_per_batch
+
+    def testSameResults(self):
+        """Tests the results are identical to the loop-based implementation.
+        """
+        for num_classes in (1, 3, 20):
+            output_per_batch = self._generate_output(
+                num_images=30, num_classes=num_classes, num_detections=50
+            )
+            ap, ar = calculate_metrics(output_per_batch, num_classes)
+            expected_ap, expected_ar = calculate_metrics_loop(
+                output_per_batch, num_classes
+            )
+
+            self.assertAllEqual(ap, expected_ap)
+            self.assertAllEqual(ar, expected_ar)
+            self.assertGreater(ap.max(), 0.)
+
+    def testNoDetections(self):
+        """Tests images without detections or without ground truth boxes.
+        """
+        output_per_batch = {
+            'bboxes': [np.zeros((0, 4)), np.array([[10., 10., 50., 50.]])],
+            'classes': [np.zeros((0,), np.int32), np.array([1])],
+            'scores': [np.zeros((0,)), np.array([.9])],
+            'gt_bboxes': [
+                np.array([[10., 10., 50., 50.]]), np.zeros((0, 4))
+            ],
+            'gt_classes': [np.array([0]), np.zeros((0,), np.int32)],
+        }
+        ap, ar = calculate_metrics(output_per_batch, 2)
+        self.assertAllEqual(ap, np.zeros((2, 10)))
+        self.assertAllEqual(ar[0], np.zeros(10))
+
+    def _streaming_metrics(self, output_per_batch, num_classes, start=0,
+                           end=None, num_bins=1000):
+        metrics = StreamingMetrics(num_classes, num_bins=num_bins)
+        for idx in range(start, end or len(output_per_batch['bboxes'])):
+            metrics.update(
+                output_per_batch['bboxes'][idx],
+                output_per_batch['classes'][idx],
+                output_per_batch['scores'][idx],
+                output_per_batch['gt_bboxes'][idx],
+                output_per_batch['gt_classes'][idx],
+            )
+        return metrics
+
+    def testStreamingMetrics(self):
+        """Tests the streaming results approximate the exact ones.
+        """
+        num_classes = 5
+        output_per_batch = self._generate_output(
+            num_images=50, num_classes=num_classes, num_detections=50
+        )
+        metrics = self._streaming_metrics(output_per_batch, num_classes)
+        ap, ar = metrics.get_metrics()
+        expected_ap, expected_ar = calculate_metrics(
+            output_per_batch, num_classes
+        )
+
+        self.assertEqual(metrics.num_images, 50)
+        self.assertAllClose(ap, expected_ap, atol=0.02)
+        self.assertAllEqual(ar, expected_ar)
+
+    def testStreamingMetricsMerge(self):
+        """Tests merging accumulators gives the same result as a single one.
+        """
+        num_classes = 3
+        output_per_batch = self._generate_output(
+            num_images=20, num_classes=num_classes, num_detections=30
+        )
+        metrics = self._streaming_metrics(output_per_batch, num_classes)
+        first_shard = self._streaming_metrics(
+            output_per_batch, num_classes, end=10
+        )
+        second_shard = self._streaming_metrics(
+            output_per_batch, num_classes, start=10
+        )
+        first_shard.merge(second_shard)
+
+        self.assertEqual(first_shard.num_images, 20)
+        self.assertAllEqual(
+            first_shard.get_metrics(), metrics.get_metrics()
+        )
+
+        with self.assertRaises(ValueError):
+            first_shard.merge(StreamingMetrics(num_classes, num_bins=10))
+
+    def _best_time(self, fn, *args, **kwargs):
+        """Returns the shortest running time of `fn` out of three runs."""
+        times = []
+        for _ in range(3):
+            start = time.time()
+            fn(*args, **kwargs)
+            times.append(time.time() - start)
+        return min(times)
+
+    def testBenchmark(self):
+        """Tests it's faster than the loop-based implementation.
+        """
+        num_classes = 20
+        output_per_batch = self._generate_output(
+            num_images=100, num_classes=num_classes, num_detections=100
+        )
+
+        loop_time = self._best_time(
+            calculate_metrics_loop, output_per_batch, num_classes
+        )
+        vectorized_time = self._best_time(
+            calculate_metrics, output_per_batch, num_classes
+        )
+
+        tf.logging.info(
+            'calculate_metrics: {:.3f}s (loop-based: {:.3f}s).'.format(
+                vectorized_time, loop_time
+            )
+        )
+        # It's usually several times faster, leave room for noisy timings.
+        self.assertLess(vectorized_time * 2, loop_time)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -151,6 +151,8 @@ class BaseNetwork(snt.AbstractModule):
             }
 
     def preprocess(self, inputs):
+        # Images are read as `uint8` (to save memory), so convert them here.
+        inputs = tf.to_float(inputs)
         if self.vgg_type or self.resnet_type:
             inputs = self._subtract_channels(inputs)
 
@@ -176,6 +178,40 @@ class BaseNetwork(snt.AbstractModule):
         """
         return inputs - [means]
 
+    def fill_padding(self, images, image_shapes):
+        """Fills the padding of a batch of images with the channel means.
+
+        Images are padded with zeros (at the bottom and right) into a batch,
+        which the mean subtraction in `preprocess` would turn into `-mean`.
+        Instead, the padding is filled with the means, so it's zero once
+        preprocessed, like the padding of convolutions over a single image.
+
+        Args:
+            images: A Tensor of shape `(batch_size, height, width, 3)`.
+            image_shapes: A Tensor of shape `(batch_size, 2)` with the
+                (height, width) of each image before padding.
+
+        Returns:
+            A float Tensor with the same shape as `images`.
+        """
+        images = tf.to_float(images)
+        if not (self.vgg_type or self.resnet_type):
+            return images
+
+        padded_shape = tf.shape(images)[1:3]
+        rows = tf.range(padded_shape[0])[tf.newaxis, :, tf.newaxis]
+        cols = tf.range(padded_shape[1])[tf.newaxis, tf.newaxis, :]
+        in_image = tf.logical_and(
+            tf.less(rows, image_shapes[:, 0, tf.newaxis, tf.newaxis]),
+            tf.less(cols, image_shapes[:, 1, tf.newaxis, tf.newaxis]),
+        )
+        in_image = tf.expand_dims(tf.to_float(in_image), -1)
+
+        return (
+            images * in_image +
+            (1. - in_image) * [[[_R_MEAN, _G_MEAN, _B_MEAN]]]
+        )
+
     def _normalize(self, inputs):
         """Normalize between -1.0 to 1.0.
 
@@ -43,6 +43,28 @@ class BaseNetworkTest(tf.test.TestCase):
                 np.ones([1, 2, 2, 3]) * [r, g, b]
             )
 
+    def testFillPadding(self):
+        """Tests the padding is zero once the means are subtracted.
+        """
+        m = BaseNetwork(self.config)
+        images = np.zeros([2, 3, 4, 3])
+        images[0] = 255.
+        images[1, :2, :3] = 255.
+        image_shapes = np.array([[3, 4], [2, 3]])
+
+        preprocessed = m.preprocess(m.fill_padding(
+            tf.constant(images, tf.float32),
+            tf.constant(image_shapes, tf.int32)
+        ))
+        with self.test_session() as sess:
+            res = sess.run(preprocessed)
+
+        white = [255. - _R_MEAN, 255. - _G_MEAN, 255. - _B_MEAN]
+        self.assertAllClose(res[0], np.ones([3, 4, 3]) * white)
+        self.assertAllClose(res[1, :2, :3], np.ones([2, 3, 3]) * white)
+        self.assertAllClose(res[1, 2], np.zeros([4, 3]))
+        self.assertAllClose(res[1, :, 3], np.zeros([3, 3]))
+
     def testAllArchitectures(self):
         for architecture in VALID_ARCHITECTURES:
             self.config.architecture = architecture
@@ -18,8 +18,11 @@ class FasterRCNN(snt.AbstractModule):
 
     It is also responsible for building the anchor reference which is used in
     graph for generating the dynamic anchors.
+
+    When `with_summaries` is `False`, neither this module nor its submodules
+    add summary ops to the graph, which is meant for inference-only graphs.
     """
-    def __init__(self, config, name='fasterrcnn'):
+    def __init__(self, config, name='fasterrcnn', with_summaries=True):
         super(FasterRCNN, self).__init__(name=name)
 
         # Main configuration object, it holds not only the necessary
@@ -39,6 +42,7 @@ class FasterRCNN(snt.AbstractModule):
         # better visualization and (of course) debugging.
         self._debug = config.train.debug
         self._seed = config.train.seed
+        self._with_summaries = with_summaries
 
         # Anchor config, check out the docs of base_config.yml for a better
         # understanding of how anchors work.
@@ -67,18 +71,28 @@ class FasterRCNN(snt.AbstractModule):
         # We want the pretrained model to be outside the FasterRCNN name scope.
         self.base_network = TruncatedBaseNetwork(config.model.base_network)
 
-    def _build(self, image, gt_boxes=None, is_training=False):
+    def _build(self, image, gt_boxes=None, is_training=False,
+               image_shapes=None):
         """
         Returns bounding boxes and classification probabilities.
 
         Args:
             image: A tensor with the image.
-                Its shape should be `(height, width, 3)`.
+                Its shape should be `(height, width, 3)`. For batches, it can
+                also be `(batch_size, height, width, 3)`, with a static
+                `batch_size` and each image padded with zeros at the bottom
+                and right.
             gt_boxes: A tensor with all the ground truth boxes of that image.
                 Its shape should be `(num_gt_boxes, 5)`
                 Where for each gt box we have (x1, y1, x2, y2, label),
-                in that order.
+                in that order. For batches, its shape should be
+                `(batch_size, max_num_gt_boxes, 5)`, with the boxes of each
+                image padded with rows of -1.
             is_training: A boolean to whether or not it is used for training.
+            image_shapes: Only used for batches. A tensor of shape
+                `(batch_size, 2)` with the (height, width) of each image before
+                padding. If `None`, all images are assumed to fill the whole
+                batch tensor.
 
         Returns:
             classification_prob: A tensor with the softmax probability for
@@ -87,7 +101,16 @@ class FasterRCNN(snt.AbstractModule):
             classification_bbox: A tensor with the bounding boxes found.
                 It's shape should be: (num_bboxes, 4). For each of the bboxes
                 we have (x1, y1, x2, y2)
+
+            For batches, a list with the prediction dict of each image is
+            returned instead.
         """
+        if image.shape.ndims == 4:
+            return self._build_batch(
+                image, gt_boxes=gt_boxes, is_training=is_training,
+                image_shapes=image_shapes
+            )
+
         if gt_boxes is not None:
             gt_boxes = tf.cast(gt_boxes, tf.float32)
         # A Tensor with the feature map for the image,
@@ -102,29 +125,164 @@ class FasterRCNN(snt.AbstractModule):
             tf.expand_dims(image, 0), is_training=is_training
         )
 
+        self._instantiate_layers()
+
+        image_shape = tf.shape(image)[0:2]
+
+        if self._with_summaries:
+            variable_summaries(
+                conv_feature_map, 'conv_feature_map', 'reduced'
+            )
+
+        prediction_dict = self._build_heads(
+            conv_feature_map, image_shape,
+            gt_boxes=gt_boxes, is_training=is_training
+        )
+
+        if self._debug:
+            prediction_dict['image'] = image
+            prediction_dict['image_shape'] = image_shape
+            if gt_boxes is not None:
+                prediction_dict['gt_boxes'] = gt_boxes
+
+        return prediction_dict
+
+    def _build_batch(self, images, gt_boxes=None, is_training=False,
+                     image_shapes=None):
+        """Runs the network over a batch of padded images.
+
+        The base network is applied once to the whole batch. Then, the part of
+        the feature map that corresponds to each image (without the padding)
+        goes through the RPN on its own, and its proposals are pooled from the
+        feature map of the batch. Anchor and proposal targets are calculated,
+        and sampled, for each image.
+
+        Args:
+            images: A tensor of shape `(batch_size, height, width, 3)`, where
+                `batch_size` is known when building the graph.
+            gt_boxes: A tensor of shape `(batch_size, max_num_gt_boxes, 5)`
+                with the ground truth boxes of each image, padded with rows of
+                -1.
+            is_training: A boolean to whether or not it is used for training.
+            image_shapes: A tensor of shape `(batch_size, 2)` with the
+                (height, width) of each image before padding.
+
+        Returns:
+            A list with the prediction dict of each image.
+        """
+        images.set_shape((None, None, None, 3))
+        batch_size = images.shape[0].value
+        if batch_size is None:
+            raise ValueError(
+                'Batches of images require a known batch size.'
+            )
+
+        if image_shapes is None:
+            image_shapes = tf.tile(
+                tf.expand_dims(tf.shape(images)[1:3], 0), [batch_size, 1]
+            )
+        else:
+            images = self.base_network.fill_padding(images, image_shapes)
+
+        conv_feature_map = self.base_network(
+            images, is_training=is_training
+        )
+
+        self._instantiate_layers()
+
+        if self._with_summaries:
+            variable_summaries(
+                conv_feature_map, 'conv_feature_map', 'reduced'
+            )
+
+        padded_shape = tf.shape(images)[1:3]
+
+        predictions = []
+        for idx in range(batch_size):
+            image_shape = image_shapes[idx]
+
+            image_gt_boxes = None
+            if gt_boxes is not None:
+                # Remove the padding rows.
+                image_gt_boxes = tf.boolean_mask(
+                    gt_boxes[idx], tf.greater_equal(gt_boxes[idx, :, 4], 0)
+                )
+                image_gt_boxes = tf.cast(image_gt_boxes, tf.float32)
+
+            prediction_dict = self._build_heads(
+                conv_feature_map, image_shape,
+                gt_boxes=image_gt_boxes, is_training=is_training,
+                batch_index=idx, padded_shape=padded_shape
+            )
+
+            if self._debug:
+                prediction_dict['image'] = images[
+                    idx, :image_shape[0], :image_shape[1]
+                ]
+                prediction_dict['image_shape'] = image_shape
+                if image_gt_boxes is not None:
+                    prediction_dict['gt_boxes'] = image_gt_boxes
+
+            predictions.append(prediction_dict)
+
+        return predictions
+
+    def _instantiate_layers(self):
         # The RPN submodule which generates proposals of objects.
         self._rpn = RPN(
             self._num_anchors, self._config.model.rpn,
-            debug=self._debug, seed=self._seed
+            debug=self._debug, seed=self._seed,
+            with_summaries=self._with_summaries
         )
         if self._with_rcnn:
             # The RCNN submodule which classifies RPN's proposals and
             # classifies them as background or a specific class.
             self._rcnn = RCNN(
                 self._num_classes, self._config.model.rcnn,
-                debug=self._debug, seed=self._seed
+                debug=self._debug, seed=self._seed,
+                with_summaries=self._with_summaries
             )
 
-        image_shape = tf.shape(image)[0:2]
+    def _build_heads(self, conv_feature_map, image_shape, gt_boxes=None,
+                     is_training=False, batch_index=None, padded_shape=None):
+        """Builds the RPN and RCNN on top of the feature map of one image.
 
-        variable_summaries(
-            conv_feature_map, 'conv_feature_map', 'reduced'
-        )
+        Args:
+            conv_feature_map: A tensor of shape
+                `(1, feature_height, feature_width, depth)`. When `batch_index`
+                is set, it's the feature map of a whole batch instead.
+            image_shape: A tensor with the (height, width) of the image.
+            gt_boxes: A tensor with the ground truth boxes of the image.
+            is_training: A boolean to whether or not it is used for training.
+            batch_index: Index of the image in the batch, if any.
+            padded_shape: A tensor with the (height, width) of the batch, to
+                which each image is padded (at the bottom and right).
+
+        Returns:
+            The prediction dict of the image.
+        """
+        image_feature_map = conv_feature_map
+        if batch_index is not None:
+            # Images are padded at the bottom and right, so the features for
+            # each image are located at the top-left corner of its feature
+            # map.
+            feature_map_shape = tf.to_float(tf.shape(conv_feature_map)[1:3])
+            feature_shape = tf.to_int32(tf.ceil(
+                tf.to_float(image_shape) * feature_map_shape /
+                tf.to_float(padded_shape)
+            ))
+            image_feature_map = conv_feature_map[
+                batch_index:batch_index + 1,
+                :feature_shape[0], :feature_shape[1], :
+            ]
+            image_feature_map.set_shape(
+                [1, None, None, conv_feature_map.shape[3]]
+            )
 
         # Generate anchors for the image based on the anchor reference.
-        all_anchors = self._generate_anchors(tf.shape(conv_feature_map))
+        all_anchors = self._generate_anchors(tf.shape(image_feature_map))
         rpn_prediction = self._rpn(
-            conv_feature_map, image_shape, all_anchors,
+            image_feature_map, image_shape, all_anchors,
             gt_boxes=gt_boxes, is_training=is_training
         )
 
@@ -133,22 +291,19 @@ class FasterRCNN(snt.AbstractModule):
         }
 
         if self._debug:
-            prediction_dict['image'] = image
-            prediction_dict['image_shape'] = image_shape
             prediction_dict['all_anchors'] = all_anchors
             prediction_dict['anchor_reference'] = tf.convert_to_tensor(
                 self._anchor_reference
             )
-            if gt_boxes is not None:
-                prediction_dict['gt_boxes'] = gt_boxes
-            prediction_dict['conv_feature_map'] = conv_feature_map
+            prediction_dict['conv_feature_map'] = image_feature_map
 
         if self._with_rcnn:
             proposals = tf.stop_gradient(rpn_prediction['proposals'])
             classification_pred = self._rcnn(
                 conv_feature_map, proposals,
                 image_shape, self.base_network,
-                gt_boxes=gt_boxes, is_training=is_training
+                gt_boxes=gt_boxes, is_training=is_training,
+                batch_index=batch_index, padded_shape=padded_shape
             )
 
             prediction_dict['classification_prediction'] = classification_pred
@@ -167,6 +322,8 @@ class FasterRCNN(snt.AbstractModule):
                 classification_prediction: A dictionary with the output Tensors
                     from the RCNN.
 
+                For batches, the list of prediction dicts of every image.
+
         Returns:
             If `return_all` is False, a tensor for the total loss. If True, a
             dict with all the internal losses (RPN's, RCNN's, regularization
@@ -174,39 +331,21 @@ class FasterRCNN(snt.AbstractModule):
         """
 
         with tf.name_scope('losses'):
-            rpn_loss_dict = self._rpn.loss(
-                prediction_dict['rpn_prediction']
-            )
-
-            # Losses have a weight assigned, we multiply by them before saving
-            # them.
-            rpn_loss_dict['rpn_cls_loss'] = (
-                rpn_loss_dict['rpn_cls_loss'] * self._rpn_cls_loss_weight)
-            rpn_loss_dict['rpn_reg_loss'] = (
-                rpn_loss_dict['rpn_reg_loss'] * self._rpn_reg_loss_weight)
-
-            prediction_dict['rpn_loss_dict'] = rpn_loss_dict
-
-            if self._with_rcnn:
-                rcnn_loss_dict = self._rcnn.loss(
-                    prediction_dict['classification_prediction']
-                )
-
-                rcnn_loss_dict['rcnn_cls_loss'] = (
-                    rcnn_loss_dict['rcnn_cls_loss'] *
-                    self._rcnn_cls_loss_weight
-                )
-                rcnn_loss_dict['rcnn_reg_loss'] = (
-                    rcnn_loss_dict['rcnn_reg_loss'] *
-                    self._rcnn_reg_loss_weight
-                )
-
-                prediction_dict['rcnn_loss_dict'] = rcnn_loss_dict
+            if isinstance(prediction_dict, list):
+                # For batches, each loss is the mean of those of every image.
+                images_losses_items = [
+                    self._image_losses(image_prediction_dict)
+                    for image_prediction_dict in prediction_dict
+                ]
+                all_losses_items = [
+                    (loss_name, tf.add_n([
+                        dict(image_losses_items)[loss_name]
+                        for image_losses_items in images_losses_items
+                    ]) / len(images_losses_items))
+                    for loss_name, _ in images_losses_items[0]
+                ]
             else:
-                rcnn_loss_dict = {}
-
-            all_losses_items = (
-                list(rpn_loss_dict.items()) + list(rcnn_loss_dict.items()))
+                all_losses_items = self._image_losses(prediction_dict)
 
             for loss_name, loss_tensor in all_losses_items:
                 tf.summary.scalar(
@@ -258,6 +397,48 @@ class FasterRCNN(snt.AbstractModule):
             # - regularization loss
             return total_loss
 
+    def _image_losses(self, prediction_dict):
+        """Computes the weighted RPN and RCNN losses of a single image.
+
+        Returns:
+            A list of (loss name, loss tensor) pairs.
+        """
+        rpn_loss_dict = self._rpn.loss(
+            prediction_dict['rpn_prediction']
+        )
+
+        # Losses have a weight assigned, we multiply by them before saving
+        # them.
+        rpn_loss_dict['rpn_cls_loss'] = (
+            rpn_loss_dict['rpn_cls_loss'] * self._rpn_cls_loss_weight)
+        rpn_loss_dict['rpn_reg_loss'] = (
+            rpn_loss_dict['rpn_reg_loss'] * self._rpn_reg_loss_weight)
+
+        prediction_dict['rpn_loss_dict'] = rpn_loss_dict
+
+        if self._with_rcnn:
+            rcnn_loss_dict = self._rcnn.loss(
+                prediction_dict['classification_prediction']
+            )
+
+            rcnn_loss_dict['rcnn_cls_loss'] = (
+                rcnn_loss_dict['rcnn_cls_loss'] *
+                self._rcnn_cls_loss_weight
+            )
+            rcnn_loss_dict['rcnn_reg_loss'] = (
+                rcnn_loss_dict['rcnn_reg_loss'] *
+                self._rcnn_reg_loss_weight
+            )
+
+            prediction_dict['rcnn_loss_dict'] = rcnn_loss_dict
+        else:
+            rcnn_loss_dict = {}
+
+        all_losses_items = (
+            list(rpn_loss_dict.items()) + list(rcnn_loss_dict.items()))
+
+        return all_losses_items
+
     def _generate_anchors(self, feature_map_shape):
         """Generate anchor for an image.
 
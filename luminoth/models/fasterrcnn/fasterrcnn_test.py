@@ -241,6 +241,136 @@ class FasterRCNNNetworkTest(tf.test.TestCase):
             rpn_prediction['proposals']
         )
 
+    def testBatch(self):
+        """
+        Test batched inference over padded images of different sizes
+        """
+        image_shapes = np.array([[600, 800], [400, 600]], dtype=np.int32)
+        images = np.zeros((2, 600, 800, 3), dtype=np.float32)
+        images[0] = self.image
+        images[1, :400, :600] = self.image[:400, :600]
+
+        images_tf = tf.placeholder(tf.float32, shape=images.shape)
+        image_shapes_tf = tf.placeholder(tf.int32, shape=image_shapes.shape)
+        model = FasterRCNN(self.config)
+        results = model(images_tf, image_shapes=image_shapes_tf)
+
+        self.assertEqual(len(results), 2)
+
+        with self.test_session() as sess:
+            sess.run(tf.global_variables_initializer())
+            results = sess.run(results, feed_dict={
+                images_tf: images,
+                image_shapes_tf: image_shapes,
+            })
+
+        for result, image_shape in zip(results, image_shapes):
+            objects = result['classification_prediction']['objects']
+            self.assertEqual(objects.shape[1], 4)
+            # Check objects are clipped to each image, not to the padding.
+            self.assertAllEqual(
+                clip_boxes(objects.copy(), image_shape), objects
+            )
+
+    def testBatchSameAsSingle(self):
+        """
+        Test the features of padded images match the ones of each image alone
+        """
+        # Stop at the first convolution, where the padding of the batch (once
+        # preprocessed) is the only difference with a single image.
+        self.config.model.base_network.endpoint = 'conv1/conv1_1'
+        image_shapes = np.array([[48, 64], [32, 40]], dtype=np.int32)
+        images = np.zeros((2, 48, 64, 3), dtype=np.float32)
+        for idx, (height, width) in enumerate(image_shapes):
+            images[idx, :height, :width] = np.random.randint(
+                low=0, high=255, size=(height, width, 3)
+            )
+
+        images_tf = tf.placeholder(tf.float32, shape=images.shape)
+        image_shapes_tf = tf.placeholder(tf.int32, shape=image_shapes.shape)
+        image_tf = tf.placeholder(tf.float32, shape=(None, None, 3))
+        model = FasterRCNN(self.config)
+        batch_results = model(images_tf, image_shapes=image_shapes_tf)
+        single_results = model(image_tf)
+
+        with self.test_session() as sess:
+            sess.run(tf.global_variables_initializer())
+            batch_results = sess.run(batch_results, feed_dict={
+                images_tf: images,
+                image_shapes_tf: image_shapes,
+            })
+            for idx, (height, width) in enumerate(image_shapes):
+                single_result = sess.run(single_results, feed_dict={
+                    image_tf: images[idx, :height, :width],
+                })
+                self.assertAllClose(
+                    batch_results[idx]['conv_feature_map'],
+                    single_result['conv_feature_map'],
+                    rtol=1e-4, atol=1e-3
+                )
+
+    def testBatchTraining(self):
+        """
+        Test training over a batch of padded images with padded gt_boxes
+        """
+        image_shapes = np.array([[600, 800], [400, 600]], dtype=np.int32)
+        images = np.zeros((2, 600, 800, 3), dtype=np.float32)
+        images[0] = self.image
+        images[1, :400, :600] = self.image[:400, :600]
+
+        # The second image has one box less, so it's padded with -1.
+        gt_boxes = np.stack([
+            self.gt_boxes,
+            np.concatenate([self.gt_boxes[:-1], -np.ones((1, 5))]),
+        ])
+
+        images_tf = tf.placeholder(tf.float32, shape=images.shape)
+        gt_boxes_tf = tf.placeholder(tf.float32, shape=gt_boxes.shape)
+        image_shapes_tf = tf.placeholder(tf.int32, shape=image_shapes.shape)
+        model = FasterRCNN(self.config)
+        results = model(
+            images_tf, gt_boxes_tf, is_training=True,
+            image_shapes=image_shapes_tf
+        )
+        total_loss = model.loss(results)
+
+        self.assertEqual(len(results), 2)
+
+        with self.test_session() as sess:
+            sess.run(tf.global_variables_initializer())
+            results, total_loss = sess.run([results, total_loss], feed_dict={
+                images_tf: images,
+                gt_boxes_tf: gt_boxes,
+                image_shapes_tf: image_shapes,
+            })
+
+        self.assertTrue(np.isfinite(total_loss))
+        for result, image_shape in zip(results, image_shapes):
+            # Proposals are clipped to each image, not to the padding.
+            proposals = result['rpn_prediction']['proposals']
+            self.assertAllEqual(
+                clip_boxes(proposals.copy(), image_shape), proposals
+            )
+            # Proposal targets are sampled for each image.
+            self.assertLessEqual(
+                result['classification_prediction']['target']['cls'].shape[0],
+                self.config.model.rcnn.target.minibatch_size
+            )
+
+    def testWithoutSummaries(self):
+        """
+        Test that no summary ops are built for inference-only graphs
+        """
+        image = tf.placeholder(tf.float32, shape=self.image.shape)
+        model = FasterRCNN(self.config, with_summaries=False)
+        model(image)
+
+        summary_ops = [
+            op for op in tf.get_default_graph().get_operations()
+            if op.type in ('ScalarSummary', 'HistogramSummary')
+        ]
+        self.assertEqual(summary_ops, [])
+
     def testAnchors(self):
         """
         Tests about the anchors generated by the FasterRCNN
@@ -36,7 +36,7 @@ class RCNN(snt.AbstractModule):
     """
 
     def __init__(self, num_classes, config, debug=False, seed=None,
-                 name='rcnn'):
+                 with_summaries=True, name='rcnn'):
         super(RCNN, self).__init__(name=name)
         self._num_classes = num_classes
         # List of the fully connected layer sizes used before classifying and
@@ -66,6 +66,8 @@ class RCNN(snt.AbstractModule):
         self._debug = debug
         self._config = config
         self._seed = seed
+        # Summaries are left out of inference-only graphs.
+        self._with_summaries = with_summaries
 
     def _instantiate_layers(self):
         # We define layers as an array since they are simple fully connected
@@ -110,11 +112,12 @@ class RCNN(snt.AbstractModule):
         # duplicates.
         self._rcnn_proposal = RCNNProposal(
             self._num_classes, self._config.proposals,
-            variances=self._variances
+            variances=self._variances, with_summaries=self._with_summaries
         )
 
     def _build(self, conv_feature_map, proposals, im_shape, base_network,
-               gt_boxes=None, is_training=False):
+               gt_boxes=None, is_training=False, batch_index=None,
+               padded_shape=None):
         """
         Classifies & refines proposals based on the pooled feature map.
 
@@ -133,6 +136,10 @@ class RCNN(snt.AbstractModule):
                 Encoding: (x1, y1, x2, y2, label).
             is_training (optional): A boolean to determine if we are just using
                 the module for training or just inference.
+            batch_index (optional): When `conv_feature_map` holds the features
+                of a batch of images, the index of the image in it.
+            padded_shape (optional): Shape (height, width) of the padded batch
+                of images, required along with `batch_index`.
 
         Returns:
             prediction_dict: a dict with the object predictions.
@@ -171,7 +178,18 @@ class RCNN(snt.AbstractModule):
                 'bbox_offsets': bbox_offsets_target,
             }
 
-        roi_prediction = self._roi_pool(proposals, conv_feature_map, im_shape)
+        if batch_index is None:
+            roi_prediction = self._roi_pool(
+                proposals, conv_feature_map, im_shape
+            )
+        else:
+            # Crop the features of the proposals out of those of the whole
+            # (padded) batch.
+            batch_ids = tf.fill(tf.shape(proposals)[:1], batch_index)
+            roi_prediction = self._roi_pool(
+                proposals, conv_feature_map, padded_shape,
+                batch_ids=batch_ids
+            )
 
         if self._debug:
             # Save raw roi prediction in debug mode.
@@ -206,14 +224,16 @@ class RCNN(snt.AbstractModule):
             net = layer(net)
 
             # Apply activation and dropout.
-            variable_summaries(
-                net, 'fc_{}_preactivationout'.format(i), 'reduced'
-            )
+            if self._with_summaries:
+                variable_summaries(
+                    net, 'fc_{}_preactivationout'.format(i), 'reduced'
+                )
             net = self._activation(net)
             if self._debug:
                 prediction_dict['_debug']['layer_{}_out'.format(i)] = net
 
-            variable_summaries(net, 'fc_{}_out'.format(i), 'reduced')
+            if self._with_summaries:
+                variable_summaries(net, 'fc_{}_out'.format(i), 'reduced')
             if is_training:
                 net = tf.nn.dropout(net, keep_prob=self._dropout_keep_prob)
 
@@ -241,6 +261,9 @@ class RCNN(snt.AbstractModule):
         if self._debug:
             prediction_dict['_debug']['proposal'] = proposals_pred
 
+        if not self._with_summaries:
+            return prediction_dict
+
         # Calculate summaries for results
         variable_summaries(cls_prob, 'cls_prob', 'reduced')
         variable_summaries(bbox_offsets, 'bbox_offsets', 'reduced')
@@ -1,7 +1,9 @@
 import sonnet as snt
 import tensorflow as tf
 
-from luminoth.utils.bbox_transform_tf import decode, clip_boxes, change_order
+from luminoth.utils.bbox_transform_tf import (
+    decode, clip_boxes, multiclass_non_max_suppression
+)
 
 
 class RCNNProposal(snt.AbstractModule):
@@ -24,11 +26,12 @@ class RCNNProposal(snt.AbstractModule):
     files.
     """
     def __init__(self, num_classes, config, variances=None,
-                 name='rcnn_proposal'):
+                 with_summaries=True, name='rcnn_proposal'):
         """
         Args:
             num_classes: Total number of classes RCNN is classifying.
             config: Configuration object.
+            with_summaries: Whether to add summary ops to the graph.
         """
         super(RCNNProposal, self).__init__(name=name)
         self._num_classes = num_classes
@@ -42,6 +45,7 @@ class RCNNProposal(snt.AbstractModule):
         self._total_max_detections = config.total_max_detections
         # Threshold probability
         self._min_prob_threshold = config.min_prob_threshold or 0.0
+        self._with_summaries = with_summaries
 
     def _build(self, proposals, bbox_pred, cls_prob, im_shape):
         """
@@ -67,83 +71,64 @@ class RCNNProposal(snt.AbstractModule):
                 Shape (final_num_proposals,)
 
         """
-        selected_boxes = []
-        selected_probs = []
-        selected_labels = []
-
-        # For each class, take the proposals with the class-specific
-        # predictions (class scores and bbox regression) and filter accordingly
-        # (valid area, min probability score and NMS).
-        for class_id in range(self._num_classes):
-            # Apply the class-specific transformations to the proposals to
-            # obtain the current class' prediction.
-            class_prob = cls_prob[:, class_id + 1]  # 0 is background class.
-            class_bboxes = bbox_pred[:, (4 * class_id):(4 * class_id + 4)]
-            raw_class_objects = decode(
-                proposals,
-                class_bboxes,
-                variances=self._variances,
-            )
+        num_proposals = tf.shape(proposals)[0]
+
+        # Take the class-specific predictions (class scores and bbox
+        # regression) for every proposal and class at once, flattened to
+        # (num_proposals * num_classes,) candidates ordered by proposal and
+        # then by class.
+        proposals = tf.reshape(
+            tf.tile(proposals, [1, self._num_classes]), [-1, 4]
+        )
+        class_bboxes = tf.reshape(bbox_pred, [-1, 4])
+        class_prob = tf.reshape(cls_prob[:, 1:], [-1])  # 0 is background.
+        class_labels = tf.tile(tf.range(self._num_classes), [num_proposals])
+
+        # Apply the class-specific transformations to the proposals to obtain
+        # the prediction for each class.
+        raw_class_objects = decode(
+            proposals,
+            class_bboxes,
+            variances=self._variances,
+        )
 
-            # Clip bboxes so they don't go out of the image.
-            class_objects = clip_boxes(raw_class_objects, im_shape)
+        # Clip bboxes so they don't go out of the image.
+        class_objects = clip_boxes(raw_class_objects, im_shape)
 
-            # Filter objects based on the min probability threshold and on them
-            # having a valid area.
-            prob_filter = tf.greater_equal(
-                class_prob, self._min_prob_threshold
-            )
+        # Filter objects based on the min probability threshold and on them
+        # having a valid area.
+        prob_filter = tf.greater_equal(class_prob, self._min_prob_threshold)
 
-            (x_min, y_min, x_max, y_max) = tf.unstack(class_objects, axis=1)
-            area_filter = tf.greater(
-                tf.maximum(x_max - x_min, 0.0)
-                * tf.maximum(y_max - y_min, 0.0),
-                0.0
-            )
+        (x_min, y_min, x_max, y_max) = tf.unstack(class_objects, axis=1)
+        area_filter = tf.greater(
+            tf.maximum(x_max - x_min, 0.0) * tf.maximum(y_max - y_min, 0.0),
+            0.0
+        )
 
-            object_filter = tf.logical_and(area_filter, prob_filter)
+        object_filter = tf.logical_and(area_filter, prob_filter)
 
-            class_objects = tf.boolean_mask(class_objects, object_filter)
-            class_prob = tf.boolean_mask(class_prob, object_filter)
+        class_objects = tf.boolean_mask(class_objects, object_filter)
+        class_prob = tf.boolean_mask(class_prob, object_filter)
+        class_labels = tf.boolean_mask(class_labels, object_filter)
 
-            # We have to use the TensorFlow's bounding box convention to use
-            # the included function for NMS.
-            class_objects_tf = change_order(class_objects)
+        # Apply class NMS, for all the classes at once, over the top scoring
+        # candidates of each class. Results are grouped by class, as if NMS
+        # was applied on each class separately.
+        selected_idx = multiclass_non_max_suppression(
+            class_objects, class_prob, class_labels,
+            self._class_max_detections, self._class_nms_threshold
+        )
 
-            # Apply class NMS.
-            class_selected_idx = tf.image.non_max_suppression(
-                class_objects_tf, class_prob, self._class_max_detections,
-                iou_threshold=self._class_nms_threshold
-            )
+        # Using NMS resulting indices, gather values from Tensors.
+        objects = tf.gather(class_objects, selected_idx)
+        proposal_label = tf.gather(class_labels, selected_idx)
+        proposal_label_prob = tf.gather(class_prob, selected_idx)
 
-            # Using NMS resulting indices, gather values from Tensors.
-            class_objects_tf = tf.gather(class_objects_tf, class_selected_idx)
-            class_prob = tf.gather(class_prob, class_selected_idx)
-
-            # Revert to our bbox convention.
-            class_objects = change_order(class_objects_tf)
-
-            # We append values to a regular list which will later be
-            # transformed to a proper Tensor.
-            selected_boxes.append(class_objects)
-            selected_probs.append(class_prob)
-            # In the case of the class_id, since it is a loop on classes, we
-            # already have a fixed class_id. We use `tf.tile` to create that
-            # Tensor with the total number of indices returned by the NMS.
-            selected_labels.append(
-                tf.tile([class_id], [tf.shape(class_selected_idx)[0]])
+        if self._with_summaries:
+            tf.summary.histogram(
+                'proposal_cls_scores', proposal_label_prob, ['rcnn']
             )
 
-        # We use concat (axis=0) to generate a Tensor where the rows are
-        # stacked on top of each other
-        objects = tf.concat(selected_boxes, axis=0)
-        proposal_label = tf.concat(selected_labels, axis=0)
-        proposal_label_prob = tf.concat(selected_probs, axis=0)
-
-        tf.summary.histogram(
-            'proposal_cls_scores', proposal_label_prob, ['rcnn']
-        )
-
         # Get top-k detections of all classes.
         k = tf.minimum(
             self._total_max_detections,
@@ -158,7 +143,4 @@ class RCNNProposal(snt.AbstractModule):
             'objects': top_k_objects,
             'proposal_label': top_k_proposal_label,
             'proposal_label_prob': top_k_proposal_label_prob,
-            'selected_boxes': selected_boxes,
-            'selected_probs': selected_probs,
-            'selected_labels': selected_labels,
         }
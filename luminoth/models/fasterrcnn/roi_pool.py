@@ -65,12 +65,14 @@ class ROIPoolingLayer(snt.AbstractModule):
 
             return bboxes
 
-    def _roi_crop(self, roi_proposals, conv_feature_map, im_shape):
+    def _roi_crop(self, roi_proposals, conv_feature_map, im_shape,
+                  batch_ids=None):
         # Get normalized bounding boxes.
         bboxes = self._get_bboxes(roi_proposals, im_shape)
-        # Generate fake batch ids
-        bboxes_shape = tf.shape(bboxes)
-        batch_ids = tf.zeros((bboxes_shape[0], ), dtype=tf.int32)
+        if batch_ids is None:
+            # Generate fake batch ids, as the feature map is of a single image.
+            bboxes_shape = tf.shape(bboxes)
+            batch_ids = tf.zeros((bboxes_shape[0], ), dtype=tf.int32)
         # Apply crop and resize with extracting a crop double the desired size.
         crops = tf.image.crop_and_resize(
             conv_feature_map, bboxes, batch_ids,
@@ -94,14 +96,34 @@ class ROIPoolingLayer(snt.AbstractModule):
 
         return prediction_dict
 
-    def _roi_pooling(self, roi_proposals, conv_feature_map, im_shape):
+    def _roi_pooling(self, roi_proposals, conv_feature_map, im_shape,
+                     batch_ids=None):
         raise NotImplementedError()
 
-    def _build(self, roi_proposals, conv_feature_map, im_shape):
+    def _build(self, roi_proposals, conv_feature_map, im_shape,
+               batch_ids=None):
+        """
+        Args:
+            roi_proposals: A Tensor with the bounding boxes of shape
+                (total_proposals, 4), in (x_min, y_min, x_max, y_max) order.
+            conv_feature_map: The feature map of a batch of images, of shape
+                (batch_size, height, width, depth).
+            im_shape: A Tensor with the shape (height, width) of the images
+                the feature map was extracted from.
+            batch_ids: A Tensor of shape (total_proposals,) with the index of
+                the image (in the batch) of each proposal. When `None`, the
+                proposals are assumed to belong to the first one.
+        """
         if self._pooling_mode == CROP:
-            return self._roi_crop(roi_proposals, conv_feature_map, im_shape)
+            return self._roi_crop(
+                roi_proposals, conv_feature_map, im_shape,
+                batch_ids=batch_ids
+            )
         elif self._pooling_mode == ROI_POOLING:
-            return self._roi_pooling(roi_proposals, conv_feature_map, im_shape)
+            return self._roi_pooling(
+                roi_proposals, conv_feature_map, im_shape,
+                batch_ids=batch_ids
+            )
         else:
             raise NotImplementedError(
                 'Pooling mode {} does not exist.'.format(self._pooling_mode))
@@ -238,6 +238,47 @@ class ROIPoolingTest(tf.test.TestCase):
             np.less_equal(results['crops'][3], d).all()
         )
 
+    def testBatchIds(self):
+        """
+        Test that proposals are pooled from the image they belong to, when
+        given a batch of feature maps.
+        """
+        roi_proposals = np.array([
+            [1, 1, 4, 4],  # Inside mat_A
+            [6, 6, 9, 9],  # Inside mat_D
+        ])
+        # The second image of the batch has its quadrants in reverse order.
+        pretrained = np.concatenate(
+            [self.pretrained, self.pretrained[:, ::-1, ::-1, :]], axis=0
+        )
+
+        roi_proposals_tf = tf.placeholder(
+            tf.float32, shape=roi_proposals.shape)
+        pretrained_tf = tf.placeholder(tf.float32, shape=pretrained.shape)
+        batch_ids_tf = tf.placeholder(tf.int32, shape=(2,))
+
+        model = ROIPoolingLayer(self.config)
+        results = model(
+            roi_proposals_tf, pretrained_tf, self.im_shape,
+            batch_ids=batch_ids_tf
+        )
+
+        with self.test_session() as sess:
+            roi_pool = sess.run(results['roi_pool'], feed_dict={
+                roi_proposals_tf: roi_proposals,
+                pretrained_tf: pretrained,
+                batch_ids_tf: [0, 1],
+            })
+
+        # mat_A of the first image, then that of the second one (which is in
+        # the place of mat_D).
+        self.assertAllEqual(
+            roi_pool[0], np.ones((2, 2, 1)) * self.multiplier_a
+        )
+        self.assertAllEqual(
+            roi_pool[1], np.ones((2, 2, 1)) * self.multiplier_a
+        )
+
 
 if __name__ == "__main__":
     tf.test.main()
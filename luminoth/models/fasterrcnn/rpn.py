@@ -19,7 +19,7 @@ from luminoth.utils.vars import (
 class RPN(snt.AbstractModule):
 
     def __init__(self, num_anchors, config, debug=False, seed=None,
-                 name='rpn'):
+                 with_summaries=True, name='rpn'):
         """RPN - Region Proposal Network.
 
         Given an image (as feature map) and a fixed set of anchors, the RPN
@@ -31,6 +31,9 @@ class RPN(snt.AbstractModule):
         each associated with an objectness score.
 
         Note: this module can be used independently of Faster R-CNN.
+
+        When `with_summaries` is `False` no summary ops are added to the graph,
+        which is useful for inference-only graphs.
         """
         super(RPN, self).__init__(name=name)
         self._num_anchors = num_anchors
@@ -39,6 +42,7 @@ class RPN(snt.AbstractModule):
 
         self._debug = debug
         self._seed = seed
+        self._with_summaries = with_summaries
 
         self._rpn_initializer = get_initializer(
             config.rpn_initializer, seed=seed
@@ -135,7 +139,8 @@ class RPN(snt.AbstractModule):
         # We start with a common conv layer applied to the feature map.
         self._instantiate_layers()
         self._proposal = RPNProposal(
-            self._num_anchors, self._config.proposals, debug=self._debug
+            self._num_anchors, self._config.proposals, debug=self._debug,
+            with_summaries=self._with_summaries
         )
         self._anchor_target = RPNTarget(
             self._num_anchors, self._config.target, seed=self._seed
@@ -195,8 +200,13 @@ class RPN(snt.AbstractModule):
 
             if self._debug:
                 prediction_dict['rpn_max_overlap'] = rpn_max_overlap
+
+            if self._debug and self._with_summaries:
                 variable_summaries(rpn_bbox_target, 'rpn_bbox_target', 'full')
 
+        if not self._with_summaries:
+            return prediction_dict
+
         # Variables summaries.
         variable_summaries(prediction_dict['scores'], 'rpn_scores', 'reduced')
         variable_summaries(rpn_cls_prob, 'rpn_cls_prob', 'reduced')
@@ -15,7 +15,7 @@ class RPNProposal(snt.AbstractModule):
     it tries to get rid of duplicate proposals by using non maximum supression
     (NMS).
     """
-    def __init__(self, num_anchors, config, debug=False,
+    def __init__(self, num_anchors, config, debug=False, with_summaries=True,
                  name='proposal_layer'):
         super(RPNProposal, self).__init__(name=name)
         self._num_anchors = num_anchors
@@ -37,6 +37,7 @@ class RPNProposal(snt.AbstractModule):
         self._clip_after_nms = config.clip_after_nms
         self._min_prob_threshold = float(config.min_prob_threshold)
         self._debug = debug
+        self._with_summaries = with_summaries
 
     def _build(self, rpn_cls_prob, rpn_bbox_pred, all_anchors, im_shape):
         """
@@ -124,16 +125,17 @@ class RPNProposal(snt.AbstractModule):
 
         filtered_proposals_total = tf.shape(unsorted_scores)[0]
 
-        tf.summary.scalar(
-            'valid_proposals_ratio',
-            (
-                tf.cast(filtered_proposals_total, tf.float32) /
-                tf.cast(all_proposals_total, tf.float32)
-            ), ['rpn'])
-
-        tf.summary.scalar(
-            'invalid_proposals',
-            all_proposals_total - filtered_proposals_total, ['rpn'])
+        if self._with_summaries:
+            tf.summary.scalar(
+                'valid_proposals_ratio',
+                (
+                    tf.cast(filtered_proposals_total, tf.float32) /
+                    tf.cast(all_proposals_total, tf.float32)
+                ), ['rpn'])
+
+            tf.summary.scalar(
+                'invalid_proposals',
+                all_proposals_total - filtered_proposals_total, ['rpn'])
 
         # Get top `pre_nms_top_n` indices by sorting the proposals by score.
         k = tf.minimum(self._pre_nms_top_n, tf.shape(unsorted_scores)[0])
@@ -15,7 +15,7 @@ VALID_SSD_ARCHITECTURES = set([
 class SSDFeatureExtractor(BaseNetwork):
 
     def __init__(self, config, parent_name=None, name='ssd_feature_extractor',
-                 **kwargs):
+                 with_summaries=True, **kwargs):
         super(SSDFeatureExtractor, self).__init__(config, name=name, **kwargs)
         if self._architecture not in VALID_SSD_ARCHITECTURES:
             raise ValueError('Invalid architecture "{}"'.format(
@@ -23,6 +23,11 @@ class SSDFeatureExtractor(BaseNetwork):
             ))
         self.parent_name = parent_name
         self.activation_fn = tf.nn.relu
+        self._with_summaries = with_summaries
+
+    def _histogram_summary(self, name, values):
+        if self._with_summaries:
+            tf.summary.histogram(name, values)
 
     def _init_vgg16_extra_layers(self):
         self.conv6 = Conv2D(1024, [3, 3], rate=6, name='conv6')
@@ -58,7 +63,7 @@ class SSDFeatureExtractor(BaseNetwork):
             # we need to add a spatial normalization before adding the
             # predictors.
             vgg_conv4_3 = base_net_endpoints[scope + '/vgg_16/conv4/conv4_3']
-            tf.summary.histogram('conv4_3_hist', vgg_conv4_3)
+            self._histogram_summary('conv4_3_hist', vgg_conv4_3)
             with tf.variable_scope('conv_4_3_norm'):
                 # Normalize through channels dimension (dim=3)
                 vgg_conv4_3_norm = tf.nn.l2_normalize(
@@ -74,14 +79,14 @@ class SSDFeatureExtractor(BaseNetwork):
                     initializer=scale_initializer
                 )
                 vgg_conv4_3_norm = tf.multiply(vgg_conv4_3_norm, scale)
-                tf.summary.histogram('conv4_3_normalized_hist', vgg_conv4_3)
+                self._histogram_summary('conv4_3_normalized_hist', vgg_conv4_3)
             tf.add_to_collection('FEATURE_MAPS', vgg_conv4_3_norm)
 
             # The original SSD paper uses a modified version of the vgg16
             # network, which we'll modify here
             vgg_network_truncation_endpoint = base_net_endpoints[
                 scope + '/vgg_16/conv5/conv5_3']
-            tf.summary.histogram(
+            self._histogram_summary(
                 'conv5_3_hist',
                 vgg_network_truncation_endpoint
             )
@@ -97,31 +102,31 @@ class SSDFeatureExtractor(BaseNetwork):
                 net = self.activation_fn(net)
                 net = self.conv7(net)
                 net = self.activation_fn(net)
-                tf.summary.histogram('conv7_hist', net)
+                self._histogram_summary('conv7_hist', net)
                 tf.add_to_collection('FEATURE_MAPS', net)
                 net = self.conv8_1(net)
                 net = self.activation_fn(net)
                 net = self.conv8_2(net)
                 net = self.activation_fn(net)
-                tf.summary.histogram('conv8_hist', net)
+                self._histogram_summary('conv8_hist', net)
                 tf.add_to_collection('FEATURE_MAPS', net)
                 net = self.conv9_1(net)
                 net = self.activation_fn(net)
                 net = self.conv9_2(net)
                 net = self.activation_fn(net)
-                tf.summary.histogram('conv9_hist', net)
+                self._histogram_summary('conv9_hist', net)
                 tf.add_to_collection('FEATURE_MAPS', net)
                 net = self.conv10_1(net)
                 net = self.activation_fn(net)
                 net = self.conv10_2(net)
                 net = self.activation_fn(net)
-                tf.summary.histogram('conv10_hist', net)
+                self._histogram_summary('conv10_hist', net)
                 tf.add_to_collection('FEATURE_MAPS', net)
                 net = self.conv11_1(net)
                 net = self.activation_fn(net)
                 net = self.conv11_2(net)
                 net = self.activation_fn(net)
-                tf.summary.histogram('conv11_hist', net)
+                self._histogram_summary('conv11_hist', net)
                 tf.add_to_collection('FEATURE_MAPS', net)
 
             # This parameter determines onto which variables we try to load the
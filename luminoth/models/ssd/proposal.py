@@ -1,7 +1,9 @@
 import sonnet as snt
 import tensorflow as tf
 
-from luminoth.utils.bbox_transform_tf import decode, clip_boxes, change_order
+from luminoth.utils.bbox_transform_tf import (
+    decode, clip_boxes, multiclass_non_max_suppression
+)
 
 
 class SSDProposal(snt.AbstractModule):
@@ -23,7 +25,8 @@ class SSDProposal(snt.AbstractModule):
     and in general. These values are easily modifiable in the configuration
     files.
     """
-    def __init__(self, num_classes, config, variances, name='proposal_layer'):
+    def __init__(self, num_classes, config, variances, with_summaries=True,
+                 name='proposal_layer'):
         super(SSDProposal, self).__init__(name=name)
         self._num_classes = num_classes
 
@@ -37,6 +40,7 @@ class SSDProposal(snt.AbstractModule):
 
         self._filter_outside_anchors = config.filter_outside_anchors
         self._variances = variances
+        self._with_summaries = with_summaries
 
     def _build(self, cls_prob, loc_pred, all_anchors, im_shape):
         """
@@ -63,93 +67,71 @@ class SSDProposal(snt.AbstractModule):
                 proposal_label: It's shape is (final_num_proposals,)
                 proposal_label_prob: It's shape is (final_num_proposals,)
         """
-        selected_boxes = []
-        selected_probs = []
-        selected_labels = []
-        selected_anchors = []  # For debugging
-
-        for class_id in range(self._num_classes):
-            # Get the confidences for this class (+ 1 is to ignore background)
-            class_cls_prob = cls_prob[:, class_id + 1]
-
-            # Filter by min_prob_threshold
-            min_prob_filter = tf.greater_equal(
-                class_cls_prob, self._min_prob_threshold)
-            class_cls_prob = tf.boolean_mask(class_cls_prob, min_prob_filter)
-            class_loc_pred = tf.boolean_mask(loc_pred, min_prob_filter)
-            anchors = tf.boolean_mask(all_anchors, min_prob_filter)
-
-            # Using the loc_pred and the anchors, we generate the proposals.
-            raw_proposals = decode(anchors, class_loc_pred, self._variances)
-            # Clip boxes to image.
-            clipped_proposals = clip_boxes(raw_proposals, im_shape)
-
-            # Filter proposals that have an non-valid area.
-            (x_min, y_min, x_max, y_max) = tf.unstack(
-                clipped_proposals, axis=1)
-            proposal_filter = tf.greater(
-                tf.maximum(x_max - x_min, 0.) * tf.maximum(y_max - y_min, 0.),
-                0.
-            )
-            class_proposals = tf.boolean_mask(
-                clipped_proposals, proposal_filter)
-            class_loc_pred = tf.boolean_mask(
-                class_loc_pred, proposal_filter)
-            class_cls_prob = tf.boolean_mask(
-                class_cls_prob, proposal_filter)
-            proposal_anchors = tf.boolean_mask(
-                anchors, proposal_filter)
-
-            # Log results of filtering non-valid area proposals
-            total_anchors = tf.shape(all_anchors)[0]
-            total_proposals = tf.shape(class_proposals)[0]
-            total_raw_proposals = tf.shape(raw_proposals)[0]
+        total_anchors = tf.shape(all_anchors)[0]
+
+        # Using the loc_pred and the anchors, we generate the proposals. The
+        # regression is shared among classes, so it's done only once.
+        raw_proposals = decode(all_anchors, loc_pred, self._variances)
+        # Clip boxes to image.
+        clipped_proposals = clip_boxes(raw_proposals, im_shape)
+
+        # Filter proposals that have an non-valid area.
+        (x_min, y_min, x_max, y_max) = tf.unstack(clipped_proposals, axis=1)
+        area_filter = tf.greater(
+            tf.maximum(x_max - x_min, 0.) * tf.maximum(y_max - y_min, 0.),
+            0.
+        )
+
+        # Log results of filtering non-valid area proposals
+        if self._with_summaries:
+            total_proposals = tf.reduce_sum(tf.to_int32(area_filter))
             tf.summary.scalar(
                 'invalid_proposals',
-                total_proposals - total_raw_proposals, ['ssd']
+                total_anchors - total_proposals, ['ssd']
             )
             tf.summary.scalar(
                 'valid_proposals_ratio',
-                tf.cast(total_anchors, tf.float32) /
-                tf.cast(total_proposals, tf.float32), ['ssd']
+                tf.cast(total_proposals, tf.float32) /
+                tf.cast(total_anchors, tf.float32), ['ssd']
             )
 
-            # We have to use the TensorFlow's bounding box convention to use
-            # the included function for NMS.
-            # After gathering results we should normalize it back.
-            class_proposal_tf = change_order(class_proposals)
+        # Flatten the confidences for all classes into (total_anchors *
+        # num_classes,) candidates, ordered by anchor and then by class (+ 1 is
+        # to ignore background).
+        class_cls_prob = tf.reshape(cls_prob[:, 1:], [-1])
+        class_labels = tf.tile(tf.range(self._num_classes), [total_anchors])
+        anchor_idx = tf.reshape(
+            tf.tile(
+                tf.expand_dims(tf.range(total_anchors), 1),
+                [1, self._num_classes]
+            ), [-1]
+        )
 
-            # Apply class NMS.
-            class_selected_idx = tf.image.non_max_suppression(
-                class_proposal_tf, class_cls_prob, self._class_max_detections,
-                iou_threshold=self._class_nms_threshold
-            )
+        # Filter by min_prob_threshold and valid area.
+        candidate_filter = tf.logical_and(
+            tf.greater_equal(class_cls_prob, self._min_prob_threshold),
+            tf.gather(area_filter, anchor_idx)
+        )
+        class_cls_prob = tf.boolean_mask(class_cls_prob, candidate_filter)
+        class_labels = tf.boolean_mask(class_labels, candidate_filter)
+        anchor_idx = tf.boolean_mask(anchor_idx, candidate_filter)
+        class_proposals = tf.gather(clipped_proposals, anchor_idx)
+
+        # Apply class NMS, for all the classes at once, over the top scoring
+        # candidates of each class. Results are grouped by class, as if NMS
+        # was applied on each class separately.
+        selected_idx = multiclass_non_max_suppression(
+            class_proposals, class_cls_prob, class_labels,
+            self._class_max_detections, self._class_nms_threshold
+        )
 
-            # Using NMS resulting indices, gather values from Tensors.
-            class_proposal_tf = tf.gather(
-                class_proposal_tf, class_selected_idx)
-            class_cls_prob = tf.gather(class_cls_prob, class_selected_idx)
-
-            # We append values to a regular list which will later be
-            # transformed to a proper Tensor.
-            selected_boxes.append(class_proposal_tf)
-            selected_probs.append(class_cls_prob)
-            # In the case of the class_id, since it is a loop on classes, we
-            # already have a fixed class_id. We use `tf.tile` to create that
-            # Tensor with the total number of indices returned by the NMS.
-            selected_labels.append(
-                tf.tile([class_id], [tf.shape(class_selected_idx)[0]])
-            )
-            selected_anchors.append(proposal_anchors)
-
-        # We use concat (axis=0) to generate a Tensor where the rows are
-        # stacked on top of each other
-        proposals_tf = tf.concat(selected_boxes, axis=0)
-        # Return to the original convention.
-        proposals = change_order(proposals_tf)
-        proposal_label = tf.concat(selected_labels, axis=0)
-        proposal_label_prob = tf.concat(selected_probs, axis=0)
-        proposal_anchors = tf.concat(selected_anchors, axis=0)
+        # Using NMS resulting indices, gather values from Tensors.
+        proposals = tf.gather(class_proposals, selected_idx)
+        proposal_label = tf.gather(class_labels, selected_idx)
+        proposal_label_prob = tf.gather(class_cls_prob, selected_idx)
+        proposal_anchors = tf.gather(
+            all_anchors, tf.gather(anchor_idx, selected_idx)
+        )
 
         # Get topK detections of all classes.
         k = tf.minimum(
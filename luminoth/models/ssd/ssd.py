@@ -16,14 +16,18 @@ from luminoth.utils.bbox_transform import clip_boxes
 
 class SSD(snt.AbstractModule):
     """SSD: Single Shot MultiBox Detector
+
+    When `with_summaries` is `False`, neither this module nor its submodules
+    add summary ops to the graph, which is meant for inference-only graphs.
     """
 
-    def __init__(self, config, name='ssd'):
+    def __init__(self, config, name='ssd', with_summaries=True):
         super(SSD, self).__init__(name=name)
         self._config = config.model
         self._num_classes = config.model.network.num_classes
         self._debug = config.train.debug
         self._seed = config.train.seed
+        self._with_summaries = with_summaries
         self._anchor_max_scale = config.model.anchors.max_scale
         self._anchor_min_scale = config.model.anchors.min_scale
         self._anchor_ratios = np.array(config.model.anchors.ratios)
@@ -40,7 +44,9 @@ class SSD(snt.AbstractModule):
 
         Args:
             image: A tensor with the image.
-                Its shape should be `(height, width, 3)`.
+                Its shape should be `(height, width, 3)`. For batched
+                inference, it can also be `(batch_size, height, width, 3)`
+                with a static `batch_size`.
             gt_boxes: A tensor with all the ground truth boxes of that image.
                 Its shape should be `(num_gt_boxes, 5)`
                 Where for each gt box we have (x1, y1, x2, y2, label),
@@ -58,15 +64,29 @@ class SSD(snt.AbstractModule):
                     for the label of each proposal.
             bbox_offsets: A tensor with the predicted bbox_offsets
             class_scores: A tensor with the predicted classes scores
+
+            For batched inference, a list with a dictionary holding the
+            `classification_prediction` of each image is returned instead.
         """
         # Reshape image
-        self.image_shape.append(3)  # Add channels to shape
-        image.set_shape(self.image_shape)
-        image = tf.expand_dims(image, 0, name='hardcode_batch_size_to_1')
+        batched = image.shape.ndims == 4
+        image_shape = self.image_shape + [3]  # Add channels to shape
+        if batched:
+            batch_size = image.shape[0].value
+            if batch_size is None:
+                raise ValueError(
+                    'Batched inference requires a known batch size.'
+                )
+            image.set_shape([batch_size] + image_shape)
+        else:
+            batch_size = 1
+            image.set_shape(image_shape)
+            image = tf.expand_dims(image, 0, name='hardcode_batch_size_to_1')
 
         # Generate feature maps from image
         self.feature_extractor = SSDFeatureExtractor(
-            self._config.base_network, parent_name=self.module_name
+            self._config.base_network, parent_name=self.module_name,
+            with_summaries=self._with_summaries
         )
         feature_maps = self.feature_extractor(image, is_training=is_training)
 
@@ -85,7 +105,7 @@ class SSD(snt.AbstractModule):
                     name=multibox_predictor_name + '_offsets_conv'
                 )(feat_map)
                 bbox_offsets_flattened = tf.reshape(
-                    bbox_offsets_layer, [-1, 4]
+                    bbox_offsets_layer, [batch_size, -1, 4]
                 )
                 bbox_offsets_list.append(bbox_offsets_flattened)
 
@@ -95,14 +115,15 @@ class SSD(snt.AbstractModule):
                     name=multibox_predictor_name + '_classes_conv',
                 )(feat_map)
                 class_scores_flattened = tf.reshape(
-                    class_scores_layer, [-1, self._num_classes + 1]
+                    class_scores_layer,
+                    [batch_size, -1, self._num_classes + 1]
                 )
                 class_scores_list.append(class_scores_flattened)
         bbox_offsets = tf.concat(
-            bbox_offsets_list, axis=0, name='concatenate_all_bbox_offsets'
+            bbox_offsets_list, axis=1, name='concatenate_all_bbox_offsets'
         )
         class_scores = tf.concat(
-            class_scores_list, axis=0, name='concatenate_all_class_scores'
+            class_scores_list, axis=1, name='concatenate_all_class_scores'
         )
         class_probabilities = tf.nn.softmax(
             class_scores, axis=-1, name='class_probabilities_softmax'
@@ -128,6 +149,30 @@ class SSD(snt.AbstractModule):
         anchors = np.concatenate(anchors_list, axis=0)
         anchors = tf.convert_to_tensor(anchors, dtype=tf.float32)
 
+        proposals_creator = SSDProposal(
+            self._num_classes, self._config.proposals,
+            self._config.variances, with_summaries=self._with_summaries
+        )
+        im_shape = tf.cast(tf.shape(image)[1:3], tf.float32)
+
+        if batched:
+            # Anchors are the same for every image of the batch, so we only
+            # need to generate the proposals separately.
+            return [
+                {
+                    'classification_prediction': proposals_creator(
+                        class_probabilities[idx], bbox_offsets[idx], anchors,
+                        im_shape
+                    ),
+                }
+                for idx in range(batch_size)
+            ]
+
+        # Remove the batch dimension.
+        bbox_offsets = bbox_offsets[0]
+        class_scores = class_scores[0]
+        class_probabilities = class_probabilities[0]
+
         # This is the dict we'll return after filling it with SSD's results
         prediction_dict = {}
 
@@ -177,13 +222,8 @@ class SSD(snt.AbstractModule):
         # We generate proposals when predicting, or when debug=True for
         # generating visualizations during training.
         if not is_training or self._debug:
-            proposals_creator = SSDProposal(
-                self._num_classes, self._config.proposals,
-                self._config.variances
-            )
             proposals = proposals_creator(
-                class_probabilities, bbox_offsets, anchors,
-                tf.cast(tf.shape(image)[1:3], tf.float32)
+                class_probabilities, bbox_offsets, anchors, im_shape
             )
             prediction_dict['classification_prediction'] = proposals
 
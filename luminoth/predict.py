@@ -1,21 +1,36 @@
 import click
+import collections
 import json
 import numpy as np
 import os
 import skvideo.io
 import sys
+import threading
 import time
 import tensorflow as tf
 
 from PIL import Image
+from six.moves import queue
 from luminoth.tools.checkpoint import get_checkpoint_config
 from luminoth.utils.config import get_config, override_config_params
-from luminoth.utils.predicting import PredictorNetwork
+from luminoth.utils.predicting import PredictorNetwork, columns_to_objects
 from luminoth.vis import build_colormap, vis_objects
 
 IMAGE_FORMATS = ['jpg', 'jpeg', 'png']
 VIDEO_FORMATS = ['mov', 'mp4', 'avi']  # TODO: check if more formats work
 
+# Number of images read ahead (and waiting to be saved) when predicting a
+# list of images, and threads used for each of those tasks.
+DEFAULT_IMAGE_PREFETCH = 4
+DEFAULT_IMAGE_IO_THREADS = 2
+
+# Maximum number of video frames waiting to go through each stage of the
+# prediction (inference and encoding).
+VIDEO_QUEUE_SIZE = 16
+
+# Marks the end of the frames going through a stage.
+_END_OF_VIDEO = object()
+
 
 def get_file_type(filename):
     extension = filename.split('.')[-1].lower()
@@ -56,49 +71,287 @@ def resolve_files(path_or_dir):
     return paths
 
 
-def filter_classes(objects, only_classes=None, ignore_classes=None):
+def filter_classes(objects, only_classes=None, ignore_classes=None,
+                   min_prob=None, max_detections=None):
     if ignore_classes:
         objects = [o for o in objects if o['label'] not in ignore_classes]
 
     if only_classes:
         objects = [o for o in objects if o['label'] in only_classes]
 
+    # Only needed when the model doesn't filter the objects itself (i.e. when
+    # loaded from a frozen graph). Objects are sorted by probability.
+    if min_prob is not None:
+        objects = [o for o in objects if o['prob'] >= min_prob]
+
+    if max_detections is not None:
+        objects = objects[:max_detections]
+
     return objects
 
 
-def predict_image(network, path, only_classes=None, ignore_classes=None,
-                  save_path=None):
-    click.echo('Predicting {}...'.format(path), nl=False)
+def filter_columns(columns, only_classes=None, ignore_classes=None,
+                   min_prob=None, max_detections=None):
+    """Same as `filter_classes`, for objects predicted with `columnar=True`.
+    """
+    keep = np.arange(len(columns['probs']))
+
+    if min_prob is not None:
+        keep = keep[columns['probs'][keep] >= min_prob]
+
+    if ignore_classes or only_classes:
+        keep = keep[np.array([
+            (not ignore_classes or label not in ignore_classes) and
+            (not only_classes or label in only_classes)
+            for label in columns['labels'][keep].tolist()
+        ], dtype=bool)]
+
+    if max_detections is not None:
+        keep = keep[:max_detections]
+
+    return {name: values[keep] for name, values in columns.items()}
+
+
+class StageStats(object):
+    """Counts the frames a stage of a pipeline processes and its busy time.
+
+    Stages run by several threads add up the time each one is busy.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy_time = 0.
+        self._lock = threading.Lock()
+
+    def add(self, start_time):
+        with self._lock:
+            self.frames += 1
+            self.busy_time += time.time() - start_time
+
+    def __str__(self):
+        return '{}: {:.1f} fps'.format(
+            self.name,
+            self.frames / self.busy_time if self.busy_time else 0.
+        )
+
+
+def _start_thread(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class _Task(object):
+    """Function call submitted to a `_ThreadPool`."""
+
+    def __init__(self, fn, args):
+        self._fn = fn
+        self._args = args
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
 
-    # Open and read the image to predict.
+    def run(self):
+        try:
+            self._result = self._fn(*self._args)
+        except Exception as e:
+            self._error = e
+        self._done.set()
+
+    def wait(self):
+        """Blocks until the call finishes, returning its result.
+
+        Exceptions raised by the call are raised again here.
+        """
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _ThreadPool(object):
+    """Runs the submitted calls on a fixed number of daemon threads."""
+
+    def __init__(self, num_threads):
+        self._tasks = queue.Queue()
+        for _ in range(num_threads):
+            _start_thread(self._run)
+
+    def submit(self, fn, *args):
+        task = _Task(fn, args)
+        self._tasks.put(task)
+        return task
+
+    def _run(self):
+        while True:
+            self._tasks.get().run()
+
+
+def load_image(path):
+    """Reads the image in `path` (through `tf.gfile`) as RGB."""
     with tf.gfile.Open(path, 'rb') as f:
+        return Image.open(f).convert('RGB')
+
+
+def _save_image(image, objects, save_path):
+    vis_objects(np.array(image), objects).save(save_path)
+
+
+def predict_images(network, paths, only_classes=None, ignore_classes=None,
+                   save_paths=None, min_prob=None, max_detections=None,
+                   tile_size=None, tile_overlap=None,
+                   prefetch=DEFAULT_IMAGE_PREFETCH,
+                   io_threads=DEFAULT_IMAGE_IO_THREADS):
+    """Runs the images in `paths` through the network.
+
+    While an image runs through the network, the next `prefetch` images are
+    read and decoded by a pool of `io_threads` threads, and another pool of
+    the same size draws the objects on the previous ones and saves them, so
+    the network is kept busy.
+
+    Args:
+        save_paths: List with the path to save each image (with its objects
+            drawn) to, or `None` for the images that shouldn't be saved.
+
+    Yields:
+        Tuples of `(path, objects)`, in the same order as `paths`. `objects`
+        is `None` for the images that can't be read.
+    """
+    if save_paths is None:
+        save_paths = [None] * len(paths)
+
+    stats = [
+        StageStats('decode'), StageStats('inference'), StageStats('save')
+    ]
+
+    def read(path):
+        start_time = time.time()
+        image = load_image(path)
+        stats[0].add(start_time)
+        return image
+
+    def save(image, objects, save_path):
+        start_time = time.time()
+        _save_image(image, objects, save_path)
+        stats[2].add(start_time)
+
+    read_pool = _ThreadPool(io_threads)
+    save_pool = _ThreadPool(io_threads)
+    pending_reads = collections.deque()
+    pending_saves = collections.deque()
+
+    start_time = time.time()
+    for idx, (path, save_path) in enumerate(zip(paths, save_paths)):
+        # Keep the next `prefetch` images being read.
+        for next_path in paths[idx + len(pending_reads):idx + prefetch + 1]:
+            pending_reads.append(read_pool.submit(read, next_path))
+
+        click.echo('Predicting {}...'.format(path), nl=False)
         try:
-            image = Image.open(f).convert('RGB')
+            image = pending_reads.popleft().wait()
         except (tf.errors.OutOfRangeError, OSError) as e:
             click.echo()
             click.echo('Error while processing {}: {}'.format(path, e))
-            return
+            yield path, None
+            continue
+
+        # Run image through the network, in tiles if requested.
+        inference_start = time.time()
+        if tile_size:
+            objects = network.predict_tiled(
+                image, tile_size=tile_size, overlap=tile_overlap
+            )
+        else:
+            objects = network.predict_image(image)
+
+        # Filter the results according to the user input.
+        objects = filter_classes(
+            objects,
+            only_classes=only_classes,
+            ignore_classes=ignore_classes,
+            min_prob=min_prob,
+            max_detections=max_detections,
+        )
+        stats[1].add(inference_start)
+
+        # Save predicted image, without waiting for more than `prefetch`
+        # images in line.
+        if save_path:
+            while len(pending_saves) > prefetch:
+                pending_saves.popleft().wait()
+            pending_saves.append(
+                save_pool.submit(save, image, objects, save_path)
+            )
 
-    # Run image through the network.
-    objects = network.predict_image(image)
+        click.echo(' done.')
+        yield path, objects
 
-    # Filter the results according to the user input.
-    objects = filter_classes(
-        objects,
-        only_classes=only_classes,
-        ignore_classes=ignore_classes
-    )
+    for task in pending_saves:
+        task.wait()
 
-    # Save predicted image.
-    if save_path:
-        vis_objects(np.array(image), objects).save(save_path)
+    if stats[1].frames:
+        click.echo(
+            'Predicted {} images in {:.2f}s ({}).'.format(
+                stats[1].frames, time.time() - start_time,
+                ', '.join(str(stage) for stage in stats if stage.frames)
+            )
+        )
 
-    click.echo(' done.')
-    return objects
+
+def _decode_video(path, frames, stats):
+    """Decodes the frames of the video in `path` into the `frames` queue.
+
+    Errors are put in the queue too, so they're raised by whoever reads it.
+    """
+    try:
+        reader = skvideo.io.vreader(path)
+        while True:
+            start_time = time.time()
+            try:
+                frame = next(reader)
+            except StopIteration:
+                break
+            stats.add(start_time)
+            frames.put(frame)
+    except Exception as e:
+        frames.put(e)
+    finally:
+        frames.put(_END_OF_VIDEO)
+
+
+def _encode_video(writer, predictions, colormap, stats, errors):
+    """Draws the objects on each frame and writes it to the video.
+
+    The first error found is added to `errors`, and the rest of the frames
+    are skipped (though still read, so the other stages don't get stuck).
+    """
+    while True:
+        item = predictions.get()
+        if item is _END_OF_VIDEO:
+            return
+        if errors:
+            continue
+
+        start_time = time.time()
+        frame, objects = item
+        try:
+            image = vis_objects(frame, objects, colormap=colormap)
+            writer.writeFrame(np.array(image))
+        except Exception as e:
+            errors.append(e)
+        stats.add(start_time)
 
 
 def predict_video(network, path, only_classes=None, ignore_classes=None,
-                  save_path=None):
+                  save_path=None, min_prob=None, max_detections=None):
+    """Runs the frames of a video through the network.
+
+    Decoding, inference and drawing the objects and encoding the output video
+    each run on a different thread, with up to `VIDEO_QUEUE_SIZE` frames
+    waiting in between, so the frame rate is that of the slowest stage
+    (usually inference) instead of the sum of all of them.
+    """
     if save_path:
         # We hardcode the video output to mp4 for the time being.
         save_path = os.path.splitext(save_path)[0] + '.mp4'
@@ -119,27 +372,51 @@ def predict_video(network, path, only_classes=None, ignore_classes=None,
     num_of_frames = int(skvideo.io.ffprobe(path)['video']['@nb_frames'])
 
     video_progress_bar = click.progressbar(
-        skvideo.io.vreader(path),
         length=num_of_frames,
         label='Predicting {}'.format(path)
     )
 
     colormap = build_colormap()
 
+    stats = [StageStats('decode'), StageStats('inference')]
+    frames = queue.Queue(maxsize=VIDEO_QUEUE_SIZE)
+    _start_thread(_decode_video, path, frames, stats[0])
+
+    if save_path:
+        stats.append(StageStats('encode'))
+        predictions = queue.Queue(maxsize=VIDEO_QUEUE_SIZE)
+        encode_errors = []
+        encoder = _start_thread(
+            _encode_video, writer, predictions, colormap, stats[2],
+            encode_errors
+        )
+
     objects_per_frame = []
     with video_progress_bar as bar:
         try:
             start_time = time.time()
-            for idx, frame in enumerate(bar):
+            idx = 0
+            while True:
+                frame = frames.get()
+                if frame is _END_OF_VIDEO:
+                    break
+                if isinstance(frame, Exception):
+                    raise frame
+
                 # Run image through network.
-                objects = network.predict_image(frame)
+                inference_start = time.time()
+                columns = network.predict_image(frame, columnar=True)
 
-                # Filter the results according to the user input.
-                objects = filter_classes(
-                    objects,
+                # Filter the results according to the user input, before
+                # turning them into dicts.
+                objects = columns_to_objects(filter_columns(
+                    columns,
                     only_classes=only_classes,
-                    ignore_classes=ignore_classes
-                )
+                    ignore_classes=ignore_classes,
+                    min_prob=min_prob,
+                    max_detections=max_detections,
+                ))
+                stats[1].add(inference_start)
 
                 objects_per_frame.append({
                     'frame': idx,
@@ -148,17 +425,31 @@ def predict_video(network, path, only_classes=None, ignore_classes=None,
 
                 # Draw the image and write it to the video file.
                 if save_path:
-                    image = vis_objects(frame, objects, colormap=colormap)
-                    writer.writeFrame(np.array(image))
+                    predictions.put((frame, objects))
+
+                bar.update(1)
+                idx += 1
+
+            if save_path:
+                predictions.put(_END_OF_VIDEO)
+                encoder.join()
+                if encode_errors:
+                    raise encode_errors[0]
 
             stop_time = time.time()
             click.echo(
-                'fps: {0:.1f}'.format(num_of_frames / (stop_time - start_time))
+                'fps: {0:.1f} ({1})'.format(
+                    len(objects_per_frame) / (stop_time - start_time),
+                    ', '.join(str(stage) for stage in stats)
+                )
             )
         except RuntimeError as e:
             click.echo()  # Error prints next to progress bar otherwise.
             click.echo('Error while processing {}: {}'.format(path, e))
             if save_path:
+                # Write the frames predicted so far.
+                predictions.put(_END_OF_VIDEO)
+                encoder.join()
                 click.echo(
                     'Partially processed video file saved in {}'.format(
                         save_path
@@ -171,10 +462,46 @@ def predict_video(network, path, only_classes=None, ignore_classes=None,
     return objects_per_frame
 
 
+def build_network(config_files, checkpoint, override_params, min_prob,
+                  max_detections, batch_size=1):
+    # Resolve the config to use.
+    if checkpoint:
+        config = get_checkpoint_config(checkpoint)
+    elif config_files:
+        config = get_config(config_files)
+    else:
+        click.echo(
+            'Neither checkpoint not config specified, assuming `accurate`.'
+        )
+        config = get_checkpoint_config('accurate')
+
+    if override_params:
+        config = override_config_params(config, override_params)
+
+    # Filter bounding boxes according to `min_prob` and `max_detections`.
+    if config.model.type == 'fasterrcnn':
+        if config.model.network.with_rcnn:
+            config.model.rcnn.proposals.total_max_detections = max_detections
+        else:
+            config.model.rpn.proposals.post_nms_top_n = max_detections
+        config.model.rcnn.proposals.min_prob_threshold = min_prob
+    elif config.model.type == 'ssd':
+        config.model.proposals.total_max_detections = max_detections
+        config.model.proposals.min_prob_threshold = min_prob
+    else:
+        raise ValueError(
+            "Model type '{}' not supported".format(config.model.type)
+        )
+
+    # Instantiate the model indicated by the config.
+    return PredictorNetwork(config, batch_size=batch_size)
+
+
 @click.command(help="Obtain a model's predictions.")
 @click.argument('path-or-dir', nargs=-1)
 @click.option('config_files', '--config', '-c', multiple=True, help='Config to use.')  # noqa
 @click.option('--checkpoint', help='Checkpoint to use.')
+@click.option('--frozen-graph', help='Frozen graph to use, as exported by `lumi checkpoint freeze`.')  # noqa
 @click.option('override_params', '--override', '-o', multiple=True, help='Override model config params.')  # noqa
 @click.option('output_path', '--output', '-f', default='-', help='Output file with the predictions (for example, JSON bounding boxes).')  # noqa
 @click.option('--save-media-to', '-d', help='Directory to store media to.')
@@ -182,19 +509,32 @@ def predict_video(network, path, only_classes=None, ignore_classes=None,
 @click.option('--max-detections', default=100, type=int, help='Maximum number of detections per image.')  # noqa
 @click.option('--only-class', '-k', default=None, multiple=True, help='Class to ignore when predicting.')  # noqa
 @click.option('--ignore-class', '-K', default=None, multiple=True, help='Class to ignore when predicting.')  # noqa
+@click.option('--tile-size', type=int, help='Split images into tiles of this size (in pixels), instead of downsizing them. Useful for very large images.')  # noqa
+@click.option('--tile-overlap', default=100, type=int, help='Minimum overlap between tiles, in pixels.')  # noqa
+@click.option('--tile-batch-size', default=1, type=int, help='Number of tiles to run through the network at once.')  # noqa
+@click.option('--prefetch', default=DEFAULT_IMAGE_PREFETCH, type=int, help='Number of images to read ahead while predicting.')  # noqa
+@click.option('--io-threads', default=DEFAULT_IMAGE_IO_THREADS, type=int, help='Number of threads reading images, and of threads saving them.')  # noqa
 @click.option('--debug', is_flag=True, help='Set debug level logging.')
-def predict(path_or_dir, config_files, checkpoint, override_params,
-            output_path, save_media_to, min_prob, max_detections, only_class,
-            ignore_class, debug):
+def predict(path_or_dir, config_files, checkpoint, frozen_graph,
+            override_params, output_path, save_media_to, min_prob,
+            max_detections, only_class, ignore_class, tile_size, tile_overlap,
+            tile_batch_size, prefetch, io_threads, debug):
     """Obtain a model's predictions.
 
     Receives either `config_files` or `checkpoint` in order to load the correct
-    model. Afterwards, runs the model through the inputs specified by
-    `path-or-dir`, returning predictions according to the format specified by
-    `output`.
+    model, or `frozen-graph` to skip building it. Afterwards, runs the model
+    through the inputs specified by `path-or-dir`, returning predictions
+    according to the format specified by `output`.
 
     Additional model behavior may be modified with `min-prob`, `only-class` and
     `ignore-class`.
+
+    Images larger than `tile-size` are split into tiles overlapping by
+    `tile-overlap` pixels, which are run through the network
+    `tile-batch-size` at a time. Videos are never split.
+
+    Images are read `prefetch` at a time ahead of the one being predicted,
+    using `io-threads` threads, so the model doesn't wait for them.
     """
     if debug:
         tf.logging.set_verbosity(tf.logging.DEBUG)
@@ -207,6 +547,19 @@ def predict(path_or_dir, config_files, checkpoint, override_params,
         )
         return
 
+    if prefetch < 0 or io_threads < 1:
+        click.echo(
+            '`prefetch` must be non-negative and `io-threads` at least 1.'
+        )
+        return
+
+    if tile_size and not 0 <= tile_overlap < tile_size:
+        click.echo(
+            '`tile-overlap` must be non-negative and smaller than '
+            '`tile-size`.'
+        )
+        return
+
     # Process the input and get the actual files to predict.
     files = resolve_files(path_or_dir)
     if not files:
@@ -229,58 +582,54 @@ def predict(path_or_dir, config_files, checkpoint, override_params,
     if save_media_to:
         tf.gfile.MakeDirs(save_media_to)
 
-    # Resolve the config to use and initialize the model.
-    if checkpoint:
-        config = get_checkpoint_config(checkpoint)
-    elif config_files:
-        config = get_config(config_files)
-    else:
-        click.echo(
-            'Neither checkpoint not config specified, assuming `accurate`.'
-        )
-        config = get_checkpoint_config('accurate')
-
-    if override_params:
-        config = override_config_params(config, override_params)
+    # Initialize the model, timing how long it takes to be ready.
+    start = time.time()
+    if frozen_graph:
+        if checkpoint or config_files or override_params:
+            click.echo(
+                'Using frozen graph; ignoring checkpoint, config and '
+                'overrides.'
+            )
+        network = PredictorNetwork.from_frozen_graph(frozen_graph)
 
-    # Filter bounding boxes according to `min_prob` and `max_detections`.
-    if config.model.type == 'fasterrcnn':
-        if config.model.network.with_rcnn:
-            config.model.rcnn.proposals.total_max_detections = max_detections
-        else:
-            config.model.rpn.proposals.post_nms_top_n = max_detections
-        config.model.rcnn.proposals.min_prob_threshold = min_prob
-    elif config.model.type == 'ssd':
-        config.model.proposals.total_max_detections = max_detections
-        config.model.proposals.min_prob_threshold = min_prob
+        # The frozen graph returns every prediction, so they must be filtered
+        # afterwards.
+        filter_min_prob = min_prob
+        filter_max_detections = max_detections
     else:
-        raise ValueError(
-            "Model type '{}' not supported".format(config.model.type)
+        network = build_network(
+            config_files, checkpoint, override_params, min_prob,
+            max_detections,
+            batch_size=tile_batch_size if tile_size else 1
         )
+        filter_min_prob = None
+        # Each tile has up to `max_detections` objects.
+        filter_max_detections = max_detections if tile_size else None
+    click.echo('Model loaded in {:.2f}s.'.format(time.time() - start))
 
-    # Instantiate the model indicated by the config.
-    network = PredictorNetwork(config)
-
-    # Iterate over files and run the model on each.
-    for file in files:
-
+    def get_save_path(file):
         # Get the media output path, if media storage is requested.
-        save_path = os.path.join(
+        return os.path.join(
             save_media_to, 'pred_{}'.format(os.path.basename(file))
         ) if save_media_to else None
 
-        file_type = get_file_type(file)
-        predictor = predict_image if file_type == 'image' else predict_video
-
-        objects = predictor(
-            network, file,
-            only_classes=only_class,
-            ignore_classes=ignore_class,
-            save_path=save_path,
-        )
-
-        # TODO: Not writing jsons for video files for now.
-        if objects is not None and file_type == 'image':
+    # Run the model on the images, reading the next ones (and saving the
+    # previous ones) while each of them is being predicted.
+    images = [file for file in files if get_file_type(file) == 'image']
+    predictions = predict_images(
+        network, images,
+        only_classes=only_class,
+        ignore_classes=ignore_class,
+        save_paths=[get_save_path(file) for file in images],
+        min_prob=filter_min_prob,
+        max_detections=filter_max_detections,
+        tile_size=tile_size,
+        tile_overlap=tile_overlap,
+        prefetch=prefetch,
+        io_threads=io_threads,
+    )
+    for file, objects in predictions:
+        if objects is not None:
             output.write(
                 json.dumps({
                     'file': file,
@@ -288,4 +637,18 @@ def predict(path_or_dir, config_files, checkpoint, override_params,
                 }) + '\n'
             )
 
+    # TODO: Not writing jsons for video files for now.
+    for file in files:
+        if get_file_type(file) != 'video':
+            continue
+
+        predict_video(
+            network, file,
+            only_classes=only_class,
+            ignore_classes=ignore_class,
+            save_path=get_save_path(file),
+            min_prob=filter_min_prob,
+            max_detections=filter_max_detections,
+        )
+
     output.close()
@@ -5,8 +5,10 @@ ease of use. This API is common among different implementations, abstracting
 away the pecularities of each task model. Thus, no knowledge of the inner
 workings of said models should be needed to use any of these classes.
 """
+import numpy as np
+
 from luminoth.tools.checkpoint import get_checkpoint_config
-from luminoth.utils.predicting import PredictorNetwork
+from luminoth.utils.predicting import PredictorNetwork, columns_to_objects
 
 
 class Detector(object):
@@ -29,7 +31,8 @@ class Detector(object):
 
     DEFAULT_CHECKPOINT = 'accurate'
 
-    def __init__(self, checkpoint=None, config=None, prob=0.7, classes=None):
+    def __init__(self, checkpoint=None, config=None, prob=0.7, classes=None,
+                 batch_size=1, frozen_graph=None):
         """Instantiate a detector object with the appropriate config.
 
         Arguments:
@@ -37,18 +40,34 @@ class Detector(object):
                 detector as.
             config (dict): Configuration parameters describing the desired
                 model. See `get_config` to load a config file.
+            batch_size (int): Number of images to run through the model at
+                once when predicting over multiple images.
+            frozen_graph (str): Path to a graph exported with
+                `lumi checkpoint freeze`. Loading it skips building the model,
+                but predictions are made one image at a time.
 
         Note:
-            Only one of the parameters must be specified. If none is, we
-            default to loading the checkpoint indicated by
-            `DEFAULT_CHECKPOINT`.
+            Only one of `checkpoint`, `config` or `frozen_graph` must be
+            specified. If none is, we default to loading the checkpoint
+            indicated by `DEFAULT_CHECKPOINT`.
         """
-        if checkpoint is not None and config is not None:
+        specified = [
+            param for param in (checkpoint, config, frozen_graph)
+            if param is not None
+        ]
+        if len(specified) > 1:
             raise ValueError(
-                'Only one of `checkpoint` or `config` must be specified in '
-                'order to instantiate a Detector.'
+                'Only one of `checkpoint`, `config` or `frozen_graph` must be '
+                'specified in order to instantiate a Detector.'
             )
 
+        self.prob = prob
+
+        if frozen_graph is not None:
+            self._network = PredictorNetwork.from_frozen_graph(frozen_graph)
+            self._set_classes(classes)
+            return
+
         if checkpoint is None and config is None:
             # Neither checkpoint no config specified, default to
             # `DEFAULT_CHECKPOINT`.
@@ -68,14 +87,14 @@ class Detector(object):
 
         # TODO: Remove dependency on `PredictorNetwork` or clearly separate
         # responsibilities.
-        self._network = PredictorNetwork(config)
-
-        self.prob = prob
+        self._network = PredictorNetwork(config, batch_size=batch_size)
+        self._set_classes(classes)
 
+    def _set_classes(self, classes):
         # Use the labels when available, integers when not.
         self._model_classes = (
             self._network.class_labels if self._network.class_labels
-            else list(range(config.model.network.num_classes))
+            else list(range(self._network.num_classes))
         )
         if classes:
             self.classes = set(classes)
@@ -143,15 +162,17 @@ class Detector(object):
         else:
             classes = set(classes)
 
-        # TODO: Remove the loop once (and if) we implement batch sizes. Neither
-        # Faster R-CNN nor SSD support batch size yet, so it's the same for
-        # now.
+        # Filter the objects as arrays, so only the ones kept are turned into
+        # dicts.
         predictions = []
-        for image in images:
-            predictions.append([
-                pred for pred in self._network.predict_image(image)
-                if pred['prob'] >= prob and pred['label'] in classes
-            ])
+        for columns in self._network.predict_images(images, columnar=True):
+            keep = np.flatnonzero(columns['probs'] >= prob)
+            keep = keep[np.array([
+                label in classes for label in columns['labels'][keep].tolist()
+            ], dtype=bool)]
+            predictions.append(columns_to_objects({
+                name: values[keep] for name, values in columns.items()
+            }))
 
         if single_image:
             predictions = predictions[0]
@@ -7,6 +7,7 @@ import requests
 import tarfile
 import tempfile
 import tensorflow as tf
+import time
 import uuid
 
 from datetime import datetime
@@ -14,10 +15,12 @@ from datetime import datetime
 from luminoth import __version__ as lumi_version
 from luminoth.utils.config import get_config
 from luminoth.utils.homedir import get_luminoth_home
+from luminoth.utils.predicting import PredictorNetwork
 
 
 CHECKPOINT_INDEX = 'checkpoints.json'
 CHECKPOINT_PATH = 'checkpoints'
+FROZEN_GRAPH_FILENAME = 'frozen_graph.pb'
 REMOTE_INDEX_URL = (
     'https://github.com/tryolabs/luminoth/releases/download/v0.0.3/'
     'checkpoints.json'
@@ -628,6 +631,43 @@ def export(id_or_alias, output):
     click.echo('Checkpoint {} exported successfully.'.format(checkpoint['id']))
 
 
+@click.command(help='Freeze a checkpoint into an inference-only graph.')
+@click.argument('id_or_alias')
+@click.option('--output', help="Output file. Defaults to the checkpoint's directory.")  # noqa
+def freeze(id_or_alias, output):
+    try:
+        config = get_checkpoint_config(id_or_alias, prompt=False)
+    except ValueError as e:
+        click.echo('Unable to freeze checkpoint: {}'.format(e))
+        return
+
+    if not output:
+        output = os.path.join(config.dataset.dir, FROZEN_GRAPH_FILENAME)
+
+    # Predictions are filtered by the callers when loading the frozen graph.
+    if config.model.type == 'fasterrcnn':
+        config.model.rcnn.proposals.min_prob_threshold = 0.0
+    elif config.model.type == 'ssd':
+        config.model.proposals.min_prob_threshold = 0.0
+    config.train.debug = False
+
+    start = time.time()
+    network = PredictorNetwork(config)
+    build_time = time.time() - start
+
+    network.export_frozen_graph(output)
+
+    start = time.time()
+    PredictorNetwork.from_frozen_graph(output)
+    load_time = time.time() - start
+
+    click.echo('Checkpoint frozen into {}.'.format(output))
+    click.echo(
+        'Startup time: {:.2f}s building the model, {:.2f}s loading the '
+        'frozen graph.'.format(build_time, load_time)
+    )
+
+
 @click.command(help='Import a checkpoint tar into the local index.')
 @click.argument('path')
 def import_(path):
@@ -723,6 +763,7 @@ checkpoint.add_command(delete)
 checkpoint.add_command(download)
 checkpoint.add_command(edit)
 checkpoint.add_command(export)
+checkpoint.add_command(freeze)
 checkpoint.add_command(import_, name='import')
 checkpoint.add_command(info)
 checkpoint.add_command(list)
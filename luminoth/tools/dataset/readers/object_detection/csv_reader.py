@@ -173,7 +173,7 @@ class CSVReader(ObjectDetectionReader):
                 'image_raw': image,
                 'gt_boxes': gt_boxes,
             }
-            self._will_add_record(record)
+            self._will_add_record(record, key=image_path)
             self.yielded_records += 1
 
             yield record
@@ -112,7 +112,7 @@ class ImageNetReader(ObjectDetectionReader):
                 'gt_boxes': gt_boxes,
             }
 
-            self._will_add_record(record)
+            self._will_add_record(record, key=image_path)
             self.yielded_records += 1
 
             yield record
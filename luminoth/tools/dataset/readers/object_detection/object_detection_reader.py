@@ -27,7 +27,15 @@ class ObjectDetectionReader(BaseReader):
 
     Additionally, must use the `_per_class_counter` variable to honor the max
     number of examples per class in an efficient way.
+
+    Readers that call `_should_skip` for every record, and yield it (if at
+    all) before moving on to the next one, support being split into
+    partitions (see `set_partition`) so several processes can read the
+    dataset at once.
     """
+
+    _partitionable = True
+
     def __init__(self, only_classes=None, only_images=None,
                  limit_examples=None, class_examples=None, **kwargs):
         """
@@ -59,6 +67,15 @@ class ObjectDetectionReader(BaseReader):
         self._per_class_counter = Counter()
         self._maxed_out_classes = set()
 
+        self._num_partitions = 1
+        self._partition_index = 0
+        # Position of the current record among the records not skipped by the
+        # reader options, which determines its partition.
+        self._num_candidates = 0
+        self.current_position = None
+        # Key of the last record about to be yielded (see `get_record_key`).
+        self.current_key = None
+
     @property
     def total(self):
         if self._total is None:
@@ -87,6 +104,44 @@ class ObjectDetectionReader(BaseReader):
         Returns a list of all the classes available in the dataset.
         """
 
+    @property
+    def supports_partitioning(self):
+        # Stopping once every class has enough examples depends on all the
+        # records read before, so it can only be done sequentially.
+        return self._partitionable and self._class_examples is None
+
+    def set_partition(self, num_partitions, index):
+        """
+        Makes the reader only yield the records of the `index`-th of
+        `num_partitions` partitions of the dataset.
+
+        Records are assigned to partitions in a round-robin fashion, and
+        `current_position` holds the position (over the whole dataset) of the
+        last yielded record, so the output of the partitions can be merged
+        back in order.
+        """
+        if not self.supports_partitioning:
+            raise ValueError(
+                '{} can\'t be partitioned.'.format(type(self).__name__)
+            )
+
+        self._num_partitions = num_partitions
+        self._partition_index = index
+
+    def get_record_key(self, record):
+        """
+        Returns a key that identifies `record`, the last one yielded by
+        `iterate`, among all the records of the dataset (unlike its
+        filename, which may only be the basename of its image).
+
+        Defaults to the key given by the reader to `_will_add_record`, such
+        as the full path of the image, or else to the name of the reader and
+        the record's filename.
+        """
+        if self.current_key is not None:
+            return self.current_key
+        return '{}:{}'.format(type(self).__name__, record['filename'])
+
     def pretty_name(self, label):
         """
         Return the "pretty" name for easy human identification of a given
@@ -137,6 +192,16 @@ class ObjectDetectionReader(BaseReader):
             if image_id not in self._only_images:
                 return True
 
+        self.current_position = self._num_candidates
+        self._num_candidates += 1
+        if (
+            self._num_partitions > 1 and
+            self.current_position % self._num_partitions !=
+            self._partition_index
+        ):
+            # Skip because the record belongs to another partition.
+            return True
+
         return False
 
     def _all_maxed_out(self):
@@ -155,10 +220,17 @@ class ObjectDetectionReader(BaseReader):
 
         return False
 
-    def _will_add_record(self, record):
+    def _will_add_record(self, record, key=None):
         """
         Called whenever a new record is to be added.
+
+        Args:
+            - record: The record about to be yielded.
+            - key: String that identifies the record in the dataset, such as
+                the full path of its image (see `get_record_key`).
         """
+        self.current_key = key
+
         # Adjust per-class counter from totals from current record
         for box in record['gt_boxes']:
             self._per_class_counter[self.classes[box['label']]] += 1
@@ -30,6 +30,11 @@ class OpenImagesReader(ObjectDetectionReader):
     Before using it you have to request and configure access following the
     instructions here: https://github.com/cvdfoundation/open-images-dataset
     """
+
+    # Records are completed (and yielded) by several threads, so they can't be
+    # matched to their position in the dataset.
+    _partitionable = False
+
     def __init__(self, data_dir, split, download_threads=25, **kwargs):
         """
         Args:
@@ -86,6 +91,11 @@ class OpenImagesReader(ObjectDetectionReader):
             IMAGES_LOCATION, self._split, '{}.jpg'.format(image_id)
         ).format(split=self._split)
 
+    def get_record_key(self, record):
+        # Records are completed by other threads, so the key is taken from
+        # the record itself instead of `current_key`.
+        return self._get_image_path(record['filename'])
+
     def get_classes(self):
         trainable_labels_file = self._get_classes_path()
         trainable_labels = set()
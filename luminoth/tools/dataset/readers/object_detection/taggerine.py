@@ -192,7 +192,7 @@ class TaggerineReader(ObjectDetectionReader):
                 'gt_boxes': gt_boxes,
             }
 
-            self._will_add_record(record)
+            self._will_add_record(record, key=annotation['path'])
             self.yielded_records += 1
 
             yield record
@@ -16,14 +16,21 @@ from .writers import ObjectDetectionWriter
 @click.option('--only-images', help='Create dataset with specific examples. Useful to test model if your model has the ability to overfit.')  # noqa
 @click.option('--limit-examples', type=int, help='Limit the dataset to the first `N` examples.')  # noqa
 @click.option('--class-examples', type=int, help='Finish when every class has at least `N` number of samples. This will be the attempted lower bound; more examples might be added or a class might finish with fewer samples depending on the dataset.')  # noqa
+@click.option('--records-per-shard', type=int, help='Split each split into files (shards) of at most `N` records.')  # noqa
+@click.option('--shard-size', type=int, help='Split each split into files (shards) of at most `N` MB.')  # noqa
+@click.option('--workers', type=int, default=1, help='Number of processes used to read and convert records.')  # noqa
+@click.option('--append', is_flag=True, help='Only write the records that are new (or changed) since the split was last transformed, into new files.')  # noqa
 @click.option('overrides', '--override', '-o', multiple=True, help='Custom parameters for readers.')  # noqa
 @click.option('--debug', is_flag=True, help='Set level logging to DEBUG.')
 def transform(dataset_reader, data_dir, output_dir, splits, only_classes,
-              only_images, limit_examples, class_examples, overrides, debug):
+              only_images, limit_examples, class_examples, records_per_shard,
+              shard_size, workers, append, overrides, debug):
     """
     Prepares dataset for ingestion.
 
-    Converts the dataset into different (one per split) TFRecords files.
+    Converts the dataset into different (one per split) TFRecords files, or
+    into several files per split when sharding. Interrupted runs are resumed
+    when run again.
     """
     tf.logging.set_verbosity(tf.logging.INFO)
     if debug:
@@ -40,6 +47,8 @@ def transform(dataset_reader, data_dir, output_dir, splits, only_classes,
 
     reader_kwargs = parse_override(overrides)
 
+    max_shard_bytes = shard_size * 1024 * 1024 if shard_size else None
+
     try:
         for split in splits:
             # Create instance of reader.
@@ -59,8 +68,17 @@ def transform(dataset_reader, data_dir, output_dir, splits, only_classes,
 
             # We assume we are saving object detection objects, but it should
             # be easy to modify once we have different types of objects.
-            writer = ObjectDetectionWriter(split_reader, output_dir, split)
-            writer.save()
+            writer = ObjectDetectionWriter(
+                split_reader, output_dir, split,
+                records_per_shard=records_per_shard,
+                max_shard_bytes=max_shard_bytes,
+                num_workers=workers, append=append,
+            )
+            try:
+                writer.save()
+            except ValueError as e:
+                tf.logging.error('Error saving split: {}'.format(e))
+                return
 
             tf.logging.info('Composition per class ({}):'.format(split))
             for label, count in split_reader._per_class_counter.most_common():
@@ -1,12 +1,17 @@
 import click
+import hashlib
 import json
 import os
 import tensorflow as tf
 
 from .base_writer import BaseWriter
+from .parallel import iterate_parallel
 
 from luminoth.tools.dataset.readers import ObjectDetectionReader
-from luminoth.utils.dataset import to_int64, to_string, to_bytes
+from luminoth.utils.dataset import (
+    to_int64, to_string, to_bytes, get_records_filename, get_shard_filename,
+    read_manifest, write_manifest
+)
 
 REQUIRED_KEYS = set(
     ['width', 'height', 'depth', 'filename', 'image_raw', 'gt_boxes']
@@ -15,24 +20,56 @@ REQUIRED_GT_KEYS = set(['label', 'xmin', 'ymin', 'xmax', 'ymax'])
 
 CLASSES_FILENAME = 'classes.json'
 
+# Number of records written between checkpoints of the files being written
+# (and updates of the incomplete manifest), so an interrupted run can be
+# resumed.
+DEFAULT_CHECKPOINT_RECORDS = 1000
+
 
 class InvalidRecord(Exception):
     pass
 
 
+def get_record_hash(record):
+    """Returns a hash of the contents of a record (image and annotations).
+    """
+    content = hashlib.sha1()
+    content.update(record.get('image_raw') or b'')
+    content.update(json.dumps(
+        {key: value for key, value in record.items() if key != 'image_raw'},
+        sort_keys=True, default=str
+    ).encode('utf-8'))
+    return content.hexdigest()
+
+
 class ObjectDetectionWriter(BaseWriter):
     """Writes object detection dataset into tfrecords.
 
     Reads dataset from a subclass of ObjectDetectionReader and saves it using
     the default format for tfrecords.
     """
-    def __init__(self, reader, output_dir, split='data'):
+    def __init__(self, reader, output_dir, split='data',
+                 records_per_shard=None, max_shard_bytes=None, num_workers=1,
+                 append=False, checkpoint_records=DEFAULT_CHECKPOINT_RECORDS):
         """
         Args:
             reader:
             output_dir: Directory to save the resulting tfrecords.
             split: Split being save, which is used as a filename for the
                 resulting file.
+            records_per_shard (int): Maximum number of records per file. When
+                either this or `max_shard_bytes` are set, the split is written
+                into shards named ``{split}-00000-of-00010.tfrecords``.
+                Otherwise, it's written into a single ``{split}.tfrecords``.
+            max_shard_bytes (int): Maximum size of each file, in bytes.
+            num_workers (int): Number of processes reading and serializing
+                records. Output is the same regardless of the number used.
+            append (bool): Add the records that aren't saved yet (or changed)
+                to an already written split, into new files, instead of
+                writing it from scratch.
+            checkpoint_records (int): Number of records written between
+                updates of the manifest, which allow resuming an interrupted
+                run (sharded or not).
         """
         super(ObjectDetectionWriter, self).__init__()
         if not isinstance(reader, ObjectDetectionReader):
@@ -43,47 +80,187 @@ class ObjectDetectionWriter(BaseWriter):
         self._reader = reader
         self._output_dir = output_dir
         self._split = split
+        self._records_per_shard = records_per_shard
+        self._max_shard_bytes = max_shard_bytes
+        self._num_workers = num_workers
+        self._append = append
+        self._checkpoint_records = checkpoint_records
+        self._shard_names = self.sharded
+        self._saved_records = {}
+
+    @property
+    def sharded(self):
+        return bool(self._records_per_shard or self._max_shard_bytes)
 
     def save(self):
-        """
+        """Saves the split into TFRecords files, along with its manifest.
+
+        When resuming an interrupted run, or when appending to an existing
+        split, only the records that aren't saved yet (or whose content
+        changed) are written, into new files. The outdated versions of
+        changed records are removed from the files they were in.
         """
         tf.logging.info('Saving split "{}" in output_dir = {}'.format(
             self._split, self._output_dir))
         if not tf.gfile.Exists(self._output_dir):
             tf.gfile.MakeDirs(self._output_dir)
 
+        classes = [
+            self._reader.pretty_name(label) for label in self._reader.classes
+        ]
+        shards = self._get_previous_shards(classes)
+        num_previous = len(shards)
+        # New files must not overwrite the ones already written.
+        self._shard_names = self.sharded or num_previous > 0
+
         # Save classes in simple json format for later use.
         classes_file = os.path.join(self._output_dir, CLASSES_FILENAME)
-        json.dump([
-            self._reader.pretty_name(label)
-            for label in self._reader.classes
-        ], tf.gfile.GFile(classes_file, 'w'))
+        json.dump(classes, tf.gfile.GFile(classes_file, 'w'))
 
-        record_file = os.path.join(
-            self._output_dir, '{}.tfrecords'.format(self._split))
-        writer = tf.python_io.TFRecordWriter(record_file)
+        # Index the records already saved, so they aren't written again. When
+        # a record appears more than once, only its last version is kept.
+        self._saved_records = {}
+        stale = {}
+        for shard_idx, shard in enumerate(shards):
+            for position, (record_id, record_hash) in enumerate(
+                shard['records']
+            ):
+                if record_id in self._saved_records:
+                    saved_idx, saved_position, _ = self._saved_records[
+                        record_id
+                    ]
+                    stale.setdefault(saved_idx, set()).add(saved_position)
+                self._saved_records[record_id] = (
+                    shard_idx, position, record_hash
+                )
 
         tf.logging.debug('Found {} images.'.format(self._reader.total))
 
-        with click.progressbar(self._reader.iterate(),
+        if self._num_workers > 1 and self._reader.supports_partitioning:
+            records = iterate_parallel(
+                self._reader, self._process_record, self._num_workers
+            )
+        else:
+            if self._num_workers > 1:
+                tf.logging.warning(
+                    'Reader can\'t be split among workers (or asked for a '
+                    'number of examples per class). Using a single process.'
+                )
+            records = self._iterate_processed()
+
+        num_unchanged = 0
+        num_duplicated = 0
+        num_written = 0
+        seen_records = set()
+        writer = None
+        records_file = None
+        rotate = False
+        with click.progressbar(records,
                                length=self._reader.total) as record_list:
-            for record_idx, record in enumerate(record_list):
-                tf_record = self._record_to_tf(record)
-                if tf_record is not None:
-                    writer.write(tf_record.SerializeToString())
+            for result in record_list:
+                if result is None:
+                    continue
+
+                record_id, record_hash, serialized = result
+                if record_id in seen_records:
+                    # Saving it would leave two records with the same id,
+                    # and only one of them could later be updated.
+                    tf.logging.warning(
+                        'Skipping duplicated record "{}".'.format(record_id)
+                    )
+                    num_duplicated += 1
+                    continue
+                seen_records.add(record_id)
+
+                if record_id in self._saved_records:
+                    if serialized is None:
+                        num_unchanged += 1
+                        continue
+                    # The record changed, so its saved version is outdated.
+                    saved_idx, saved_position, _ = self._saved_records[
+                        record_id
+                    ]
+                    stale.setdefault(saved_idx, set()).add(saved_position)
+
+                if writer is None or rotate or self._is_shard_full(
+                    shards[-1], len(serialized)
+                ):
+                    if writer is not None:
+                        writer.close()
+                        records_file.close()
+                        # Keep track of the files finished so far, so an
+                        # interrupted run can be resumed.
+                        write_manifest(
+                            self._output_dir, self._split, shards,
+                            complete=False
+                        )
+                    shards.append({
+                        'filename': self._get_temp_filename(len(shards)),
+                        'num_records': 0,
+                        'num_bytes': 0,
+                        'records': [],
+                    })
+                    writer = tf.python_io.TFRecordWriter(
+                        os.path.join(self._output_dir, shards[-1]['filename'])
+                    )
+                    records_file = tf.gfile.GFile(
+                        self._get_records_path(shards[-1]), 'w'
+                    )
+                    rotate = False
+
+                writer.write(serialized)
+                # Records are listed as they are written, so checkpoints
+                # don't have to write the list again.
+                records_file.write(
+                    json.dumps([record_id, record_hash]) + '\n'
+                )
+                shards[-1]['num_records'] += 1
+                shards[-1]['num_bytes'] += len(serialized)
+                shards[-1]['records'].append([record_id, record_hash])
+
+                num_written += 1
+                if num_written % self._checkpoint_records == 0:
+                    if hasattr(writer, 'flush'):
+                        # Also count the records of the files being written.
+                        # Whatever gets written after them is dropped when
+                        # resuming.
+                        writer.flush()
+                        records_file.flush()
+                        write_manifest(
+                            self._output_dir, self._split, shards,
+                            complete=False
+                        )
+                    else:
+                        # Older TensorFlow versions can't flush the file, so
+                        # continue on a new one.
+                        rotate = True
+                        self._shard_names = True
 
             if self._output_dir.startswith('gs://'):
                 tf.logging.info('Saving tfrecord to Google Cloud Storage. '
                                 'It may take a while.')
-            writer.close()
+            if writer is not None:
+                writer.close()
+                records_file.close()
 
-        if self._reader.yielded_records == 0:
+        new_shards = shards[num_previous:]
+        if self._reader.yielded_records == 0 or not shards:
             tf.logging.error(
                 'Data is missing. Removing record file. '
                 '(Use "--debug" flag to display all logs)')
-            tf.gfile.Remove(record_file)
+            for shard in new_shards:
+                tf.gfile.Remove(
+                    os.path.join(self._output_dir, shard['filename'])
+                )
+                tf.gfile.Remove(self._get_records_path(shard))
             return
-        elif self._reader.errors > 0:
+        if num_duplicated:
+            tf.logging.warning(
+                'Skipped {} records with the same id as a previous '
+                'one.'.format(num_duplicated)
+            )
+
+        if self._reader.errors > 0:
             tf.logging.warning(
                 'Failed on {} records. '
                 '(Use "--debug" flag to display all logs)'.format(
@@ -91,8 +268,222 @@ class ObjectDetectionWriter(BaseWriter):
                 )
             )
 
-        tf.logging.info('Saved {} records to "{}"'.format(
-            self._reader.yielded_records, record_file))
+        for shard_idx in sorted(stale):
+            self._remove_records(shards[shard_idx], stale[shard_idx])
+            write_manifest(
+                self._output_dir, self._split, shards, complete=False
+            )
+
+        # Now that the number of shards is known, give the new ones their
+        # final names. (Files already renamed in previous runs keep theirs.)
+        for shard_idx, shard in enumerate(shards):
+            if not shard['filename'].endswith('.tmp'):
+                continue
+            filename = self._get_filename(shard_idx, len(shards))
+            tf.gfile.Rename(
+                os.path.join(self._output_dir, shard['filename']),
+                os.path.join(self._output_dir, filename),
+                overwrite=True
+            )
+            tf.gfile.Rename(
+                self._get_records_path(shard),
+                os.path.join(
+                    self._output_dir, get_records_filename(filename)
+                ),
+                overwrite=True
+            )
+            shard['filename'] = filename
+
+        write_manifest(self._output_dir, self._split, shards)
+
+        if num_previous:
+            tf.logging.info(
+                'Skipped {} unchanged records and removed {} outdated ones '
+                'from previous files.'.format(
+                    num_unchanged,
+                    sum(len(positions) for positions in stale.values())
+                )
+            )
+        tf.logging.info('Saved {} records to {} file(s) in "{}"'.format(
+            sum(shard['num_records'] for shard in new_shards),
+            len(new_shards), self._output_dir
+        ))
+
+    def _get_previous_shards(self, classes):
+        """Returns the files already written for the split to add records to.
+
+        That is the case when appending or when the last run was interrupted.
+        Otherwise, an empty list is returned and the split is written from
+        scratch.
+        """
+        manifest = read_manifest(self._output_dir, self._split)
+        if manifest is None:
+            if self._append:
+                tf.logging.warning(
+                    'No manifest found for split "{}", writing it from '
+                    'scratch.'.format(self._split)
+                )
+            return []
+
+        if not self._append and manifest.get('complete', True):
+            return []
+
+        shards = manifest['shards']
+        if not all(
+            tf.gfile.Exists(self._get_records_path(shard)) for shard in shards
+        ):
+            raise ValueError(
+                'The records of split "{}" aren\'t listed, so it can\'t be '
+                'added to. Transform it again without `--append`.'.format(
+                    self._split
+                )
+            )
+
+        classes_file = os.path.join(self._output_dir, CLASSES_FILENAME)
+        if tf.gfile.Exists(classes_file):
+            with tf.gfile.GFile(classes_file) as f:
+                if json.load(f) != classes:
+                    raise ValueError(
+                        'Classes differ from the ones of the saved split '
+                        '"{}", so it can\'t be added to.'.format(self._split)
+                    )
+
+        if not manifest.get('complete', True):
+            tf.logging.info(
+                'Resuming the transformation of split "{}" ({} records were '
+                'already saved).'.format(self._split, manifest['num_records'])
+            )
+
+        for shard in shards:
+            shard['records'] = self._read_records(shard)
+
+        if not manifest.get('complete', True) and shards:
+            # The last file may have been interrupted while being written,
+            # after the manifest was last updated.
+            self._truncate_shard(shards[-1])
+
+        return shards
+
+    def _iterate_processed(self):
+        """Reads and processes the records of the reader, one at a time.
+        """
+        for record in self._reader.iterate():
+            yield self._process_record(record)
+
+    def _process_record(self, record):
+        """Gets the id and content hash of a record, and serializes it.
+
+        Returns:
+            Tuple of (id, hash, serialized record), where the serialized
+            record is `None` if it's already saved (with the same content).
+            Returns `None` if the record is invalid.
+        """
+        record_id = self._reader.get_record_key(record)
+        record_hash = get_record_hash(record)
+
+        saved = self._saved_records.get(record_id)
+        if saved is not None and saved[2] == record_hash:
+            return record_id, record_hash, None
+
+        tf_record = self._record_to_tf(record)
+        if tf_record is None:
+            return
+
+        return record_id, record_hash, tf_record.SerializeToString()
+
+    def _remove_records(self, shard, positions):
+        """Rewrites a file without the records at the given positions.
+        """
+        path = os.path.join(self._output_dir, shard['filename'])
+        temp_path = '{}.rewrite'.format(path)
+
+        num_bytes = 0
+        writer = tf.python_io.TFRecordWriter(temp_path)
+        for position, serialized in enumerate(
+            tf.python_io.tf_record_iterator(path)
+        ):
+            if position in positions:
+                continue
+            writer.write(serialized)
+            num_bytes += len(serialized)
+        writer.close()
+
+        tf.gfile.Rename(temp_path, path, overwrite=True)
+
+        shard['records'] = [
+            record for position, record in enumerate(shard['records'])
+            if position not in positions
+        ]
+        shard['num_records'] = len(shard['records'])
+        shard['num_bytes'] = num_bytes
+        self._write_records(shard)
+
+    def _truncate_shard(self, shard):
+        """Rewrites a file keeping only the records listed in `shard`.
+        """
+        path = os.path.join(self._output_dir, shard['filename'])
+        temp_path = '{}.rewrite'.format(path)
+
+        writer = tf.python_io.TFRecordWriter(temp_path)
+        # Stop after the listed records, as what follows may be incomplete.
+        records = tf.python_io.tf_record_iterator(path)
+        for _ in range(shard['num_records']):
+            writer.write(next(records))
+        writer.close()
+
+        tf.gfile.Rename(temp_path, path, overwrite=True)
+        self._write_records(shard)
+
+    def _get_records_path(self, shard):
+        return os.path.join(
+            self._output_dir, get_records_filename(shard['filename'])
+        )
+
+    def _read_records(self, shard):
+        """Reads the `[id, hash]` of the records listed in `shard`.
+
+        Only the first `num_records` lines are read, as the list of a file
+        that was being written may go further (or end in a partial line).
+        """
+        records = []
+        with tf.gfile.GFile(self._get_records_path(shard)) as f:
+            for line in f:
+                if len(records) == shard['num_records']:
+                    break
+                records.append(json.loads(line))
+        return records
+
+    def _write_records(self, shard):
+        """Rewrites the list of records of `shard`.
+        """
+        with tf.gfile.GFile(self._get_records_path(shard), 'w') as f:
+            for record in shard['records']:
+                f.write(json.dumps(record) + '\n')
+
+    def _is_shard_full(self, shard, record_bytes):
+        """Whether a record of `record_bytes` bytes fits in `shard` or not.
+        """
+        if (
+            self._records_per_shard and
+            shard['num_records'] >= self._records_per_shard
+        ):
+            return True
+
+        # A shard always has at least one record, however big.
+        return bool(
+            self._max_shard_bytes and shard['num_records'] and
+            shard['num_bytes'] + record_bytes > self._max_shard_bytes
+        )
+
+    def _get_filename(self, shard_idx, num_shards):
+        if not self._shard_names:
+            return '{}.tfrecords'.format(self._split)
+        return get_shard_filename(self._split, shard_idx, num_shards)
+
+    def _get_temp_filename(self, shard_idx):
+        if not self._shard_names:
+            return self._get_filename(shard_idx, 1)
+        return '{}.tmp'.format(get_shard_filename(self._split, shard_idx, 0))
 
     def _validate_record(self, record):
         """
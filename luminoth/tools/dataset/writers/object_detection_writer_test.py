@@ -0,0 +1,141 @@
+import json
+import os
+import tempfile
+import tensorflow as tf
+
+from luminoth.tools.dataset.readers import ObjectDetectionReader
+from luminoth.tools.dataset.writers.object_detection_writer import (
+    ObjectDetectionWriter
+)
+from luminoth.utils.dataset import (
+    get_records_filename, get_split_files, read_manifest
+)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class MockReader(ObjectDetectionReader):
+    """Yields a record for each of the given image paths, optionally failing
+    before yielding the one at `interrupt_at`.
+    """
+
+    def __init__(self, paths, interrupt_at=None, **kwargs):
+        super(MockReader, self).__init__(**kwargs)
+        self._paths = paths
+        self._interrupt_at = interrupt_at
+        self.yielded_records = 0
+        self.errors = 0
+
+    def get_total(self):
+        return len(self._paths)
+
+    def get_classes(self):
+        return ['cat']
+
+    def iterate(self):
+        for position, path in enumerate(self._paths):
+            if self._stop_iteration():
+                return
+
+            if self._should_skip(path):
+                continue
+
+            if position == self._interrupt_at:
+                raise Interrupted()
+
+            record = {
+                'width': 10,
+                'height': 10,
+                'depth': 3,
+                # Like most readers, only use the basename.
+                'filename': os.path.basename(path),
+                'image_raw': path.encode('utf-8'),
+                'gt_boxes': [{
+                    'label': 0, 'xmin': 1, 'ymin': 1, 'xmax': 5, 'ymax': 5,
+                }],
+            }
+            self._will_add_record(record, key=path)
+            self.yielded_records += 1
+            yield record
+
+
+class ObjectDetectionWriterTest(tf.test.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def _save(self, paths, interrupt_at=None, **kwargs):
+        writer = ObjectDetectionWriter(
+            MockReader(paths, interrupt_at=interrupt_at), self.output_dir,
+            'train', **kwargs
+        )
+        writer.save()
+
+    def _saved_ids(self):
+        ids = []
+        for shard in read_manifest(self.output_dir, 'train')['shards']:
+            # Only the shard's own metadata is kept in the manifest.
+            self.assertEqual(
+                set(shard), set(['filename', 'num_records', 'num_bytes'])
+            )
+            path = os.path.join(
+                self.output_dir, get_records_filename(shard['filename'])
+            )
+            with open(path) as f:
+                ids.extend(json.loads(line)[0] for line in f)
+        return ids
+
+    def _saved_images(self):
+        images = []
+        for path in get_split_files(self.output_dir, 'train'):
+            for serialized in tf.python_io.tf_record_iterator(path):
+                example = tf.train.SequenceExample.FromString(serialized)
+                images.append(
+                    example.context.feature['image_raw'].bytes_list.value[0]
+                )
+        return images
+
+    def testResumeUnsharded(self):
+        """Tests an interrupted unsharded save can be resumed.
+        """
+        paths = ['images/{}.jpg'.format(i) for i in range(10)]
+
+        with self.assertRaises(Interrupted):
+            self._save(paths, interrupt_at=7, checkpoint_records=3)
+
+        manifest = read_manifest(self.output_dir, 'train')
+        self.assertFalse(manifest['complete'])
+        # The records written after the last update aren't listed.
+        self.assertEqual(manifest['num_records'], 6)
+        self.assertEqual(
+            [shard['filename'] for shard in manifest['shards']],
+            ['train.tfrecords']
+        )
+
+        self._save(paths, checkpoint_records=3)
+
+        manifest = read_manifest(self.output_dir, 'train')
+        self.assertTrue(manifest['complete'])
+        self.assertEqual(manifest['num_records'], 10)
+        self.assertEqual(self._saved_ids(), paths)
+        self.assertEqual(
+            self._saved_images(), [path.encode('utf-8') for path in paths]
+        )
+
+    def testRecordIds(self):
+        """Tests records are identified by their key instead of filename, and
+        duplicated keys are skipped.
+        """
+        paths = ['a/image.jpg', 'b/image.jpg', 'a/image.jpg']
+        self._save(paths)
+
+        self.assertEqual(self._saved_ids(), ['a/image.jpg', 'b/image.jpg'])
+        self.assertEqual(
+            self._saved_images(), [b'a/image.jpg', b'b/image.jpg']
+        )
+
+
+if __name__ == '__main__':
+    tf.test.main()
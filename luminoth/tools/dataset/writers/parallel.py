@@ -0,0 +1,139 @@
+import multiprocessing
+import traceback
+
+from six.moves import queue
+
+
+# Maximum number of serialized records waiting to be written, per worker.
+DEFAULT_QUEUE_SIZE = 64
+
+
+def _get_context():
+    # Readers are handed to the workers as they are, so processes must be
+    # forked instead of spawned (which would require pickling them).
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+def _worker_main(reader, process_record, num_workers, index, output_queue):
+    reader.set_partition(num_workers, index)
+    errors = 0
+    try:
+        for record in reader.iterate():
+            # Get the labels first, as `process_record` may modify the record.
+            labels = [box['label'] for box in record.get('gt_boxes', [])]
+            result = process_record(record)
+            # Also send the number of records that failed to be read since
+            # the last one.
+            output_queue.put((
+                'record', reader.current_position, result, labels,
+                reader.errors - errors
+            ))
+            errors = reader.errors
+    except Exception:
+        output_queue.put(('error', traceback.format_exc()))
+        return
+
+    output_queue.put(('done', reader.errors - errors))
+
+
+def _get_message(output_queue, process):
+    while True:
+        try:
+            return output_queue.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(
+                    'Dataset worker (pid {}) died unexpectedly.'.format(
+                        process.pid
+                    )
+                )
+
+
+def iterate_parallel(reader, process_record, num_workers,
+                     queue_size=DEFAULT_QUEUE_SIZE):
+    """Reads and processes the records of a reader with several processes.
+
+    Each worker process reads (and processes, using `process_record`) a
+    different partition of the dataset, and the results are merged back in
+    the same order a sequential read would produce them.
+
+    Once done, the reader's `yielded_records`, `errors` and per-class counter
+    are updated as if it had read the dataset itself. (When stopping early
+    because of `limit_examples`, failures on records read by other workers
+    right before the last record may not be counted.)
+
+    Args:
+        reader: `ObjectDetectionReader` that supports partitioning.
+        process_record: Function that converts a record into what is yielded
+            (e.g. its serialized `tf.train.SequenceExample`). Its results
+            must be picklable.
+        num_workers (int): Number of worker processes to use.
+        queue_size (int): Maximum number of records each worker can have
+            waiting to be written.
+
+    Yields:
+        The result of `process_record` for each record.
+    """
+    context = _get_context()
+    queues = []
+    processes = []
+    for index in range(num_workers):
+        output_queue = context.Queue(maxsize=queue_size)
+        process = context.Process(
+            target=_worker_main,
+            args=(reader, process_record, num_workers, index, output_queue)
+        )
+        process.daemon = True
+        process.start()
+
+        queues.append(output_queue)
+        processes.append(process)
+
+    heads = [None] * num_workers
+    finished = [False] * num_workers
+    reader.yielded_records = 0
+    reader.errors = 0
+    try:
+        while reader.yielded_records != reader.total:
+            # Get the next record of every worker (that has any left).
+            for index in range(num_workers):
+                while heads[index] is None and not finished[index]:
+                    message = _get_message(queues[index], processes[index])
+                    if message[0] == 'record':
+                        heads[index] = message[1:]
+                    elif message[0] == 'done':
+                        finished[index] = True
+                        reader.errors += message[1]
+                    else:
+                        raise RuntimeError(
+                            'Error reading the dataset:\n{}'.format(
+                                message[1]
+                            )
+                        )
+
+            pending = [
+                index for index in range(num_workers)
+                if heads[index] is not None
+            ]
+            if not pending:
+                break
+
+            # Records are yielded in the order they appear in the dataset.
+            index = min(pending, key=lambda index: heads[index][0])
+            _, result, labels, errors = heads[index]
+            heads[index] = None
+
+            for label in labels:
+                reader._per_class_counter[reader.classes[label]] += 1
+            reader.yielded_records += 1
+            reader.errors += errors
+
+            yield result
+
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
@@ -0,0 +1,159 @@
+import tensorflow as tf
+import threading
+import time
+
+from collections import Counter
+from six.moves import queue
+
+
+class PendingPrediction(object):
+    """Image waiting in a `BatchingQueue` for its prediction."""
+
+    def __init__(self, image):
+        self.image = image
+        self.enqueued_at = time.time()
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def set_result(self, result):
+        self.result = result
+        self._done.set()
+
+    def set_error(self, error):
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class BatchingQueue(object):
+    """Groups concurrent prediction requests into batches.
+
+    Requests are collected by a single background thread until either
+    `max_batch_size` images are waiting or `max_wait_ms` milliseconds have
+    passed since the first image of the batch arrived. The whole batch is then
+    sent through `predict_fn` at once and the results are handed back to each
+    of the waiting callers.
+
+    Args:
+        predict_fn: Function that receives a list of images and returns a list
+            with the predictions for each one, in the same order.
+        max_batch_size (int): Maximum number of images in a single batch.
+        max_wait_ms (float): Maximum time to wait for a batch to fill up,
+            counted from the moment its first image was received.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10):
+        if max_batch_size < 1:
+            raise ValueError('`max_batch_size` must be at least 1.')
+
+        self._predict_fn = predict_fn
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._total_images = 0
+        self._total_wait = 0.
+        self._max_queue_wait = 0.
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def predict(self, image):
+        """Enqueue `image` and block until its prediction is available."""
+        pending = PendingPrediction(image)
+        self._queue.put(pending)
+        return pending.wait()
+
+    @property
+    def queue_depth(self):
+        """Number of images waiting to be assigned to a batch."""
+        return self._queue.qsize()
+
+    def get_stats(self):
+        """Returns batch size and queue wait statistics as a dict."""
+        with self._stats_lock:
+            total_batches = sum(self._batch_sizes.values())
+            return {
+                'total_batches': total_batches,
+                'total_images': self._total_images,
+                'mean_batch_size': (
+                    self._total_images / float(total_batches)
+                    if total_batches else 0.
+                ),
+                'batch_sizes': dict(self._batch_sizes),
+                'mean_queue_wait_ms': (
+                    1000. * self._total_wait / self._total_images
+                    if self._total_images else 0.
+                ),
+                'max_queue_wait_ms': 1000. * self._max_queue_wait,
+                'queue_depth': self.queue_depth,
+            }
+
+    def _next_batch(self):
+        # Block until there's at least one image to process.
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self._max_wait
+
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Don't wait anymore, but take whatever is already queued.
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started_at = time.time()
+
+            waits = [started_at - pending.enqueued_at for pending in batch]
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._total_images += len(batch)
+                self._total_wait += sum(waits)
+                self._max_queue_wait = max(self._max_queue_wait, max(waits))
+
+            try:
+                results = list(self._predict_fn(
+                    [pending.image for pending in batch]
+                ))
+                if len(results) != len(batch):
+                    # Otherwise, the requests without a result would never
+                    # be answered.
+                    raise ValueError(
+                        'Got {} predictions for a batch of {} images.'.format(
+                            len(results), len(batch)
+                        )
+                    )
+            except Exception as e:
+                tf.logging.error(
+                    'Error while predicting batch: {}'.format(e)
+                )
+                for pending in batch:
+                    pending.set_error(e)
+                continue
+
+            for pending, result in zip(batch, results):
+                pending.set_result(result)
+
+            tf.logging.debug(
+                'Predicted batch of {} images in {:.2f}s (max queue wait '
+                '{:.2f}ms).'.format(
+                    len(batch), time.time() - started_at, 1000. * max(waits)
+                )
+            )
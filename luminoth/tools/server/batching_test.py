@@ -0,0 +1,117 @@
+import tensorflow as tf
+import threading
+import time
+
+from luminoth.tools.server.batching import BatchingQueue
+
+
+class BatchingQueueTest(tf.test.TestCase):
+
+    def _predict_concurrently(self, batching_queue, images):
+        results = [None] * len(images)
+
+        def worker(idx):
+            results[idx] = batching_queue.predict(images[idx])
+
+        threads = [
+            threading.Thread(target=worker, args=(idx,))
+            for idx in range(len(images))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def testResultsReturnedToCaller(self):
+        """Tests that each caller receives the prediction of its own image.
+        """
+        batching_queue = BatchingQueue(
+            lambda images: [image * 2 for image in images],
+            max_batch_size=4, max_wait_ms=50
+        )
+        images = list(range(10))
+        results = self._predict_concurrently(batching_queue, images)
+        self.assertEqual(results, [image * 2 for image in images])
+
+        stats = batching_queue.get_stats()
+        self.assertEqual(stats['total_images'], 10)
+        self.assertLessEqual(max(stats['batch_sizes'].keys()), 4)
+
+    def testBatchesAreGrouped(self):
+        """Tests that concurrent requests are predicted together.
+        """
+        batch_sizes = []
+
+        def predict_fn(images):
+            batch_sizes.append(len(images))
+            return images
+
+        # Wait long enough for every request to arrive.
+        batching_queue = BatchingQueue(
+            predict_fn, max_batch_size=8, max_wait_ms=1000
+        )
+        self._predict_concurrently(batching_queue, list(range(8)))
+
+        self.assertEqual(batch_sizes, [8])
+        self.assertEqual(batching_queue.get_stats()['total_batches'], 1)
+
+    def testMaxWait(self):
+        """Tests that incomplete batches are sent after `max_wait_ms`.
+        """
+        batching_queue = BatchingQueue(
+            lambda images: images, max_batch_size=8, max_wait_ms=10
+        )
+        start = time.time()
+        self.assertEqual(batching_queue.predict(1), 1)
+        self.assertLess(time.time() - start, 1.)
+
+        stats = batching_queue.get_stats()
+        self.assertEqual(stats['batch_sizes'], {1: 1})
+        self.assertGreater(stats['max_queue_wait_ms'], 0.)
+
+    def testErrorsArePropagated(self):
+        """Tests that errors in the prediction are raised to every caller.
+        """
+        def predict_fn(images):
+            raise ValueError('Invalid batch.')
+
+        batching_queue = BatchingQueue(predict_fn, max_batch_size=1)
+        with self.assertRaises(ValueError):
+            batching_queue.predict(1)
+
+        # The queue keeps working after an error.
+        self.assertEqual(batching_queue.get_stats()['total_batches'], 1)
+
+    def testMissingResults(self):
+        """Tests that every caller gets an error when fewer predictions than
+        images are returned.
+        """
+        batching_queue = BatchingQueue(
+            lambda images: images[:1], max_batch_size=4, max_wait_ms=1000
+        )
+        errors = []
+
+        def worker(image):
+            try:
+                batching_queue.predict(image)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=worker, args=(image,))
+            for image in range(4)
+        ]
+        for thread in threads:
+            # Don't keep the tests from exiting if a caller never returns.
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(len(errors), 4)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import threading
+
+from collections import OrderedDict
+
+
+# Default limits of the cache used by the web server.
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def content_key(data):
+    """Returns the key under which the results for `data` (bytes) are stored.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache(object):
+    """Least recently used cache of predictions, keyed by image contents.
+
+    Entries are evicted, least recently used first, whenever the cache holds
+    more than `max_entries` results or their total (estimated) size goes over
+    `max_bytes`. The size of a result is estimated as the length of its JSON
+    encoding, which is close to what the server ends up sending. Results
+    larger than `max_bytes` on their own are never stored.
+
+    The cache is safe to use from several threads at once.
+
+    Args:
+        max_entries (int): Maximum number of results to keep. When zero the
+            cache is disabled.
+        max_bytes (int): Maximum total size of the results to keep.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        if max_entries < 0 or max_bytes < 0:
+            raise ValueError(
+                '`max_entries` and `max_bytes` must not be negative.'
+            )
+
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        # Maps each key to its `(result, size)`, least recently used first.
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the result stored under `key`, or `None` if there is none.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Re-insert it to mark it as the most recently used.
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        """Stores `result` (must be JSON serializable) under `key`.
+
+        Returns:
+            bool: Whether the result was stored.
+        """
+        size = len(json.dumps(result))
+        if not self._max_entries or size > self._max_bytes:
+            return False
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+
+            self._entries[key] = (result, size)
+            self._total_bytes += size
+
+            while (len(self._entries) > self._max_entries or
+                   self._total_bytes > self._max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.evictions += 1
+
+        return True
+
+    def clear(self):
+        """Removes every stored result (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def get_stats(self):
+        """Returns the usage and hit rate of the cache as a dict."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_entries': self._max_entries,
+                'max_bytes': self._max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': float(self.hits) / requests if requests else 0.,
+            }
@@ -0,0 +1,76 @@
+import json
+import tensorflow as tf
+
+from luminoth.tools.server.cache import ResultCache, content_key
+
+
+class ResultCacheTest(tf.test.TestCase):
+
+    def _result(self, label, num_objects=1):
+        return [
+            {'bbox': [0, 0, 10, 10], 'label': label, 'prob': 0.5}
+        ] * num_objects
+
+    def testContentKey(self):
+        """Tests that keys only depend on the contents.
+        """
+        self.assertEqual(content_key(b'image'), content_key(b'image'))
+        self.assertNotEqual(content_key(b'image'), content_key(b'image2'))
+
+    def testHitsAndMisses(self):
+        """Tests stored results are returned and the counters updated.
+        """
+        cache = ResultCache(max_entries=10)
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(cache.put('a', self._result('cat')))
+        self.assertEqual(cache.get('a'), self._result('cat'))
+        self.assertEqual(cache.get('a'), self._result('cat'))
+
+        stats = cache.get_stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(
+            stats['bytes'], len(json.dumps(self._result('cat')))
+        )
+
+    def testEvictsLeastRecentlyUsed(self):
+        """Tests entries are evicted in LRU order when over `max_entries`.
+        """
+        cache = ResultCache(max_entries=2)
+        cache.put('a', self._result('a'))
+        cache.put('b', self._result('b'))
+        # Use 'a', so 'b' is the least recently used.
+        cache.get('a')
+        cache.put('c', self._result('c'))
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+
+    def testMaxBytes(self):
+        """Tests the total size of the results stays under `max_bytes`.
+        """
+        size = len(json.dumps(self._result('a', num_objects=10)))
+        cache = ResultCache(max_entries=100, max_bytes=int(size * 2.5))
+        for key in 'abcd':
+            cache.put(key, self._result(key, num_objects=10))
+
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.get_stats()['bytes'], size * 2.5)
+        self.assertIsNotNone(cache.get('d'))
+
+        # Results that don't fit on their own aren't stored.
+        self.assertFalse(cache.put('e', self._result('e', num_objects=30)))
+        self.assertEqual(len(cache), 2)
+
+    def testDisabled(self):
+        cache = ResultCache(max_entries=0)
+        self.assertFalse(cache.put('a', self._result('a')))
+        self.assertIsNone(cache.get('a'))
+
+
+if __name__ == '__main__':
+    tf.test.main()
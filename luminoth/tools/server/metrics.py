@@ -0,0 +1,194 @@
+import bisect
+import threading
+
+
+# Upper bounds (in seconds) of the buckets of latency histograms.
+DEFAULT_BUCKETS = (
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n')
+        )
+        for name, value in pairs
+    ))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+    """Metric with a value for each combination of its labels."""
+
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                'Metric `{}` expects the labels {}, got {}.'.format(
+                    self.name, list(self.label_names), sorted(labels)
+                )
+            )
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        with self._lock:
+            samples = self._samples()
+        for suffix, label_values, extra, value in samples:
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix,
+                _format_labels(self.label_names, label_values, extra),
+                _format_value(value)
+            ))
+        return lines
+
+
+class _ScalarMetric(_Metric):
+
+    def __init__(self, name, description, labels=()):
+        super(_ScalarMetric, self).__init__(name, description, labels)
+        self._function = None
+
+    def set_function(self, function):
+        """Take the (unlabeled) value from calling `function` when rendered.
+        """
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            return [('', (), (), self._function())]
+        return [
+            ('', label_values, (), value)
+            for label_values, value in sorted(self._values.items())
+        ]
+
+
+class Counter(_ScalarMetric):
+    """Value that only goes up, such as the number of requests."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_ScalarMetric):
+    """Value that goes up and down, such as the number of queued requests."""
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Counts observed values (such as latencies) into cumulative buckets."""
+
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.)
+            )
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        samples = []
+        for label_values, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((
+                    '_bucket', label_values,
+                    (('le', _format_value(bound)),), cumulative
+                ))
+            samples.append(('_count', label_values, (), cumulative))
+            samples.append(('_sum', label_values, (), total))
+        return samples
+
+
+class MetricsRegistry(object):
+    """Group of metrics rendered together in the Prometheus text format.
+
+    Only what's needed for the web server to be scraped by a local
+    Prometheus (or read by hand) is implemented, so no client library is
+    required.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self._register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._register(
+            Histogram(name, description, labels, buckets=buckets)
+        )
+
+    def render(self):
+        """Returns the current value of every metric as a string."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def server_timing(timings):
+    """Formats `timings` (seconds by stage) as a `Server-Timing` header."""
+    return ', '.join(
+        '{};dur={:.1f}'.format(name, 1000. * seconds)
+        for name, seconds in timings.items()
+    )
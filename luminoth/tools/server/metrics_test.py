@@ -0,0 +1,71 @@
+import tensorflow as tf
+
+from collections import OrderedDict
+
+from luminoth.tools.server.metrics import MetricsRegistry, server_timing
+
+
+class MetricsTest(tf.test.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def _lines(self):
+        return self.registry.render().splitlines()
+
+    def testCounter(self):
+        """Tests counters are rendered with their labels and description.
+        """
+        counter = self.registry.counter(
+            'requests_total', 'Number of requests.', labels=('status',)
+        )
+        counter.inc(status='200')
+        counter.inc(status='200')
+        counter.inc(status='400')
+
+        self.assertEqual(self._lines(), [
+            '# HELP requests_total Number of requests.',
+            '# TYPE requests_total counter',
+            'requests_total{status="200"} 2.0',
+            'requests_total{status="400"} 1.0',
+        ])
+
+        with self.assertRaises(ValueError):
+            counter.inc(code='200')
+
+    def testGauge(self):
+        gauge = self.registry.gauge('in_flight', 'Requests being handled.')
+        gauge.set(3)
+        gauge.dec()
+        self.assertEqual(self._lines()[-1], 'in_flight 2.0')
+
+        gauge.set_function(lambda: 7)
+        self.assertEqual(self._lines()[-1], 'in_flight 7.0')
+
+    def testHistogram(self):
+        """Tests histogram buckets are cumulative and include `+Inf`.
+        """
+        histogram = self.registry.histogram(
+            'latency_seconds', 'Latency.', labels=('stage',),
+            buckets=(.1, 1.)
+        )
+        for value in (.05, .5, .5, 5.):
+            histogram.observe(value, stage='decode')
+
+        self.assertEqual(self._lines()[2:], [
+            'latency_seconds_bucket{stage="decode",le="0.1"} 1.0',
+            'latency_seconds_bucket{stage="decode",le="1.0"} 3.0',
+            'latency_seconds_bucket{stage="decode",le="+Inf"} 4.0',
+            'latency_seconds_count{stage="decode"} 4.0',
+            'latency_seconds_sum{stage="decode"} 6.05',
+        ])
+
+    def testServerTiming(self):
+        timings = OrderedDict([('decode', .0123), ('inference', .5)])
+        self.assertEqual(
+            server_timing(timings), 'decode;dur=12.3, inference;dur=500.0'
+        )
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -1,26 +1,144 @@
 import click
+import io
+import numpy as np
 import tensorflow as tf
+import time
 
-from flask import Flask, jsonify, request, render_template
+from collections import OrderedDict
+from functools import partial
+from flask import Flask, Response, g, jsonify, request, render_template
 from threading import Thread
 from PIL import Image
 from six.moves import _thread
 
 from luminoth.tools.checkpoint import get_checkpoint_config
+from luminoth.tools.server.batching import BatchingQueue
+from luminoth.tools.server.cache import (
+    DEFAULT_MAX_BYTES, DEFAULT_MAX_ENTRIES, ResultCache, content_key
+)
+from luminoth.tools.server.metrics import (
+    CONTENT_TYPE, MetricsRegistry, server_timing
+)
+from luminoth.tools.server.workers import (
+    InferenceWorkerPool, create_predictor_network
+)
 from luminoth.utils.config import get_config, override_config_params
 from luminoth.utils.predicting import PredictorNetwork
 
 
 app = Flask(__name__)
 
+# Predictions (with the server's low threshold) of recently uploaded images,
+# so the same image isn't decoded and predicted again.
+RESULT_CACHE = ResultCache()
 
-def get_image():
+# Set by `start_network` once the model is loaded.
+PREDICTOR_NETWORK = None
+BATCHING_QUEUE = None
+WORKER_POOL = None
+
+METRICS = MetricsRegistry()
+REQUESTS = METRICS.counter(
+    'luminoth_requests_total',
+    'Number of requests handled, by endpoint and status code.',
+    labels=('endpoint', 'status')
+)
+REQUEST_DURATION = METRICS.histogram(
+    'luminoth_request_duration_seconds',
+    'Time taken to handle each request, by endpoint.',
+    labels=('endpoint',)
+)
+STAGE_DURATION = METRICS.histogram(
+    'luminoth_predict_stage_duration_seconds',
+    'Time spent by prediction requests in each stage: parsing the upload, '
+    'decoding the image, waiting in line, running the network and '
+    'processing its results.',
+    labels=('stage',)
+)
+IN_FLIGHT = METRICS.gauge(
+    'luminoth_requests_in_flight', 'Number of requests being handled.'
+)
+IN_FLIGHT.set(0)
+QUEUE_DEPTH = METRICS.gauge(
+    'luminoth_queue_depth',
+    'Number of images waiting for the network to be free.'
+)
+MODEL_LOAD_TIME = METRICS.gauge(
+    'luminoth_model_load_seconds', 'Time taken to load the model.'
+)
+CACHE_HITS = METRICS.counter(
+    'luminoth_cache_hits_total',
+    'Number of predictions returned from the cache.'
+)
+CACHE_MISSES = METRICS.counter(
+    'luminoth_cache_misses_total',
+    'Number of predictions not found in the cache.'
+)
+
+
+def get_queue_depth():
+    if WORKER_POOL is not None:
+        return WORKER_POOL.queue_depth
+    if BATCHING_QUEUE is not None:
+        return BATCHING_QUEUE.queue_depth
+    return 0
+
+
+QUEUE_DEPTH.set_function(get_queue_depth)
+CACHE_HITS.set_function(lambda: RESULT_CACHE.hits)
+CACHE_MISSES.set_function(lambda: RESULT_CACHE.misses)
+
+
+def predict_batch(images):
+    """Predicts a batch of images, along with the time spent in each stage.
+    """
+    timings = {}
+    predictions = PREDICTOR_NETWORK.predict_images(images, timings=timings)
+    return [(objects, timings) for objects in predictions]
+
+
+def get_image_data():
     image = request.files.get('image')
     if not image:
         raise ValueError
 
-    image = Image.open(image.stream).convert('RGB')
-    return image
+    return image.read()
+
+
+def decode_image(image_data):
+    return Image.open(io.BytesIO(image_data)).convert('RGB')
+
+
+@app.before_request
+def start_request():
+    g.start_time = time.time()
+    # Time spent in each stage of the request, sent back as `Server-Timing`.
+    g.timings = OrderedDict()
+    IN_FLIGHT.inc()
+
+
+@app.after_request
+def finish_request(response):
+    endpoint = request.endpoint or 'unknown'
+    duration = time.time() - g.start_time
+    REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    g.request_counted = True
+    REQUEST_DURATION.observe(duration, endpoint=endpoint)
+
+    for stage, seconds in g.timings.items():
+        STAGE_DURATION.observe(seconds, stage=stage)
+    g.timings['total'] = duration
+    response.headers['Server-Timing'] = server_timing(g.timings)
+    return response
+
+
+@app.teardown_request
+def teardown_request(error=None):
+    IN_FLIGHT.dec()
+    # Older Flask versions don't call `after_request` for unhandled errors,
+    # while newer ones do (with the 500 response).
+    if error is not None and not g.get('request_counted', False):
+        REQUESTS.inc(endpoint=request.endpoint or 'unknown', status='500')
 
 
 @app.route('/')
@@ -33,12 +151,12 @@ def predict(model_name):
     if request.method == 'GET':
         return jsonify(error='Use POST method to send image.'), 400
 
+    start_time = time.time()
     try:
-        image_array = get_image()
+        image_data = get_image_data()
     except ValueError:
         return jsonify(error='Missing image'), 400
-    except OSError:
-        return jsonify(error='Incompatible file type'), 400
+    g.timings['parse'] = time.time() - start_time
 
     total_predictions = request.args.get('total')
     if total_predictions is not None:
@@ -47,19 +165,95 @@ def predict(model_name):
         except ValueError:
             total_predictions = None
 
+    # The cached results are the same for every value of `total`, as the
+    # limit is applied afterwards.
+    cache_key = content_key(image_data)
+    objects = RESULT_CACHE.get(cache_key)
+    cache_status = 'HIT'
+    if objects is None:
+        cache_status = 'MISS'
+        start_time = time.time()
+        try:
+            image_array = decode_image(image_data)
+        except (IOError, OSError):
+            return jsonify(error='Incompatible file type'), 400
+        g.timings['decode'] = time.time() - start_time
+
+        # Wait for the model to finish loading.
+        NETWORK_START_THREAD.join()
+
+        start_time = time.time()
+        if WORKER_POOL is not None:
+            network_timings = {}
+            try:
+                objects = WORKER_POOL.predict(
+                    np.array(image_array), timings=network_timings
+                )
+            except ValueError as e:
+                return jsonify(error=str(e)), 400
+            except RuntimeError as e:
+                return jsonify(error=str(e)), 503
+        else:
+            objects, network_timings = BATCHING_QUEUE.predict(image_array)
+
+        # Whatever isn't spent by the network itself is spent waiting for it.
+        g.timings['queue'] = max(
+            time.time() - start_time - sum(network_timings.values()), 0.
+        )
+        g.timings.update(sorted(network_timings.items()))
+        RESULT_CACHE.put(cache_key, objects)
+
+    response = jsonify({'objects': objects[:total_predictions]})
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+@app.route('/api/stats/')
+def stats():
     # Wait for the model to finish loading.
     NETWORK_START_THREAD.join()
 
-    objects = PREDICTOR_NETWORK.predict_image(image_array)
-    objects = objects[:total_predictions]
+    stats = {'cache': RESULT_CACHE.get_stats()}
+    if WORKER_POOL is not None:
+        stats['workers'] = WORKER_POOL.get_stats()
+    else:
+        stats['batching'] = BATCHING_QUEUE.get_stats()
+    return jsonify(stats)
+
 
-    return jsonify({'objects': objects})
+@app.route('/metrics')
+def metrics():
+    return Response(METRICS.render(), content_type=CONTENT_TYPE)
 
 
-def start_network(config):
+def start_network(config, max_batch_size=1, max_batch_wait=10, workers=0,
+                  threads_per_worker=None):
     global PREDICTOR_NETWORK
+    global BATCHING_QUEUE
+    global WORKER_POOL
+    WORKER_POOL = None
+    start_time = time.time()
     try:
-        PREDICTOR_NETWORK = PredictorNetwork(config)
+        if workers > 0:
+            # Each worker process loads its own copy of the model and predicts
+            # a single image at a time.
+            WORKER_POOL = InferenceWorkerPool(
+                partial(create_predictor_network, config), workers,
+                threads_per_worker=threads_per_worker
+            )
+            MODEL_LOAD_TIME.set(time.time() - start_time)
+            return
+
+        PREDICTOR_NETWORK = PredictorNetwork(
+            config, batch_size=max_batch_size
+        )
+        MODEL_LOAD_TIME.set(time.time() - start_time)
+        # Concurrent requests are grouped and sent through the network from a
+        # single thread, so the session is never used by two requests at once.
+        BATCHING_QUEUE = BatchingQueue(
+            predict_batch, max_batch_size=max_batch_size,
+            max_wait_ms=max_batch_wait
+        )
     except Exception as e:
         # An error occurred loading the model; interrupt the whole server.
         tf.logging.error(e)
@@ -72,8 +266,16 @@ def start_network(config):
 @click.option('override_params', '--override', '-o', multiple=True, help='Override model config params.')  # noqa
 @click.option('--host', default='127.0.0.1', help='Hostname to listen on. Set this to "0.0.0.0" to have the server available externally.')  # noqa
 @click.option('--port', default=5000, help='Port to listen to.')
+@click.option('--max-batch-size', default=1, help='Maximum number of images to predict together.')  # noqa
+@click.option('--max-batch-wait', default=10., help='Maximum time (in ms) to wait for a batch to fill up.')  # noqa
+@click.option('--workers', default=0, help='Number of processes to predict in, each one with its own copy of the model. Batching is disabled when used.')  # noqa
+@click.option('--threads-per-worker', type=int, help='Number of threads for each worker. Defaults to splitting the CPUs evenly.')  # noqa
+@click.option('--cache-size', default=DEFAULT_MAX_ENTRIES, help='Maximum number of predictions to keep cached, by image contents. Set to 0 to disable the cache.')  # noqa
+@click.option('--cache-max-mb', default=DEFAULT_MAX_BYTES / 1024. / 1024., help='Maximum total size (in MB) of the cached predictions.')  # noqa
 @click.option('--debug', is_flag=True, help='Set debug level logging.')
-def web(config_files, checkpoint, override_params, host, port, debug):
+def web(config_files, checkpoint, override_params, host, port, max_batch_size,
+        max_batch_wait, workers, threads_per_worker, cache_size, cache_max_mb,
+        debug):
     if debug:
         tf.logging.set_verbosity(tf.logging.DEBUG)
     else:
@@ -103,9 +305,21 @@ def web(config_files, checkpoint, override_params, host, port, debug):
             "Model type '{}' not supported".format(config.model.type)
         )
 
+    global RESULT_CACHE
+    RESULT_CACHE = ResultCache(
+        max_entries=cache_size, max_bytes=int(cache_max_mb * 1024 * 1024)
+    )
+
     # Initialize model
     global NETWORK_START_THREAD
-    NETWORK_START_THREAD = Thread(target=start_network, args=(config,))
+    NETWORK_START_THREAD = Thread(
+        target=start_network,
+        args=(
+            config, max_batch_size, max_batch_wait, workers,
+            threads_per_worker
+        )
+    )
     NETWORK_START_THREAD.start()
 
-    app.run(host=host, port=port, debug=debug)
+    # Requests must be handled concurrently so they can be batched together.
+    app.run(host=host, port=port, debug=debug, threaded=True)
@@ -0,0 +1,309 @@
+import multiprocessing
+import numpy as np
+import os
+import tensorflow as tf
+import threading
+import time
+import traceback
+
+from six.moves import queue
+
+from luminoth.utils.predicting import PredictorNetwork
+
+
+# Largest image (in pixels) that fits in the shared memory of each worker.
+DEFAULT_MAX_IMAGE_PIXELS = 4096 * 4096
+
+# Seconds between checks that some worker is still running, while waiting for
+# one to be idle.
+WORKER_CHECK_INTERVAL = 1.
+
+
+def _get_context():
+    # The network factory is handed to the workers as it is, so processes must
+    # be forked instead of spawned (which would require pickling it).
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+def create_predictor_network(config, num_threads):
+    """Returns a `PredictorNetwork` whose session uses `num_threads` threads.
+
+    Intended to be used (through `functools.partial`) as the `create_network`
+    argument of `InferenceWorkerPool`.
+    """
+    session_config = tf.ConfigProto(
+        intra_op_parallelism_threads=num_threads,
+        inter_op_parallelism_threads=1,
+    )
+    session_config.gpu_options.allow_growth = True
+    return PredictorNetwork(config, session_config=session_config)
+
+
+def _worker_main(create_network, num_threads, cores, image_buffer,
+                 connection):
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+    started_at = time.time()
+    try:
+        network = create_network(num_threads)
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+        return
+    connection.send(('ready', time.time() - started_at))
+
+    shared_image = np.frombuffer(image_buffer, dtype=np.uint8)
+    while True:
+        shape = connection.recv()
+        if shape is None:
+            # Shutdown requested.
+            break
+
+        image = shared_image[:int(np.prod(shape))].reshape(shape)
+        timings = {}
+        try:
+            objects = network.predict_image(image, timings=timings)
+        except Exception as e:
+            connection.send(('error', '{}'.format(e)))
+        else:
+            connection.send(('ok', (objects, timings)))
+
+
+class InferenceWorker(object):
+    """Handle to a single worker process of an `InferenceWorkerPool`.
+
+    Only one request is handled by a worker at any given time, so the shared
+    image buffer and the connection are never used concurrently.
+    """
+
+    def __init__(self, index, process, connection, image_buffer, cores):
+        self.index = index
+        self.process = process
+        self.connection = connection
+        self.image_buffer = image_buffer
+        self.cores = cores
+
+        self.model_load_time = None
+        self.total_requests = 0
+        self.total_errors = 0
+        self.total_time = 0.
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def predict(self, image, timings=None):
+        started_at = time.time()
+        self.total_requests += 1
+        try:
+            np.frombuffer(
+                self.image_buffer, dtype=np.uint8
+            )[:image.size] = image.ravel()
+            self.connection.send(image.shape)
+            status, value = self.connection.recv()
+        except (EOFError, IOError):
+            self.total_errors += 1
+            raise RuntimeError(
+                'Worker {} stopped unexpectedly.'.format(self.index)
+            )
+        finally:
+            self.total_time += time.time() - started_at
+
+        if status != 'ok':
+            self.total_errors += 1
+            raise RuntimeError(value)
+
+        objects, worker_timings = value
+        if timings is not None:
+            for name, seconds in worker_timings.items():
+                timings[name] = timings.get(name, 0.) + seconds
+
+        return objects
+
+    def get_stats(self):
+        return {
+            'index': self.index,
+            'pid': self.process.pid,
+            'alive': self.is_alive(),
+            'cores': sorted(self.cores) if self.cores else None,
+            'model_load_time': self.model_load_time,
+            'total_requests': self.total_requests,
+            'total_errors': self.total_errors,
+            'mean_latency_ms': (
+                1000. * self.total_time / self.total_requests
+                if self.total_requests else 0.
+            ),
+        }
+
+
+class InferenceWorkerPool(object):
+    """Runs predictions in several processes, each one with its own model.
+
+    Every worker process loads the model through `create_network` and keeps
+    its own session, limited to `threads_per_worker` threads and, when
+    possible, pinned to the same number of CPU cores, so workers don't compete
+    for them. Images are copied into a shared memory buffer of the worker
+    instead of being pickled through the connection; only the (small) list of
+    predicted objects is sent back.
+
+    Requests are assigned to the first idle worker; when every worker is busy
+    they wait in line, which is reported as the queue depth in `get_stats`.
+
+    Args:
+        create_network: Function that receives the number of threads to use
+            and returns an object with a `predict_image` method that accepts
+            a `timings` dict (such as a `PredictorNetwork`). It's called once
+            inside each worker.
+        num_workers (int): Number of worker processes to start.
+        threads_per_worker (int): Number of threads used by the session of
+            each worker. Defaults to splitting the available CPUs evenly.
+        max_image_pixels (int): Size (in pixels) of the largest image that can
+            be predicted.
+        pin_cores (bool): Whether to pin each worker to its own set of cores.
+    """
+
+    def __init__(self, create_network, num_workers,
+                 threads_per_worker=None,
+                 max_image_pixels=DEFAULT_MAX_IMAGE_PIXELS, pin_cores=True):
+        if num_workers < 1:
+            raise ValueError('`num_workers` must be at least 1.')
+
+        context = _get_context()
+        cpu_count = multiprocessing.cpu_count()
+        if threads_per_worker is None:
+            threads_per_worker = max(1, cpu_count // num_workers)
+        # Only pin workers to cores when there are enough for all of them.
+        pin_cores = pin_cores and threads_per_worker * num_workers <= cpu_count
+
+        self._max_image_bytes = max_image_pixels * 3
+        self._idle_workers = queue.Queue()
+        self._waiting_lock = threading.Lock()
+        self._waiting = 0
+
+        self._workers = []
+        for index in range(num_workers):
+            cores = None
+            if pin_cores:
+                cores = set(range(
+                    index * threads_per_worker,
+                    (index + 1) * threads_per_worker
+                ))
+
+            image_buffer = context.RawArray('B', self._max_image_bytes)
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_worker_main,
+                args=(
+                    create_network, threads_per_worker, cores, image_buffer,
+                    child_connection
+                )
+            )
+            process.daemon = True
+            process.start()
+            # Close our copy so a dead worker is detected as an `EOFError`.
+            child_connection.close()
+
+            self._workers.append(InferenceWorker(
+                index, process, connection, image_buffer, cores
+            ))
+
+        # Wait for every worker to finish loading the model.
+        for worker in self._workers:
+            try:
+                status, value = worker.connection.recv()
+            except EOFError:
+                status, value = 'error', 'Worker stopped unexpectedly.'
+
+            if status != 'ready':
+                self.close()
+                raise RuntimeError(
+                    'Worker {} failed to load the model:\n{}'.format(
+                        worker.index, value
+                    )
+                )
+
+            worker.model_load_time = value
+            tf.logging.info(
+                'Worker {} (pid {}) loaded the model in {:.2f}s.'.format(
+                    worker.index, worker.process.pid, value
+                )
+            )
+            self._idle_workers.put(worker)
+
+    def predict(self, image, timings=None):
+        """Predict `image` in the first idle worker, waiting for one if needed.
+
+        If a `timings` dict is given, the time spent by the worker in each
+        stage of the prediction is added to it.
+        """
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        if image.nbytes > self._max_image_bytes:
+            raise ValueError(
+                'Image of shape {} is too large to predict.'.format(
+                    image.shape
+                )
+            )
+
+        with self._waiting_lock:
+            self._waiting += 1
+        try:
+            worker = self._get_worker()
+        finally:
+            with self._waiting_lock:
+                self._waiting -= 1
+
+        try:
+            return worker.predict(image, timings=timings)
+        finally:
+            if worker.is_alive():
+                self._idle_workers.put(worker)
+            else:
+                tf.logging.error(
+                    'Worker {} is not running anymore.'.format(worker.index)
+                )
+
+    def _get_worker(self):
+        while True:
+            if not any(worker.is_alive() for worker in self._workers):
+                raise RuntimeError('No inference workers are running.')
+
+            # The busy workers may die instead of becoming idle, so don't
+            # wait for them indefinitely.
+            try:
+                worker = self._idle_workers.get(
+                    timeout=WORKER_CHECK_INTERVAL
+                )
+            except queue.Empty:
+                continue
+
+            if worker.is_alive():
+                return worker
+
+    @property
+    def queue_depth(self):
+        """Number of requests waiting for an idle worker."""
+        return self._waiting
+
+    def get_stats(self):
+        """Returns the health and load of each worker as a dict."""
+        return {
+            'queue_depth': self.queue_depth,
+            'idle_workers': self._idle_workers.qsize(),
+            'workers': [worker.get_stats() for worker in self._workers],
+        }
+
+    def close(self):
+        """Stop every worker process."""
+        for worker in self._workers:
+            if worker.is_alive():
+                try:
+                    worker.connection.send(None)
+                except IOError:
+                    pass
+
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.is_alive():
+                worker.process.terminate()
+            worker.connection.close()
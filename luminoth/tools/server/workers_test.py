@@ -0,0 +1,140 @@
+import numpy as np
+import os
+import tensorflow as tf
+import threading
+import time
+
+from luminoth.tools.server.workers import InferenceWorkerPool
+
+
+class MockNetwork(object):
+    """Predicts the shape and sum of the image, along with the worker pid."""
+
+    def predict_image(self, image, timings=None):
+        if image.shape[0] == 1:
+            raise ValueError('Image too small.')
+
+        timings['inference'] = 0.5
+
+        return {
+            'shape': list(image.shape),
+            'sum': int(image.sum()),
+            'pid': os.getpid(),
+        }
+
+
+def create_mock_network(num_threads):
+    return MockNetwork()
+
+
+def create_broken_network(num_threads):
+    raise ValueError('Checkpoint not found.')
+
+
+class InferenceWorkerPoolTest(tf.test.TestCase):
+
+    def setUp(self):
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def testPredict(self):
+        """Tests that images reach the workers through shared memory intact.
+        """
+        self.pool = InferenceWorkerPool(
+            create_mock_network, 2, threads_per_worker=1,
+            max_image_pixels=100 * 100
+        )
+
+        images = [
+            np.random.randint(0, 256, size=(10 + idx, 20, 3), dtype=np.uint8)
+            for idx in range(8)
+        ]
+        results = [None] * len(images)
+
+        def worker(idx):
+            results[idx] = self.pool.predict(images[idx])
+
+        threads = [
+            threading.Thread(target=worker, args=(idx,))
+            for idx in range(len(images))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for image, result in zip(images, results):
+            self.assertEqual(result['shape'], list(image.shape))
+            self.assertEqual(result['sum'], int(image.sum()))
+            self.assertNotEqual(result['pid'], os.getpid())
+
+        stats = self.pool.get_stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['idle_workers'], 2)
+        self.assertEqual(
+            sum(worker['total_requests'] for worker in stats['workers']), 8
+        )
+        self.assertTrue(all(worker['alive'] for worker in stats['workers']))
+
+    def testErrors(self):
+        """Tests that prediction errors are raised without killing workers.
+        """
+        self.pool = InferenceWorkerPool(
+            create_mock_network, 1, max_image_pixels=100 * 100
+        )
+
+        with self.assertRaises(RuntimeError):
+            self.pool.predict(np.zeros((1, 10, 3)))
+
+        # Images larger than the shared buffer are rejected.
+        with self.assertRaises(ValueError):
+            self.pool.predict(np.zeros((200, 200, 3)))
+
+        timings = {}
+        result = self.pool.predict(np.ones((5, 5, 3)), timings=timings)
+        self.assertEqual(result['sum'], 75)
+        self.assertEqual(timings, {'inference': 0.5})
+
+        worker_stats = self.pool.get_stats()['workers'][0]
+        self.assertEqual(worker_stats['total_requests'], 2)
+        self.assertEqual(worker_stats['total_errors'], 1)
+
+    def testWorkersDied(self):
+        """Tests waiting requests fail once every worker stopped running.
+        """
+        self.pool = InferenceWorkerPool(create_mock_network, 1)
+        # Keep the only worker busy, so requests wait for it.
+        worker = self.pool._idle_workers.get()
+
+        errors = []
+
+        def predict():
+            try:
+                self.pool.predict(np.ones((5, 5, 3)))
+            except RuntimeError as e:
+                errors.append(e)
+
+        waiting = threading.Thread(target=predict)
+        waiting.daemon = True
+        waiting.start()
+        time.sleep(0.1)
+        # The worker dies instead of becoming idle.
+        worker.process.terminate()
+        worker.process.join()
+
+        waiting.join(timeout=10)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(len(errors), 1)
+
+    def testModelLoadError(self):
+        """Tests that failing to load the model is reported on startup.
+        """
+        with self.assertRaises(RuntimeError):
+            InferenceWorkerPool(create_broken_network, 2)
+
+
+if __name__ == '__main__':
+    tf.test.main()
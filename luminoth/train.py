@@ -11,7 +11,7 @@ from luminoth.datasets import get_dataset
 from luminoth.datasets.exceptions import InvalidDataDirectory
 from luminoth.models import get_model
 from luminoth.utils.config import get_config
-from luminoth.utils.hooks import ImageVisHook, VarVisHook
+from luminoth.utils.hooks import ImageVisHook, StepTimingHook, VarVisHook
 from luminoth.utils.training import get_optimizer, clip_gradients_by_norm
 from luminoth.utils.experiments import save_run
 
@@ -35,6 +35,13 @@ def run(config, target='', cluster_spec=None, is_chief=True, job_name=None,
     else:
         tf.logging.set_verbosity(tf.logging.INFO)
 
+    if config.train.batch_size > 1 and config.model.type != 'fasterrcnn':
+        tf.logging.warning(
+            'Only Faster R-CNN can be trained with batches of more than one '
+            'image. Using `batch_size` = 1.'
+        )
+        config.train.batch_size = 1
+
     model = model_class(config)
 
     # Placement of ops on devices using replica device setter
@@ -49,9 +56,27 @@ def run(config, target='', cluster_spec=None, is_chief=True, job_name=None,
         except KeyError:
             raise KeyError('dataset.type should be set on the custom config.')
 
+        # Each worker reads a different part of the dataset. The chief
+        # (`master`) goes first, then the rest of the workers.
+        num_workers, worker_index = 1, 0
+        if cluster_spec is not None:
+            num_master = (
+                cluster_spec.num_tasks('master')
+                if 'master' in cluster_spec.jobs else 0
+            )
+            num_workers = num_master + (
+                cluster_spec.num_tasks('worker')
+                if 'worker' in cluster_spec.jobs else 0
+            )
+            worker_index = task_index + (
+                num_master if job_name == 'worker' else 0
+            )
+
         try:
             dataset_class = get_dataset_fn(config.dataset.type)
-            dataset = dataset_class(config)
+            dataset = dataset_class(
+                config, num_workers=num_workers, worker_index=worker_index
+            )
             train_dataset = dataset()
         except InvalidDataDirectory as exc:
             tf.logging.error(
@@ -63,9 +88,28 @@ def run(config, target='', cluster_spec=None, is_chief=True, job_name=None,
         train_filename = train_dataset['filename']
         train_bboxes = train_dataset['bboxes']
 
-        prediction_dict = model(train_image, train_bboxes, is_training=True)
+        model_kwargs = {}
+        if 'image_shape' in train_dataset:
+            # Images in a batch are padded to the same size.
+            model_kwargs['image_shapes'] = train_dataset['image_shape']
+
+        prediction_dict = model(
+            train_image, train_bboxes, is_training=True, **model_kwargs
+        )
         total_loss = model.loss(prediction_dict)
 
+        vis_prediction_dict = prediction_dict
+        vis_image = train_image
+        vis_bboxes = train_bboxes
+        if isinstance(prediction_dict, list):
+            # Only the first image of each batch is visualized.
+            vis_prediction_dict = prediction_dict[0]
+            image_shape = train_dataset['image_shape'][0]
+            vis_image = train_image[0, :image_shape[0], :image_shape[1]]
+            vis_bboxes = tf.boolean_mask(
+                train_bboxes[0], tf.greater_equal(train_bboxes[0, :, 4], 0)
+            )
+
         global_step = tf.train.get_or_create_global_step()
 
         optimizer = get_optimizer(config.train, global_step)
@@ -150,7 +194,9 @@ def run(config, target='', cluster_spec=None, is_chief=True, job_name=None,
     scaffold = tf.train.Scaffold(
         saver=model_saver,
         init_op=tf.global_variables_initializer() if is_chief else tf.no_op(),
-        local_init_op=tf.group(tf.initialize_local_variables(), slot_init),
+        local_init_op=tf.group(
+            tf.initialize_local_variables(), slot_init, dataset.initializer
+        ),
         ready_for_local_init_op=tf.constant([], dtype=tf.string),
         summary_op=summary_op,
         init_fn=load_base_net_checkpoint,
@@ -186,15 +232,28 @@ def run(config, target='', cluster_spec=None, is_chief=True, job_name=None,
         and checkpoint_dir is not None
     )
     if should_add_hooks:
+        if config.train.get('step_timing'):
+            # StepTiming only runs on the chief, and goes first so it's as
+            # close as possible to `Session.run`.
+            chief_only_hooks.append(
+                StepTimingHook(
+                    list(train_dataset.values()),
+                    queue_occupancy=dataset.queue_occupancy,
+                    every_n_steps=config.train.display_every_steps,
+                    every_n_secs=config.train.display_every_secs,
+                    output_dir=checkpoint_dir,
+                )
+            )
+
         if not config.train.debug and image_vis == 'debug':
             tf.logging.warning('ImageVisHook will not run without debug mode.')
         elif image_vis is not None:
             # ImageVis only runs on the chief.
             chief_only_hooks.append(
                 ImageVisHook(
-                    prediction_dict,
-                    image=train_dataset['image'],
-                    gt_bboxes=train_dataset['bboxes'],
+                    vis_prediction_dict,
+                    image=vis_image,
+                    gt_bboxes=vis_bboxes,
                     config=config.model,
                     output_dir=checkpoint_dir,
                     every_n_steps=config.train.display_every_steps,
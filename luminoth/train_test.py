@@ -60,7 +60,7 @@ class TrainTest(tf.test.TestCase):
         """
         Mocks luminoth.datasets.datasets.get_dataset
         """
-        def dataset_class(arg2):
+        def dataset_class(arg2, **kwargs):
             def build():
                 queue_dtypes = [tf.float32, tf.int32, tf.string]
                 queue_names = ['image', 'bboxes', 'filename']
@@ -84,6 +84,8 @@ class TrainTest(tf.test.TestCase):
                     tf.train.QueueRunner(queue, enqueue_ops))
 
                 return queue.dequeue()
+            # Queue-based datasets need no initialization.
+            build.initializer = tf.no_op()
             return build
         return dataset_class
 
@@ -1,11 +1,13 @@
 import numpy as np
 import tensorflow as tf
+import time
 
 from luminoth.utils.bbox_transform import (
     encode as encode_np, decode as decode_np, clip_boxes as clip_boxes_np
 )
 from luminoth.utils.bbox_transform_tf import (
-    encode as encode_tf, decode as decode_tf, clip_boxes as clip_boxes_tf
+    encode as encode_tf, decode as decode_tf, clip_boxes as clip_boxes_tf,
+    change_order, multiclass_non_max_suppression
 )
 from luminoth.utils.test.gt_boxes import generate_gt_boxes
 
@@ -151,6 +153,149 @@ class BBoxTransformTest(tf.test.TestCase):
             proposals = generate_gt_boxes(i, image_size=800)
             self._encode_decode(proposals, gt_boxes)
 
+    def _multiclass_nms_loop(self, bboxes, scores, labels, num_classes,
+                             max_per_class, iou_threshold, capped=False):
+        """Runs NMS with a separate op for each class, as it used to be done.
+
+        When `capped`, only the `max_per_class` highest scoring candidates of
+        each class go through NMS.
+        """
+        selected = []
+        for class_id in range(num_classes):
+            class_idx = tf.where(tf.equal(labels, class_id))[:, 0]
+            if capped:
+                class_top = tf.nn.top_k(
+                    tf.gather(scores, class_idx),
+                    k=tf.minimum(max_per_class, tf.size(class_idx))
+                ).indices
+                class_idx = tf.gather(class_idx, class_top)
+            class_selected = tf.image.non_max_suppression(
+                change_order(tf.gather(bboxes, class_idx)),
+                tf.gather(scores, class_idx), max_per_class,
+                iou_threshold=iou_threshold
+            )
+            selected.append(
+                tf.to_int32(tf.gather(class_idx, class_selected))
+            )
+        return tf.concat(selected, axis=0)
+
+    def _nms_candidates(self, num_boxes, num_classes):
+        """Every box with every label, as with `min_prob_threshold = 0`."""
+        bboxes = np.tile(
+            generate_gt_boxes(num_boxes, image_size=600), [num_classes, 1]
+        ).astype(np.float32)
+        scores = np.random.RandomState(0).uniform(
+            size=num_boxes * num_classes
+        ).astype(np.float32)
+        labels = np.repeat(
+            np.arange(num_classes, dtype=np.int32), num_boxes
+        )
+        # Candidates are given ordered by box and then by class.
+        order = np.argsort(
+            np.tile(np.arange(num_boxes), num_classes), kind='mergesort'
+        )
+        return bboxes[order], scores[order], labels[order]
+
+    def testMulticlassNonMaxSuppression(self):
+        num_classes = 4
+        max_per_class = 5
+        random = np.random.RandomState(0)
+        bboxes = generate_gt_boxes(200, image_size=100).astype(np.float32)
+        scores = random.uniform(size=200).astype(np.float32)
+        labels = random.randint(num_classes, size=200).astype(np.int32)
+
+        selected_tf = multiclass_non_max_suppression(
+            bboxes, scores, labels, max_per_class, 0.5
+        )
+        # Compare against running NMS separately for the top candidates of
+        # each class.
+        expected_tf = self._multiclass_nms_loop(
+            bboxes, scores, labels, num_classes, max_per_class, 0.5,
+            capped=True
+        )
+
+        with self.test_session() as sess:
+            selected, expected = sess.run([selected_tf, expected_tf])
+
+        self.assertAllEqual(selected, expected)
+        self.assertAllEqual(
+            np.bincount(labels[selected], minlength=num_classes)
+            <= max_per_class,
+            [True] * num_classes
+        )
+
+        # Without candidates nothing is selected.
+        empty_tf = multiclass_non_max_suppression(
+            np.zeros((0, 4), np.float32), np.zeros((0,), np.float32),
+            np.zeros((0,), np.int32), max_per_class, 0.5
+        )
+        with self.test_session() as sess:
+            self.assertEqual(sess.run(empty_tf).shape, (0,))
+
+    def testMulticlassNonMaxSuppressionEmptyClasses(self):
+        """Tests classes without candidates are skipped.
+
+        Each class has at most `max_per_class` candidates, so the result is
+        the same as running NMS over every candidate of each class.
+        """
+        num_classes = 80
+        max_per_class = 100
+        random = np.random.RandomState(0)
+        bboxes = generate_gt_boxes(150, image_size=100).astype(np.float32)
+        scores = random.uniform(size=150).astype(np.float32)
+        labels = random.choice([3, 41, 79], size=150).astype(np.int32)
+
+        selected_tf = multiclass_non_max_suppression(
+            bboxes, scores, labels, max_per_class, 0.5
+        )
+        expected_tf = self._multiclass_nms_loop(
+            bboxes, scores, labels, num_classes, max_per_class, 0.5
+        )
+
+        with self.test_session() as sess:
+            selected, expected = sess.run([selected_tf, expected_tf])
+
+        self.assertAllEqual(selected, expected)
+
+    def testMulticlassNonMaxSuppressionBenchmark(self):
+        """Compares the running time against a separate NMS for each class.
+
+        Every proposal is a candidate for every class, which is what happens
+        with `min_prob_threshold = 0` (as used by `lumi eval` and frozen
+        graphs).
+        """
+        num_classes = 100
+        max_per_class = 100
+        bboxes, scores, labels = self._nms_candidates(300, num_classes)
+
+        selected_tf = multiclass_non_max_suppression(
+            bboxes, scores, labels, max_per_class, 0.5
+        )
+        expected_tf = self._multiclass_nms_loop(
+            bboxes, scores, labels, num_classes, max_per_class, 0.5,
+            capped=True
+        )
+
+        with self.test_session() as sess:
+            # Warm up both before timing them.
+            selected, expected = sess.run([selected_tf, expected_tf])
+            self.assertAllEqual(selected, expected)
+
+            start = time.time()
+            for _ in range(5):
+                sess.run(expected_tf)
+            loop_time = (time.time() - start) / 5
+
+            start = time.time()
+            for _ in range(5):
+                sess.run(selected_tf)
+            single_time = (time.time() - start) / 5
+
+        tf.logging.info(
+            'multiclass_non_max_suppression: {:.3f}s (one op per class: '
+            '{:.3f}s).'.format(single_time, loop_time)
+        )
+
 
 if __name__ == '__main__':
     tf.test.main()
@@ -126,6 +126,89 @@ def change_order(bboxes):
         return bboxes
 
 
+def multiclass_non_max_suppression(bboxes, scores, labels, max_per_class,
+                                   iou_threshold):
+    """Applies NMS separately for each class, with a single NMS op.
+
+    Only the `max_per_class` highest scoring candidates of each class are
+    kept. Then, the boxes of each class are shifted so they don't overlap
+    with the ones of any other class, and NMS is run once over all of them.
+    This way, the work done doesn't grow with the number of classes, but
+    with the number of candidates kept.
+
+    Args:
+        bboxes: A Tensor of shape (total_bboxes, 4), with the
+            (x_min, y_min, x_max, y_max) of the candidates of every class.
+        scores: A Tensor of shape (total_bboxes,).
+        labels: An int Tensor of shape (total_bboxes,), with non-negative
+            values.
+        max_per_class: Maximum number of bounding boxes to select per class.
+        iou_threshold: IoU threshold to use for NMS.
+
+    Returns:
+        selected: An int Tensor with the indices of the selected bounding
+            boxes. They are grouped by label (in increasing order), and sorted
+            by decreasing score within each label, which is the same order as
+            concatenating the results of running NMS for each class.
+    """
+    with tf.name_scope('BoundingBoxTransform/multiclass_nms'):
+        bboxes = tf.cast(bboxes, tf.float32)
+        scores = tf.cast(scores, tf.float32)
+        labels = tf.cast(labels, tf.int32)
+        total_bboxes = tf.shape(labels)[0]
+
+        # Sort the candidates by decreasing score and then (as `top_k` keeps
+        # the order of equal values) by label.
+        by_score = tf.nn.top_k(scores, k=total_bboxes).indices
+        by_label = tf.nn.top_k(
+            -tf.gather(labels, by_score), k=total_bboxes
+        ).indices
+        sorted_idx = tf.gather(by_score, by_label)
+        sorted_labels = tf.gather(labels, sorted_idx)
+
+        # Keep the first `max_per_class` candidates of each label.
+        num_labels = tf.reduce_max(tf.concat([[-1], labels], axis=0)) + 1
+        label_counts = tf.unsorted_segment_sum(
+            tf.ones_like(labels), labels, num_labels
+        )
+        label_starts = tf.cumsum(label_counts, exclusive=True)
+        rank = (
+            tf.range(total_bboxes) - tf.gather(label_starts, sorted_labels)
+        )
+        kept_idx = tf.boolean_mask(sorted_idx, rank < max_per_class)
+        kept_labels = tf.gather(labels, kept_idx)
+        kept_bboxes = tf.gather(bboxes, kept_idx)
+
+        # Shift the boxes of each label apart, so boxes of different labels
+        # never overlap.
+        coords = tf.concat([[0.], tf.reshape(kept_bboxes, [-1])], axis=0)
+        offset = tf.reduce_max(coords) - tf.reduce_min(coords) + 1.
+        shifted_bboxes = (
+            kept_bboxes +
+            tf.expand_dims(tf.to_float(kept_labels) * offset, 1)
+        )
+
+        num_kept = tf.shape(kept_idx)[0]
+        selected = tf.image.non_max_suppression(
+            change_order(shifted_bboxes), tf.gather(scores, kept_idx),
+            num_kept, iou_threshold=iou_threshold
+        )
+
+        # Selected boxes are sorted by decreasing score, so group them by
+        # label keeping that order.
+        num_selected = tf.shape(selected)[0]
+        order_key = (
+            tf.to_int64(tf.gather(kept_labels, selected)) *
+            tf.to_int64(num_kept) +
+            tf.to_int64(tf.range(num_selected))
+        )
+        selected = tf.gather(
+            selected, tf.nn.top_k(-order_key, k=num_selected).indices
+        )
+
+        return tf.gather(kept_idx, selected)
+
+
 if __name__ == '__main__':
     import numpy as np
 
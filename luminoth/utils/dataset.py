@@ -1,8 +1,17 @@
+import json
+import os
 import tensorflow as tf
 
 from lxml import etree
 
 
+# Describes the files (shards) a split was written into.
+MANIFEST_FILENAME = '{split}.manifest.json'
+SHARD_FILENAME = '{split}-{index:05d}-of-{total:05d}.tfrecords'
+# Lists the `[id, hash]` of each record in a shard, one per line.
+RECORDS_FILENAME = '{filename}.records'
+
+
 def node2dict(root):
     if root.getchildren():
         val = {}
@@ -57,3 +66,88 @@ def to_string(value):
     return tf.train.Feature(
         bytes_list=tf.train.BytesList(value=value)
     )
+
+
+def get_shard_filename(split, index, total):
+    """Returns the filename of the `index`-th of `total` shards of a split.
+    """
+    return SHARD_FILENAME.format(split=split, index=index, total=total)
+
+
+def get_records_filename(shard_filename):
+    """Returns the filename of the list of records of a shard.
+    """
+    return RECORDS_FILENAME.format(filename=shard_filename)
+
+
+def write_manifest(dataset_dir, split, shards, complete=True):
+    """Writes the manifest of a split.
+
+    Args:
+        dataset_dir: Directory the split is saved in.
+        split: Name of the split.
+        shards: List of dicts, one per file the split is saved in, with the
+            keys ``filename`` (relative to `dataset_dir`), ``num_records``
+            and, optionally, ``num_bytes``. Any other keys are not written.
+            (The records of each file are listed in a separate file, see
+            `get_records_filename`.)
+        complete (bool): Whether the split was fully written, or the manifest
+            describes a partially written split that may be resumed.
+    """
+    manifest = {
+        'split': split,
+        'complete': complete,
+        'num_records': sum(shard['num_records'] for shard in shards),
+        'shards': [
+            {
+                key: shard[key]
+                for key in ('filename', 'num_records', 'num_bytes')
+                if key in shard
+            }
+            for shard in shards
+        ],
+    }
+    manifest_path = os.path.join(
+        dataset_dir, MANIFEST_FILENAME.format(split=split)
+    )
+    with tf.gfile.GFile(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+
+def read_manifest(dataset_dir, split):
+    """Reads the manifest of a split, or returns `None` if there's none.
+    """
+    manifest_path = os.path.join(
+        dataset_dir, MANIFEST_FILENAME.format(split=split)
+    )
+    if not tf.gfile.Exists(manifest_path):
+        return None
+
+    with tf.gfile.GFile(manifest_path) as f:
+        return json.load(f)
+
+
+def get_split_files(dataset_dir, split):
+    """Returns the paths of the TFRecords files a split is saved in.
+
+    The files listed in the split's manifest are used when available.
+    Otherwise, looks for a single ``{split}.tfrecords`` file or, failing that,
+    for ``{split}-?????-of-?????.tfrecords`` shards.
+
+    Returns:
+        Sorted list of paths, empty when no files are found.
+    """
+    manifest = read_manifest(dataset_dir, split)
+    if manifest is not None:
+        return [
+            os.path.join(dataset_dir, shard['filename'])
+            for shard in manifest['shards']
+        ]
+
+    split_path = os.path.join(dataset_dir, '{}.tfrecords'.format(split))
+    if tf.gfile.Exists(split_path):
+        return [split_path]
+
+    return sorted(tf.gfile.Glob(os.path.join(
+        dataset_dir, '{}-?????-of-?????.tfrecords'.format(split)
+    )))
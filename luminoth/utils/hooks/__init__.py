@@ -1,2 +1,3 @@
 from .image_vis_hook import ImageVisHook  # noqa
+from .step_timing_hook import StepTimingHook  # noqa
 from .var_vis_hook import VarVisHook  # noqa
@@ -1,13 +1,14 @@
 import tensorflow as tf
 
 from tensorflow.python.training.summary_io import SummaryWriterCache
-from luminoth.utils.image_vis import image_vis_summaries
+from luminoth.utils.image_vis import ImageVisWorker
 
 
 class ImageVisHook(tf.train.SessionRunHook):
     def __init__(self, prediction_dict, image, config=None, gt_bboxes=None,
                  every_n_steps=None, every_n_secs=None, output_dir=None,
-                 summary_writer=None, image_visualization_mode=None):
+                 summary_writer=None, image_visualization_mode=None,
+                 max_pending=2):
         super(ImageVisHook, self).__init__()
         if (every_n_secs is None) == (every_n_steps is None):
             raise ValueError(
@@ -27,6 +28,10 @@ class ImageVisHook(tf.train.SessionRunHook):
         self._image_visualization_mode = image_visualization_mode
         self._image = image
         self._gt_bboxes = gt_bboxes
+        # Images are drawn in the background, so the training loop doesn't
+        # wait for them. Up to `max_pending` can be waiting to be drawn.
+        self._max_pending = max_pending
+        self._worker = None
 
         tf.logging.info('ImageVisHook was created with mode = "{}"'.format(
             image_visualization_mode
@@ -35,6 +40,10 @@ class ImageVisHook(tf.train.SessionRunHook):
     def begin(self):
         if self._summary_writer is None and self._output_dir:
             self._summary_writer = SummaryWriterCache.get(self._output_dir)
+        if self._summary_writer is not None:
+            self._worker = ImageVisWorker(
+                self._summary_writer, max_pending=self._max_pending
+            )
         self._next_step = None
         self._global_step = tf.train.get_global_step()
         if self._global_step is None:
@@ -63,19 +72,19 @@ class ImageVisHook(tf.train.SessionRunHook):
         if self._draw_images:
             self._timer.update_last_triggered_step(global_step)
             prediction_dict = results.get('prediction_dict')
-            if prediction_dict is not None:
-                summaries = image_vis_summaries(
-                    prediction_dict, config=self._config,
+            if prediction_dict is not None and self._worker is not None:
+                self._worker.submit(
+                    global_step, prediction_dict, config=self._config,
                     image_visualization_mode=self._image_visualization_mode,
                     image=results.get('image'),
                     gt_bboxes=results.get('gt_bboxes')
                 )
-                if self._summary_writer is not None:
-                    for summary in summaries:
-                        self._summary_writer.add_summary(summary, global_step)
 
         self._next_step = global_step + 1
 
     def end(self, session=None):
+        if self._worker:
+            self._worker.close()
+            self._worker = None
         if self._summary_writer:
             self._summary_writer.flush()
@@ -0,0 +1,172 @@
+import collections
+import json
+import numpy as np
+import os
+import tensorflow as tf
+import time
+
+from tensorflow.python.training.summary_io import SummaryWriterCache
+
+
+# Percentiles of the recorded times written on every summary.
+PERCENTILES = (50, 90, 99)
+
+TIMING_FILENAME = 'step_timing.jsonl'
+
+
+class StepTimingHook(tf.train.SessionRunHook):
+    """Records where the time of each training step is spent.
+
+    Every step is split into:
+        - `input_wait`: time `Session.run` waits for the input pipeline to
+          return the step's images.
+        - `compute`: the rest of the `Session.run` call.
+        - `overhead`: time between `Session.run` calls, spent running the
+          rest of the hooks (writing summaries, drawing images, saving
+          checkpoints) and in the training loop itself.
+
+    Percentiles of these (and of the input queue occupancy, when available)
+    over the last `window_size` steps are periodically written as summaries
+    and appended to `step_timing.jsonl` in `output_dir`.
+
+    For `Session.run` to be measured as closely as possible, this hook must
+    be the first one to run.
+    """
+    def __init__(self, inputs, queue_occupancy=None, every_n_steps=None,
+                 every_n_secs=None, output_dir=None, window_size=100):
+        """
+        Args:
+            inputs: List of tensors returned by the input pipeline.
+            queue_occupancy: Scalar tensor with the fraction of the input
+                queue that's full, if any.
+            every_n_steps (int): Write the percentiles every N steps.
+            every_n_secs (int): Write the percentiles every N seconds.
+            output_dir (str): Directory to write the summaries and the
+                timings file to.
+            window_size (int): Number of steps the percentiles are
+                calculated over.
+        """
+        super(StepTimingHook, self).__init__()
+
+        if (every_n_secs is None) == (every_n_steps is None):
+            raise ValueError(
+                'Only one of "every_n_secs" and "every_n_steps" must be '
+                'provided.'
+            )
+
+        if output_dir is None:
+            tf.logging.warning(
+                '`output_dir` not provided, StepTimingHook is not saving '
+                'summaries.'
+            )
+
+        self._timer = tf.train.SecondOrStepTimer(
+            every_steps=every_n_steps,
+            every_secs=every_n_secs
+        )
+
+        self._inputs = inputs
+        self._queue_occupancy = queue_occupancy
+        self._output_dir = output_dir
+        self._window_size = window_size
+        self._summary_writer = None
+
+    def begin(self):
+        if self._output_dir:
+            self._summary_writer = SummaryWriterCache.get(self._output_dir)
+
+        self._next_step = None
+        self._global_step = tf.train.get_global_step()
+        if self._global_step is None:
+            raise RuntimeError(
+                'Global step must be created for StepTimingHook.'
+            )
+
+        # Time at which the inputs are ready, taken inside `Session.run`.
+        with tf.name_scope('step_timing'):
+            with tf.control_dependencies(self._inputs):
+                self._inputs_time = tf.py_func(
+                    time.time, [], tf.float64, stateful=True,
+                    name='inputs_time'
+                )
+
+        names = ['input_wait', 'compute', 'overhead']
+        if self._queue_occupancy is not None:
+            names.append('queue_occupancy')
+        self._values = collections.OrderedDict(
+            (name, collections.deque(maxlen=self._window_size))
+            for name in names
+        )
+        self._last_run_end = None
+
+    def before_run(self, run_context):
+        fetches = {
+            'global_step': self._global_step,
+            'inputs_time': self._inputs_time,
+        }
+        if self._queue_occupancy is not None:
+            fetches['queue_occupancy'] = self._queue_occupancy
+
+        self._write_summaries = (
+            self._next_step is None or
+            self._timer.should_trigger_for_step(self._next_step)
+        )
+
+        self._run_start = time.time()
+        if self._last_run_end is not None:
+            self._values['overhead'].append(
+                self._run_start - self._last_run_end
+            )
+
+        return tf.train.SessionRunArgs(fetches)
+
+    def after_run(self, run_context, run_values):
+        self._last_run_end = time.time()
+
+        results = run_values.results
+        global_step = results.get('global_step')
+
+        input_wait = max(results['inputs_time'] - self._run_start, 0.)
+        self._values['input_wait'].append(input_wait)
+        self._values['compute'].append(
+            self._last_run_end - self._run_start - input_wait
+        )
+        if self._queue_occupancy is not None:
+            self._values['queue_occupancy'].append(
+                results['queue_occupancy']
+            )
+
+        if self._write_summaries:
+            self._timer.update_last_triggered_step(global_step)
+            self._write(global_step)
+
+        self._next_step = global_step + 1
+
+    def _write(self, global_step):
+        record = {'step': int(global_step)}
+        summary = tf.Summary()
+        for name, values in self._values.items():
+            if not values:
+                continue
+
+            record[name] = {}
+            for percentile, value in zip(
+                    PERCENTILES, np.percentile(values, PERCENTILES)):
+                key = 'p{}'.format(percentile)
+                record[name][key] = float(value)
+                summary.value.add(
+                    tag='step_timing/{}_{}'.format(name, key),
+                    simple_value=record[name][key]
+                )
+
+        if self._summary_writer is not None:
+            self._summary_writer.add_summary(summary, global_step)
+
+        if self._output_dir:
+            timing_file = os.path.join(self._output_dir, TIMING_FILENAME)
+            with tf.gfile.Open(timing_file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def end(self, session=None):
+        if self._summary_writer:
+            self._summary_writer.flush()
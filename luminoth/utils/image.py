@@ -35,6 +35,28 @@ def adjust_bboxes(bboxes, old_height, old_width, new_height, new_width):
     return tf.stack([x_min, y_min, x_max, y_max, label], axis=1)
 
 
+def resize_images(images, size):
+    """Resizes images using bilinear interpolation, keeping their dtype.
+
+    `tf.image.resize_images` always returns `float32` images, so `uint8` ones
+    are rounded and cast back, keeping them four times smaller than floats.
+
+    Args:
+        images: Tensor of shape (H, W, C) or (batch_size, H, W, C).
+        size: Tensor with the new (height, width).
+
+    Returns:
+        Resized images with the same dtype as `images`.
+    """
+    # Resize image using TensorFlow's own `resize_image` utility.
+    resized = tf.image.resize_images(
+        images, size, method=tf.image.ResizeMethod.BILINEAR
+    )
+    if images.dtype == tf.uint8:
+        resized = tf.saturate_cast(tf.round(resized), tf.uint8)
+    return resized
+
+
 def resize_image(image, bboxes=None, min_size=None, max_size=None):
     """
     We need to resize image and (optionally) bounding boxes when the biggest
@@ -90,10 +112,8 @@ def resize_image(image, bboxes=None, min_size=None, max_size=None):
     new_height = height * scale_factor
     new_width = width * scale_factor
 
-    # Resize image using TensorFlow's own `resize_image` utility.
-    image = tf.image.resize_images(
-        image, tf.stack(tf.to_int32([new_height, new_width])),
-        method=tf.image.ResizeMethod.BILINEAR
+    image = resize_images(
+        image, tf.stack(tf.to_int32([new_height, new_width]))
     )
 
     if bboxes is not None:
@@ -123,10 +143,8 @@ def resize_image_fixed(image, new_height, new_width, bboxes=None):
     scale_factor_height = new_height / height
     scale_factor_width = new_width / width
 
-    # Resize image using TensorFlow's own `resize_image` utility.
-    image = tf.image.resize_images(
-        image, tf.stack(tf.to_int32([new_height, new_width])),
-        method=tf.image.ResizeMethod.BILINEAR
+    image = resize_images(
+        image, tf.stack(tf.to_int32([new_height, new_width]))
     )
 
     if bboxes is not None:
@@ -193,10 +211,7 @@ def patch_image(image, bboxes=None, offset_height=0, offset_width=0,
     if bboxes is None:
         # Resize the patch to the original image's size. This is to make sure
         # we respect restrictions in image size in the models.
-        new_image_resized = tf.image.resize_images(
-            new_image, im_shape[:2],
-            method=tf.image.ResizeMethod.BILINEAR
-        )
+        new_image_resized = resize_images(new_image, im_shape[:2])
         return_dict = {'image': new_image_resized}
         return return_dict
 
@@ -282,10 +297,7 @@ def patch_image(image, bboxes=None, offset_height=0, offset_width=0,
         axis=1
     )
     # Now resize the image to the original size and adjust bboxes accordingly
-    new_image_resized = tf.image.resize_images(
-        new_image, im_shape[:2],
-        method=tf.image.ResizeMethod.BILINEAR
-    )
+    new_image_resized = resize_images(new_image, im_shape[:2])
     # adjust_bboxes requires height and width values with dtype=float32
     new_bboxes_resized = adjust_bboxes(
         new_bboxes,
@@ -476,10 +488,7 @@ def random_resize(image, bboxes=None, min_size=600, max_size=980,
         dtype=tf.int32,
         seed=seed,
     )
-    image = tf.image.resize_images(
-        image, new_size,
-        method=tf.image.ResizeMethod.BILINEAR
-    )
+    image = resize_images(image, new_size)
     # Our returned dict needs to have a fixed size. So we can't
     # return the scale_factor that resize_image returns.
     if bboxes is not None:
@@ -522,6 +531,12 @@ def random_distortion(image, bboxes=None, brightness=None, contrast=None,
         image: Distorted image with the same shape as the input image.
         bboxes: Unchanged bboxes.
     """
+    # Distortions are applied on the [0, 255] float values, as they would be
+    # on `float32` images (color adjustments scale `uint8` images to [0, 1]).
+    dtype = image.dtype
+    if dtype == tf.uint8:
+        image = tf.to_float(image)
+
     # Following Andrew Howard (2013). "Some improvements on deep convolutional
     # neural network based image classification."
     if brightness is not None:
@@ -556,6 +571,8 @@ def random_distortion(image, bboxes=None, brightness=None, contrast=None,
             image, lower=saturation.lower, upper=saturation.upper,
             seed=seed
         )
+    if dtype == tf.uint8:
+        image = tf.saturate_cast(tf.round(image), tf.uint8)
     if bboxes is None:
         return_dict = {'image': image}
     else:
@@ -605,7 +622,10 @@ def expand(image, bboxes=None, fill=0, min_ratio=1, max_ratio=4, seed=None):
     paddings = tf.stack([tf.concat([pad_top, pad_bottom], axis=0),
                          tf.concat([pad_left, pad_right], axis=0),
                          tf.constant([0., 0.])])
-    expanded_image = tf.pad(image, tf.to_int32(paddings), constant_values=fill)
+    expanded_image = tf.pad(
+        image, tf.to_int32(paddings),
+        constant_values=tf.cast(fill, image.dtype)
+    )
 
     # Adjust bboxes
     shift_bboxes_by = tf.concat([pad_left, pad_top, pad_left, pad_top], axis=0)
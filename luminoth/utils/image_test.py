@@ -5,7 +5,7 @@ from easydict import EasyDict
 
 from luminoth.utils.image import (
     resize_image, flip_image, random_patch, random_resize, random_distortion,
-    patch_image
+    patch_image, expand
 )
 from luminoth.utils.test.gt_boxes import generate_gt_boxes
 
@@ -566,6 +566,58 @@ class ImageTest(tf.test.TestCase):
         large_number = 0.1
         self.assertAllClose(image, ret_image, rtol=0.05, atol=large_number)
 
+    def testUint8Augmentation(self):
+        """
+        Tests that `uint8` images are kept as such, with the same results as
+        with `float32` ones.
+        """
+        image_array, bboxes_array = self._get_image_with_boxes(
+            (500, 600, 3), 10
+        )
+        image_array = np.round(image_array * 255)
+
+        augmentations = [
+            lambda image, bboxes: resize_image(
+                image, bboxes=bboxes, min_size=300, max_size=400
+            ),
+            lambda image, bboxes: flip_image(image, bboxes=bboxes),
+            lambda image, bboxes: random_patch(
+                image, bboxes=bboxes, seed=0, **self._random_patch_config
+            ),
+            lambda image, bboxes: random_resize(
+                image, bboxes=bboxes, seed=0, **self._random_resize_config
+            ),
+            lambda image, bboxes: random_distortion(
+                image, bboxes=bboxes, seed=0,
+                brightness=EasyDict({'max_delta': 0.3})
+            ),
+            lambda image, bboxes: expand(image, bboxes=bboxes, seed=0),
+        ]
+        for augmentation in augmentations:
+            tf.reset_default_graph()
+            bboxes = tf.constant(bboxes_array, tf.int32)
+            uint8_result = augmentation(
+                tf.constant(image_array, tf.uint8), bboxes
+            )
+            float_result = augmentation(
+                tf.constant(image_array, tf.float32), bboxes
+            )
+            self.assertEqual(uint8_result['image'].dtype, tf.uint8)
+
+            with self.test_session() as sess:
+                uint8_result, float_result = sess.run(
+                    [uint8_result, float_result]
+                )
+
+            self.assertAllClose(
+                uint8_result['image'],
+                np.clip(float_result['image'], 0, 255),
+                atol=1
+            )
+            self.assertAllEqual(
+                uint8_result['bboxes'], float_result['bboxes']
+            )
+
 
 if __name__ == '__main__':
     tf.test.main()
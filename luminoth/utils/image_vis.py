@@ -2,6 +2,7 @@ import io
 import numpy as np
 import os
 import logging
+import threading
 import PIL.Image as Image
 import PIL.ImageDraw as ImageDraw
 import PIL.ImageFont as ImageFont
@@ -10,6 +11,7 @@ import tensorflow as tf
 from .bbox_overlap import bbox_overlap
 from .bbox_transform import decode
 from base64 import b64encode
+from six.moves import queue
 from sys import stdout
 
 # flake8: noqa
@@ -183,6 +185,79 @@ def image_vis_summaries(pred_dict, config=None, extra_tag=None,
     return summaries
 
 
+class ImageVisWorker(object):
+    """Draws image visualizations and writes their summaries in the background.
+
+    Drawing the visualizations (specially in `debug` mode) and encoding them
+    can take seconds, so it's done on a separate thread instead of stalling
+    training or evaluation.
+
+    At most `max_pending` visualizations wait to be drawn. When falling behind,
+    new ones are dropped instead of blocking whoever submits them, unless
+    submitted with `block=True`.
+    """
+    def __init__(self, summary_writer, max_pending=2):
+        self._summary_writer = summary_writer
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, global_step, pred_dict, block=False, **kwargs):
+        """Queues a visualization to be drawn and written under `global_step`.
+
+        Keyword arguments are passed on to `image_vis_summaries`.
+
+        Args:
+            block (bool): Wait for room in the queue instead of dropping the
+                visualization when it's full.
+
+        Returns:
+            Whether the visualization was queued (instead of dropped).
+        """
+        try:
+            self._queue.put((global_step, pred_dict, kwargs), block=block)
+        except queue.Full:
+            self.dropped += 1
+            tf.logging.debug(
+                'Dropping image visualization for step {}.'.format(
+                    global_step
+                )
+            )
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            global_step, pred_dict, kwargs = item
+            try:
+                summaries = image_vis_summaries(pred_dict, **kwargs)
+                for summary in summaries:
+                    self._summary_writer.add_summary(summary, global_step)
+            except Exception as e:
+                tf.logging.error(
+                    'Failed to draw image visualization for step {}: '
+                    '{}'.format(global_step, e)
+                )
+
+    def close(self):
+        """Waits for the pending visualizations to be written.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self.dropped:
+            tf.logging.info(
+                '{} image visualizations were dropped to avoid blocking.'
+                .format(self.dropped)
+            )
+
+
 def image_to_summary(image_pil, tag):
     summary = tf.Summary(value=[
         tf.Summary.Value(tag=tag, image=tf.Summary.Image(
@@ -259,6 +334,143 @@ def get_image_draw(image):
     return image_pil, draw
 
 
+def draw_boxes(image_pil, boxes, fill=None, outline=None):
+    """Draws all of `boxes` on `image_pil` at once, using array operations.
+
+    The result is the same as calling `ImageDraw.rectangle` (on an `RGBA`
+    draw) for each box, except that every fill is drawn below every outline,
+    and boxes of the same color are blended together regardless of the order
+    of the rest. It takes time proportional to the number of boxes plus the
+    size of the image, instead of the area of every box, so drawing thousands
+    of anchors is cheap.
+
+    Args:
+        image_pil: `RGB` PIL image, which is drawn on in place.
+        boxes: Array of shape (num_boxes, 4), with the (x_min, y_min, x_max,
+            y_max) coordinates of each box. Boxes without a positive area are
+            ignored.
+        fill: RGBA color for the inside of the boxes, or array of shape
+            (num_boxes, 4) with a color for each box. `None` to not fill
+            them.
+        outline: RGBA color (or colors, same as `fill`) for the one pixel
+            border of the boxes. `None` to not draw it.
+
+    Returns:
+        The same `image_pil`.
+    """
+    boxes = np.round(
+        np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    ).astype(np.int64)
+    width, height = image_pil.size
+
+    x_min, y_min, x_max, y_max = boxes.T
+    visible = (
+        (x_max >= x_min) & (y_max >= y_min) &
+        (x_max >= 0) & (y_max >= 0) & (x_min < width) & (y_min < height)
+    )
+    clipped = np.clip(boxes, 0, [width - 1, height - 1] * 2)
+    cx_min, cy_min, cx_max, cy_max = clipped.T
+
+    pixels = np.asarray(image_pil, dtype=np.float64)
+
+    if fill is not None:
+        _blend_rectangles(
+            pixels, clipped[visible],
+            _box_colors(fill, len(boxes))[visible]
+        )
+
+    if outline is not None:
+        colors = _box_colors(outline, len(boxes))
+        # Rows of the sides, which don't include the top and bottom edges.
+        side_y_min = np.maximum(y_min + 1, 0)
+        side_y_max = np.minimum(y_max - 1, height - 1)
+        has_sides = visible & (side_y_max >= side_y_min)
+        edges = [
+            # Top, bottom, left and right edges, when inside the image.
+            (visible & (y_min >= 0), (cx_min, y_min, cx_max, y_min)),
+            (visible & (y_max < height) & (y_max > y_min),
+             (cx_min, y_max, cx_max, y_max)),
+            (has_sides & (x_min >= 0),
+             (x_min, side_y_min, x_min, side_y_max)),
+            (has_sides & (x_max < width) & (x_max > x_min),
+             (x_max, side_y_min, x_max, side_y_max)),
+        ]
+        _blend_rectangles(
+            pixels,
+            np.concatenate([
+                np.stack(edge, axis=1)[mask] for mask, edge in edges
+            ]),
+            np.concatenate([colors[mask] for mask, _ in edges])
+        )
+
+    image_pil.paste(
+        Image.fromarray(np.uint8(np.clip(np.round(pixels), 0, 255)))
+    )
+    return image_pil
+
+
+def _box_colors(color, num_boxes):
+    """Returns an array of shape (num_boxes, 4) with RGBA colors."""
+    colors = np.asarray(color, dtype=np.float64)
+    if colors.ndim == 1:
+        colors = np.tile(colors, (num_boxes, 1))
+    if colors.shape[1] == 3:
+        # Colors without alpha are opaque.
+        colors = np.pad(
+            colors, [(0, 0), (0, 1)], mode='constant', constant_values=255
+        )
+    return colors
+
+
+def _blend_rectangles(pixels, rectangles, colors):
+    """Alpha blends a color over each of the rectangles of `pixels`.
+
+    Blending `n` layers of the same color `c`, with alphas `a_1, ..., a_n`,
+    over a pixel `p` gives `c + (p - c) * (1 - a_1) * ... * (1 - a_n)`. So,
+    for each color, the products (as sums of logarithms) are calculated for
+    every pixel at once with a summed-area table.
+
+    Args:
+        pixels: Float array of shape (height, width, 3), modified in place.
+        rectangles: Int array of shape (num_rectangles, 4) with inclusive
+            (x_min, y_min, x_max, y_max) coordinates inside the image.
+        colors: Array of shape (num_rectangles, 4) with RGBA colors.
+    """
+    if not len(rectangles):
+        return
+
+    height, width = pixels.shape[:2]
+    x_min, y_min, x_max, y_max = rectangles.T
+    log_transparency = np.log(np.maximum(1. - colors[:, 3] / 255., 1e-6))
+
+    rgbs, color_idx = np.unique(colors[:, :3], axis=0, return_inverse=True)
+    color_idx = color_idx.reshape(-1)
+    for idx, rgb in enumerate(rgbs):
+        in_color = color_idx == idx
+        weights = log_transparency[in_color]
+
+        # Add the weights at the corners of the rectangles of a summed-area
+        # table, whose cumulative sums are the total for each pixel.
+        top = y_min[in_color] * (width + 1)
+        bottom = (y_max[in_color] + 1) * (width + 1)
+        left = x_min[in_color]
+        right = x_max[in_color] + 1
+        table = np.bincount(
+            np.concatenate([
+                top + left, top + right, bottom + left, bottom + right
+            ]),
+            weights=np.concatenate([weights, -weights, -weights, weights]),
+            minlength=(height + 1) * (width + 1)
+        ).reshape(height + 1, width + 1)
+        transparency = np.exp(
+            table.cumsum(axis=0).cumsum(axis=1)[:height, :width]
+        )
+
+        pixels -= rgb
+        pixels *= transparency[..., np.newaxis]
+        pixels += rgb
+
+
 def draw_positive_anchors(pred_dict, image):
     """
     Draws positive anchors used as "correct" in RPN
@@ -280,10 +492,11 @@ def draw_positive_anchors(pred_dict, image):
         'We have {} positive_anchors'.format(positive_anchors.shape[0]))
     logger.debug('GT boxes: {}'.format(gt_bboxes))
 
+    draw_boxes(
+        image_pil, positive_anchors, fill=(255, 0, 0, 40),
+        outline=(0, 255, 0, 100)
+    )
     for label, positive_anchor in zip(list(overlap_iou), positive_anchors):
-        draw.rectangle(
-            list(positive_anchor), fill=(255, 0, 0, 40),
-            outline=(0, 255, 0, 100))
         x, y = positive_anchor[:2]
         x = max(x, 0)
         y = max(y, 0)
@@ -291,10 +504,10 @@ def draw_positive_anchors(pred_dict, image):
             tuple([x, y]), text=str(label), font=font,
             fill=(0, 255, 0, 255))
 
-    for gt_box in gt_bboxes:
-        draw.rectangle(
-            list(gt_box[:4]), fill=(0, 0, 255, 60),
-            outline=(0, 0, 255, 150))
+    draw_boxes(
+        image_pil, gt_bboxes[:, :4], fill=(0, 0, 255, 60),
+        outline=(0, 0, 255, 150)
+    )
 
     return image_pil
 
@@ -304,14 +517,13 @@ def draw_gt_boxes(pred_dict, image):
     Draws GT boxes.
     """
 
-    image_pil, draw = get_image_draw(image)
+    image_pil, _ = get_image_draw(image)
     gt_bboxes = pred_dict['gt_bboxes']
-    for gt_box in gt_bboxes:
-        draw.rectangle(
-            list(gt_box[:4]),
-            fill=(0, 0, 255, 60),
-            outline=(0, 0, 255, 150)
-        )
+    draw_boxes(
+        image_pil, gt_bboxes[:, :4],
+        fill=(0, 0, 255, 60),
+        outline=(0, 0, 255, 150)
+    )
 
     return image_pil
 
@@ -326,13 +538,14 @@ def draw_anchor_centers(pred_dict, image):
     center_x = x_min + (x_max - x_min) / 2.
     center_y = y_min + (y_max - y_min) / 2.
 
-    image_pil, draw = get_image_draw(image)
+    image_pil, _ = get_image_draw(image)
 
-    for x, y in zip(center_x, center_y):
-        draw.rectangle(
-            [x - 1, y - 1, x + 1, y + 1],
-            fill=(255, 0, 0, 150), outline=(0, 255, 0, 200)
-        )
+    draw_boxes(
+        image_pil,
+        np.stack([center_x - 1, center_y - 1, center_x + 1, center_y + 1],
+                 axis=1),
+        fill=(255, 0, 0, 150), outline=(0, 255, 0, 200)
+    )
 
     return image_pil
 
@@ -395,32 +608,25 @@ def draw_anchors(pred_dict, image, anchor_num=None):
     back = Image.new('RGB', [max_x, max_y], 'white')
     back.paste(image_pil, [int(min_x), int(min_y)])
 
-    draw = ImageDraw.Draw(back, 'RGBA')
-
-    anchor_id_to_draw = anchor_num
-    draw_every = pred_dict['anchor_reference'].shape[0]
-    first = True
-    for anchor_id, anchor in enumerate(moved_anchors):
-        if anchor_num is not None:
-            if anchor_id != anchor_id_to_draw:
-                continue
-            else:
-                anchor_id_to_draw += draw_every
-
-        if first and anchor_num is not None:
-            draw.rectangle(
-                list(anchor), fill=(255, 0, 0, 40), outline=(0, 255, 0, 120)
-            )
-            first = False
-        elif anchor_num is None:
-            draw.rectangle(
-                list(anchor), fill=(255, 0, 0, 1), outline=(0, 255, 0, 2)
-            )
-        else:
-            draw.rectangle(
-                list(anchor), fill=(255, 0, 0, 2), outline=(0, 255, 0, 4)
-            )
+    if anchor_num is None:
+        draw_boxes(
+            back, moved_anchors, fill=(255, 0, 0, 1), outline=(0, 255, 0, 2)
+        )
+    else:
+        # Only draw the `anchor_num`-th reference anchor, at every position
+        # (highlighting the first one).
+        draw_every = pred_dict['anchor_reference'].shape[0]
+        selected_anchors = moved_anchors[anchor_num::draw_every]
+        draw_boxes(
+            back, selected_anchors[1:], fill=(255, 0, 0, 2),
+            outline=(0, 255, 0, 4)
+        )
+        draw_boxes(
+            back, selected_anchors[:1], fill=(255, 0, 0, 40),
+            outline=(0, 255, 0, 120)
+        )
 
+    draw = ImageDraw.Draw(back, 'RGBA')
     draw.text(
         tuple([min_x, min_y - 10]),
         text='{}w x {}h'.format(width, height),
@@ -441,17 +647,14 @@ def draw_anchor_batch(pred_dict, image):
     anchors = anchors[in_batch_idx]
     targets = targets[in_batch_idx]
 
-    image_pil, draw = get_image_draw(image)
+    image_pil, _ = get_image_draw(image)
 
-    for anchor, target in zip(anchors, targets):
-        if target == 1:
-            draw.rectangle(
-                list(anchor), fill=(20, 200, 10, 15),
-                outline=(20, 200, 10, 30))
-        else:
-            draw.rectangle(
-                list(anchor), fill=(200, 10, 170, 10),
-                outline=(200, 10, 170, 30))
+    foreground = (targets == 1)[:, np.newaxis]
+    draw_boxes(
+        image_pil, anchors,
+        fill=np.where(foreground, (20, 200, 10, 15), (200, 10, 170, 10)),
+        outline=np.where(foreground, (20, 200, 10, 30), (200, 10, 170, 30))
+    )
 
     return image_pil
 
@@ -490,20 +693,25 @@ def draw_top_proposals(pred_dict, image, min_score=0.8, max_display=20,
     scores = scores[top_scores_idx]
     proposals = proposals[top_scores_idx]
 
+    positive_area = np.logical_and(
+        proposals[:, 2] - proposals[:, 0] > 0,
+        proposals[:, 3] - proposals[:, 1] > 0
+    )
+    for proposal, score in zip(
+            proposals[~positive_area], scores[~positive_area]):
+        logger.debug(
+            'Ignoring top proposal without positive area: '
+            '{}, score: {}'.format(proposal, score))
+    proposals = proposals[positive_area]
+    scores = scores[positive_area]
+
     image_pil, draw = get_image_draw(image)
 
+    draw_boxes(
+        image_pil, proposals, fill=(0, 255, 0, 20), outline=(0, 255, 0, 80)
+    )
     for proposal, score in zip(proposals, scores):
-        bbox = list(proposal)
-        if (bbox[2] - bbox[0] <= 0) or (bbox[3] - bbox[1] <= 0):
-            logger.debug(
-                'Ignoring top proposal without positive area: '
-                '{}, score: {}'.format(proposal, score))
-            continue
-
-        draw.rectangle(
-            list(bbox), fill=(0, 255, 0, 20),
-            outline=(0, 255, 0, 80))
-        x, y = bbox[:2]
+        x, y = proposal[:2]
         x = max(x, 0)
         y = max(y, 0)
 
@@ -561,58 +769,63 @@ def draw_batch_proposals(pred_dict, image, display='proposal', top_k=None,
 
     bboxes = decode(all_anchors, bbox_pred)
 
-    image_pil, draw = get_image_draw(image)
+    positive_area = np.logical_and(
+        bboxes[:, 2] - bboxes[:, 0] > 0, bboxes[:, 3] - bboxes[:, 1] > 0
+    )
+    for target, proposal in zip(
+            targets[~positive_area], bboxes[~positive_area]):
+        logger.debug(
+            'Ignoring proposal for target {} '
+            'because of negative area => {}'.format(
+                target, proposal))
+    scores = scores[positive_area]
+    bboxes = bboxes[positive_area]
+    targets = targets[positive_area]
+    all_anchors = all_anchors[positive_area]
+
+    if display == 'anchor':
+        boxes = all_anchors
+    else:
+        boxes = bboxes
 
-    for score, proposal, target, max_overlap, anchor in zip(
-            scores, bboxes, targets, max_overlaps, all_anchors):
+    image_pil, draw = get_image_draw(image)
 
-        if ((proposal[2] - proposal[0] <= 0) or
-                (proposal[3] - proposal[1] <= 0)):
-            logger.debug(
-                'Ignoring proposal for target {} '
-                'because of negative area => {}'.format(
-                    target, proposal))
-            continue
+    foreground = (targets == 1)[:, np.newaxis]
+    draw_boxes(
+        image_pil, boxes,
+        fill=np.where(foreground, (0, 0, 255, 30), (255, 0, 0, 5)),
+        outline=np.where(
+            (scores > 0.5)[:, np.newaxis], (0, 0, 255, 50), (255, 0, 0, 50)
+        )
+    )
 
+    for score, target, box in zip(scores, targets, boxes):
         if target == 1:
-            fill = (0, 0, 255, 30)
             if score > 0.8:
                 font_fill = (0, 0, 255, 160)
             else:
                 font_fill = (0, 255, 255, 180)
         else:
-            fill = (255, 0, 0, 5)
             if score > 0.8:
                 font_fill = (255, 0, 255, 160)
             else:
                 font_fill = (255, 0, 0, 100)
 
-        if score > 0.5:
-            outline_fill = (0, 0, 255, 50)
-        else:
-            outline_fill = (255, 0, 0, 50)
-
         if np.abs(score - 1.) < 0.05:
             font_txt = '1'
         else:
             font_txt = '{:.2f}'.format(score)[1:]
 
-        if display == 'anchor':
-            box = list(anchor)
-        else:
-            box = list(proposal)
-
-        draw.rectangle(box, fill=fill, outline=outline_fill)
         x, y = box[:2]
         x = max(x, 0)
         y = max(y, 0)
 
-        score = float(score)
         draw.text(tuple([x, y]), text=font_txt, font=font, fill=font_fill)
 
-    for gt_box in gt_bboxes:
-        box = list(gt_box[:4])
-        draw.rectangle(box, fill=(0, 255, 0, 60), outline=(0, 255, 0, 70))
+    draw_boxes(
+        image_pil, gt_bboxes[:, :4], fill=(0, 255, 0, 60),
+        outline=(0, 255, 0, 70)
+    )
 
     return image_pil
 
@@ -629,19 +842,26 @@ def draw_top_nms_proposals(pred_dict, image, min_score=0.8, draw_gt=False):
     scores = scores[sorted_idx]
     proposals = proposals[sorted_idx]
 
+    positive_area = np.logical_and(
+        proposals[:, 2] - proposals[:, 0] > 0,
+        proposals[:, 3] - proposals[:, 1] > 0
+    )
+    for proposal in proposals[~positive_area]:
+        logger.debug('Proposal has negative area: {}'.format(list(proposal)))
+    scores = scores[positive_area]
+    proposals = proposals[positive_area]
+
     image_pil, draw = get_image_draw(image)
 
-    fill_alpha = 70
+    # The fill is more transparent the lower the proposal's score is.
+    fill_alpha = np.maximum(70 - 5 * np.arange(len(proposals)), 0)
+    fill = np.zeros((len(proposals), 4))
+    fill[:, 1] = 255
+    fill[:, 3] = fill_alpha
+    draw_boxes(image_pil, proposals, fill=fill, outline=(0, 255, 0, 50))
 
-    for topn, (score, proposal) in enumerate(zip(scores, proposals)):
+    for score, proposal in zip(scores, proposals):
         bbox = list(proposal)
-        if (bbox[2] - bbox[0] <= 0) or (bbox[3] - bbox[1] <= 0):
-            logger.debug('Proposal has negative area: {}'.format(bbox))
-            continue
-
-        draw.rectangle(
-            bbox, fill=(0, 255, 0, fill_alpha), outline=(0, 255, 0, 50))
-
         if np.abs(score - 1.0) <= 0.01:
             font_txt = '1'
         else:
@@ -651,14 +871,12 @@ def draw_top_nms_proposals(pred_dict, image, min_score=0.8, draw_gt=False):
             tuple([bbox[0], bbox[1]]), text=font_txt,
             font=font, fill=(0, 255, 0, 150))
 
-        fill_alpha -= 5
-
     if draw_gt:
         gt_bboxes = pred_dict['gt_bboxes']
-        for gt_box in gt_bboxes:
-            draw.rectangle(
-                list(gt_box[:4]), fill=(0, 0, 255, 60),
-                outline=(0, 0, 255, 150))
+        draw_boxes(
+            image_pil, gt_bboxes[:, :4], fill=(0, 0, 255, 60),
+            outline=(0, 0, 255, 150)
+        )
 
     return image_pil
 
@@ -715,16 +933,18 @@ def draw_rpn_cls_loss(pred_dict, image, foreground=True, topn=10,
 
     image_pil, draw = get_image_draw(image)
 
-    for anchor_prob, anchor, anchor_loss in zip(prob, anchors, loss):
-        anchor = list(anchor)
-        draw.rectangle(anchor, fill=(0, 255, 0, 20), outline=(0, 255, 0, 100))
+    draw_boxes(
+        image_pil, anchors, fill=(0, 255, 0, 20), outline=(0, 255, 0, 100)
+    )
+    for anchor, anchor_loss in zip(anchors, loss):
         draw.text(
             tuple([anchor[0], anchor[1]]), text='{:.2f}'.format(anchor_loss),
             font=font, fill=(0, 0, 0, 255))
 
-    for gt_box in gt_bboxes:
-        draw.rectangle(
-            list(gt_box[:4]), fill=(0, 0, 255, 60), outline=(0, 0, 255, 150))
+    draw_boxes(
+        image_pil, gt_bboxes[:, :4], fill=(0, 0, 255, 60),
+        outline=(0, 0, 255, 150)
+    )
 
     return image_pil
 
@@ -752,9 +972,11 @@ def draw_rpn_pred_combined_loss(pred_dict, image, top_k=10):
 
     image_pil, draw = get_image_draw(image)
 
+    draw_boxes(
+        image_pil, bbox_final, fill=(30, 0, 240, 20),
+        outline=(30, 0, 240, 100)
+    )
     for bbox, loss in zip(bbox_final, combined_loss):
-        bbox = list(bbox)
-        draw.rectangle(bbox, fill=(30, 0, 240, 20), outline=(30, 0, 240, 100))
         draw.text(
             tuple([bbox[0], bbox[1]]), text='{:.2f}'.format(loss),
             font=font, fill=(0, 0, 0, 255))
@@ -858,16 +1080,18 @@ def draw_ssd_cls_loss(pred_dict, image, foreground=True, topn=10, worst=True):
 
     image_pil, draw = get_image_draw(image)
 
-    for anchor_prob, anchor, anchor_loss in zip(prob, anchors, loss):
-        anchor = list(anchor)
-        draw.rectangle(anchor, fill=(0, 255, 0, 20), outline=(0, 255, 0, 100))
+    draw_boxes(
+        image_pil, anchors, fill=(0, 255, 0, 20), outline=(0, 255, 0, 100)
+    )
+    for anchor, anchor_loss in zip(anchors, loss):
         draw.text(
             tuple([anchor[0], anchor[1]]), text='{:.2f}'.format(anchor_loss),
             font=font, fill=(0, 0, 0, 255))
 
-    for gt_box in gt_bboxes:
-        draw.rectangle(
-            list(gt_box[:4]), fill=(0, 0, 255, 60), outline=(0, 0, 255, 150))
+    draw_boxes(
+        image_pil, gt_bboxes[:, :4], fill=(0, 0, 255, 60),
+        outline=(0, 0, 255, 150)
+    )
 
     return image_pil
 
@@ -883,11 +1107,11 @@ def draw_rpn_bbox_targets(pred_dict, image):
 
     gt_boxes = decode(all_anchors, bbox_target)
 
-    image_pil, draw = get_image_draw(image)
+    image_pil, _ = get_image_draw(image)
 
-    for gt_box in gt_boxes:
-        draw.rectangle(
-            list(gt_box), fill=(30, 0, 240, 20), outline=(30, 0, 240, 100))
+    draw_boxes(
+        image_pil, gt_boxes, fill=(30, 0, 240, 20), outline=(30, 0, 240, 100)
+    )
 
     return image_pil
 
@@ -970,22 +1194,23 @@ def draw_rcnn_cls_batch(pred_dict, image, foreground=True, background=True):
 
     image_pil, draw = get_image_draw(image)
 
-    for bbox, cls_target in zip(bboxes, cls_targets):
-        bbox = list(bbox.astype(int))
-        if cls_target > 0:
-            fill = (0, 255, 0, 20)
-            outline = (0, 255, 0, 100)
-        else:
-            fill = (255, 0, 0, 20)
-            outline = (255, 0, 0, 100)
-
-        draw.rectangle(bbox, fill=fill, outline=outline)
+    bboxes = bboxes.astype(int)
+    foreground = (cls_targets > 0)[:, np.newaxis]
+    fill = np.where(foreground, (0, 255, 0, 20), (255, 0, 0, 20))
+    draw_boxes(
+        image_pil, bboxes, fill=fill,
+        outline=np.where(foreground, (0, 255, 0, 100), (255, 0, 0, 100))
+    )
+    for bbox, cls_target, text_fill in zip(bboxes, cls_targets, fill):
         draw.text(
-            tuple(bbox[:2]), text=str(int(cls_target)), font=font, fill=fill)
+            tuple(bbox[:2]), text=str(int(cls_target)), font=font,
+            fill=tuple(text_fill.tolist()))
 
+    draw_boxes(
+        image_pil, gt_bboxes[:, :4], fill=(0, 0, 255, 20),
+        outline=(0, 0, 255, 100)
+    )
     for gt_box in gt_bboxes:
-        draw.rectangle(
-            list(gt_box[:4]), fill=(0, 0, 255, 20), outline=(0, 0, 255, 100))
         draw.text(
             tuple(gt_box[:2]), text=str(gt_box[4]),
             font=font, fill=(0, 0, 255, 255))
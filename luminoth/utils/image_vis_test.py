@@ -0,0 +1,145 @@
+import numpy as np
+import tensorflow as tf
+import threading
+
+from PIL import Image, ImageDraw
+
+from luminoth.utils import image_vis
+from luminoth.utils.image_vis import ImageVisWorker, draw_boxes
+
+
+class DrawBoxesTest(tf.test.TestCase):
+
+    def setUp(self):
+        self.image = np.random.randint(0, 256, size=(60, 80, 3))
+
+    def _draw_pil(self, boxes, fill, outline):
+        """Draws the boxes one by one, with fills below outlines.
+        """
+        image_pil = Image.fromarray(np.uint8(self.image))
+        draw = ImageDraw.Draw(image_pil, 'RGBA')
+        for box in boxes:
+            draw.rectangle(list(box), fill=fill)
+        for box in boxes:
+            draw.rectangle(list(box), outline=outline)
+        return np.asarray(image_pil, dtype=np.int32)
+
+    def _draw_boxes(self, boxes, fill, outline):
+        image_pil = Image.fromarray(np.uint8(self.image))
+        draw_boxes(image_pil, boxes, fill=fill, outline=outline)
+        return np.asarray(image_pil, dtype=np.int32)
+
+    def testSameAsPIL(self):
+        """Tests the boxes are drawn the same as by PIL.
+        """
+        boxes = np.array([
+            [5, 5, 20, 30],
+            [10, 10, 50, 40],
+            [12, 8, 30, 20],
+            # Partially outside the image.
+            [-10, -5, 20, 30],
+            [60, 40, 100, 90],
+            [0, 0, 79, 59],
+        ])
+        fill = (255, 0, 0, 40)
+        outline = (0, 255, 0, 100)
+
+        # Up to one unit off, since PIL rounds after drawing each box.
+        self.assertAllClose(
+            self._draw_boxes(boxes, fill, outline),
+            self._draw_pil(boxes, fill, outline),
+            atol=1
+        )
+
+    def testColorPerBox(self):
+        """Tests drawing boxes of different colors.
+        """
+        boxes = np.array([[5, 5, 20, 30], [40, 10, 70, 50]])
+        fill = np.array([[255, 0, 0, 40], [0, 0, 255, 255]])
+        outline = np.array([[0, 255, 0, 100], [0, 0, 0, 255]])
+
+        image_pil = Image.fromarray(np.uint8(self.image))
+        draw = ImageDraw.Draw(image_pil, 'RGBA')
+        for box, box_fill, box_outline in zip(boxes, fill, outline):
+            draw.rectangle(
+                list(box), fill=tuple(box_fill), outline=tuple(box_outline)
+            )
+
+        self.assertAllClose(
+            self._draw_boxes(boxes, fill, outline),
+            np.asarray(image_pil, dtype=np.int32),
+            atol=1
+        )
+
+    def testIgnoredBoxes(self):
+        """Tests boxes without area or outside the image aren't drawn.
+        """
+        boxes = np.array([
+            [20, 20, 10, 30],
+            [100, 10, 120, 20],
+            [-20, -20, -5, -5],
+        ])
+        self.assertAllEqual(
+            self._draw_boxes(boxes, (255, 0, 0, 40), (0, 255, 0, 100)),
+            self.image
+        )
+        self.assertAllEqual(
+            self._draw_boxes(np.zeros((0, 4)), (255, 0, 0, 40), None),
+            self.image
+        )
+
+
+class MockSummaryWriter(object):
+
+    def __init__(self):
+        self.steps = []
+
+    def add_summary(self, summary, global_step):
+        self.steps.append(global_step)
+
+
+class ImageVisWorkerTest(tf.test.TestCase):
+
+    def setUp(self):
+        # Hold the worker's thread until `release` is set.
+        self.release = threading.Event()
+        self._image_vis_summaries = image_vis.image_vis_summaries
+        image_vis.image_vis_summaries = (
+            lambda pred_dict, **kwargs: [self.release.wait()]
+        )
+
+    def tearDown(self):
+        self.release.set()
+        image_vis.image_vis_summaries = self._image_vis_summaries
+
+    def testDropsWhenFull(self):
+        writer = MockSummaryWriter()
+        worker = ImageVisWorker(writer, max_pending=1)
+        results = [worker.submit(step, {}) for step in range(5)]
+        self.release.set()
+        worker.close()
+
+        # At most one is being drawn and another one waiting.
+        self.assertFalse(all(results))
+        self.assertEqual(worker.dropped, results.count(False))
+        self.assertEqual(
+            writer.steps,
+            [step for step, queued in enumerate(results) if queued]
+        )
+
+    def testBlockingSubmit(self):
+        """Tests visualizations submitted with `block` are never dropped.
+        """
+        writer = MockSummaryWriter()
+        worker = ImageVisWorker(writer, max_pending=1)
+        threading.Timer(.1, self.release.set).start()
+        results = [worker.submit(step, {}, block=True) for step in range(5)]
+        worker.close()
+
+        self.assertTrue(all(results))
+        self.assertEqual(worker.dropped, 0)
+        self.assertEqual(writer.steps, list(range(5)))
+
+
+if __name__ == '__main__':
+    tf.test.main()
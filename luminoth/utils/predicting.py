@@ -2,11 +2,146 @@ import json
 import numpy as np
 import os
 import tensorflow as tf
+import time
 
 from luminoth.models import get_model
 from luminoth.datasets import get_dataset
 
 
+# Name of the node holding the metadata of a frozen graph.
+FROZEN_GRAPH_METADATA = 'luminoth_metadata'
+
+
+def _add_time(timings, name, start_time):
+    if timings is not None:
+        timings[name] = timings.get(name, 0.) + time.time() - start_time
+
+
+def columns_to_objects(columns):
+    """Converts the objects returned with `columnar=True` into a list.
+
+    Args:
+        columns (dict): Arrays of `bboxes`, `labels` and `probs`, as returned
+            by `PredictorNetwork.predict_image` with `columnar=True`.
+
+    Returns:
+        List of objects, with the same format as `predict_image`.
+    """
+    return [
+        {'bbox': bbox, 'label': label, 'prob': prob}
+        for bbox, label, prob in zip(
+            columns['bboxes'].tolist(), columns['labels'].tolist(),
+            columns['probs'].tolist()
+        )
+    ]
+
+
+def get_tile_starts(size, tile_size, overlap):
+    """Returns where each tile starts along a dimension of `size` pixels.
+
+    The tiles are evenly spaced, from the start to the end of the image (so
+    no tile is smaller than `tile_size`, unless the image is), using as few
+    as possible while overlapping consecutive ones by at least `overlap`
+    pixels.
+    """
+    if size <= tile_size:
+        return [0]
+
+    num_tiles = int(np.ceil(
+        float(size - tile_size) / (tile_size - overlap)
+    )) + 1
+    return np.round(
+        np.linspace(0, size - tile_size, num_tiles)
+    ).astype(int).tolist()
+
+
+def merge_tiled_objects(objects, tile_ids, threshold=0.5):
+    """Merges the objects found more than once by different tiles of an image.
+
+    Starting from the most probable, each object absorbs the objects with the
+    same label from other tiles whose intersection with it covers more than
+    `threshold` of the smallest of both. Comparing against the smallest one
+    (instead of using the IoU) also merges the parts of an object cut by the
+    edge of a tile. The resulting bounding box covers all of the merged
+    objects, so the object is whole again.
+
+    Objects from the same tile are never merged, as the model already
+    suppresses duplicates within an image.
+
+    Args:
+        objects: List of objects, as returned by `predict_image`, in the
+            image's coordinates.
+        tile_ids: List with the tile each object was found in.
+        threshold (float): Minimum fraction of the smallest object that the
+            intersection must cover to merge two objects.
+
+    Returns:
+        List of merged objects, sorted by probability.
+    """
+    if not objects:
+        return []
+
+    bboxes = np.array([obj['bbox'] for obj in objects], dtype=np.float64)
+    probs = np.array([obj['prob'] for obj in objects])
+    tile_ids = np.array(tile_ids)
+    label_ids = {}
+    labels = np.array([
+        label_ids.setdefault(obj['label'], len(label_ids))
+        for obj in objects
+    ])
+    areas = (
+        (bboxes[:, 2] - bboxes[:, 0] + 1) * (bboxes[:, 3] - bboxes[:, 1] + 1)
+    )
+
+    merged = []
+    # Ties keep the original order of the objects.
+    pending = np.argsort(-probs, kind='mergesort')
+    while pending.size:
+        idx = pending[0]
+        rest = pending[1:]
+
+        # Grow the object until no more parts of it are found, as the parts
+        # in different tiles may not overlap each other.
+        bbox = bboxes[idx]
+        area = areas[idx]
+        tiles = [tile_ids[idx]]
+        while rest.size:
+            intersection = (
+                np.maximum(
+                    np.minimum(bbox[2], bboxes[rest, 2]) -
+                    np.maximum(bbox[0], bboxes[rest, 0]) + 1, 0.
+                ) *
+                np.maximum(
+                    np.minimum(bbox[3], bboxes[rest, 3]) -
+                    np.maximum(bbox[1], bboxes[rest, 1]) + 1, 0.
+                )
+            )
+            same = (
+                (labels[rest] == labels[idx]) &
+                np.isin(tile_ids[rest], tiles, invert=True) &
+                (intersection > threshold * np.minimum(area, areas[rest]))
+            )
+            if not same.any():
+                break
+
+            group = rest[same]
+            bbox = np.concatenate([
+                np.minimum(bbox[:2], bboxes[group, :2].min(axis=0)),
+                np.maximum(bbox[2:], bboxes[group, 2:].max(axis=0)),
+            ])
+            area = (bbox[2] - bbox[0] + 1) * (bbox[3] - bbox[1] + 1)
+            tiles.extend(tile_ids[group])
+            rest = rest[~same]
+
+        obj = dict(objects[idx])
+        if len(tiles) > 1:
+            obj['bbox'] = bbox.astype(int).tolist()
+        merged.append(obj)
+        pending = rest
+
+    return merged
+
+
 class PredictorNetwork(object):
     """Instantiates a network in order to get predictions from it.
 
@@ -15,17 +150,30 @@ class PredictorNetwork(object):
 
     Returns a list of objects detected, which is a dict of its coordinates,
     label and probability, ordered by probability.
+
+    When `batch_size` is larger than one, an additional batched graph is built
+    so `predict_images` can run up to `batch_size` images through the base
+    network at once. A custom `tf.ConfigProto` can be given through
+    `session_config`, for example to limit the number of threads in use.
+
+    The network can be exported with `export_frozen_graph` into a single file
+    and loaded back with `from_frozen_graph`, which skips building the model
+    altogether.
+
+    Images too large to be downsized without losing their small objects can
+    be run through the network in tiles with `predict_tiled`.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, batch_size=1, session_config=None):
 
+        self.class_labels = None
         if config.dataset.dir:
             # Gets the names of the classes
             classes_file = os.path.join(config.dataset.dir, 'classes.json')
             if tf.gfile.Exists(classes_file):
                 self.class_labels = json.load(tf.gfile.GFile(classes_file))
-            else:
-                self.class_labels = None
+
+        self.num_classes = config.model.network.num_classes
 
         # Don't use data augmentation in predictions
         config.dataset.data_augmentation = None
@@ -33,12 +181,13 @@ class PredictorNetwork(object):
         dataset_class = get_dataset(config.dataset.type)
         model_class = get_model(config.model.type)
         dataset = dataset_class(config)
-        model = model_class(config)
+        # Summaries are never fetched, so leave them out of the graph.
+        model = model_class(config, with_summaries=False)
+
+        self.batch_size = batch_size
 
         graph = tf.Graph()
-        tf_config = tf.ConfigProto()
-        tf_config.gpu_options.allow_growth = True
-        self.session = tf.Session(config=tf_config, graph=graph)
+        self.session = self._create_session(graph, session_config)
 
         with graph.as_default():
             self.image_placeholder = tf.placeholder(
@@ -49,6 +198,16 @@ class PredictorNetwork(object):
             )
             pred_dict = model(image_tf)
 
+            self.fetches = self._get_fetches(config, pred_dict)
+            self.fetches['scale_factor'] = process_meta['scale_factor']
+
+            # If in debug mode, return the full prediction dictionary.
+            if config.train.debug:
+                self.fetches['_debug'] = pred_dict
+
+            if batch_size > 1:
+                self._build_batch(config, dataset, model)
+
             # Restore checkpoint
             if config.train.job_dir:
                 job_dir = config.train.job_dir
@@ -73,58 +232,383 @@ class PredictorNetwork(object):
                 )
                 self.session.run(init_op)
 
-            if config.model.type == 'ssd':
+    @classmethod
+    def from_frozen_graph(cls, path, session_config=None):
+        """Loads a network exported with `export_frozen_graph`.
+
+        Neither the model nor the dataset preprocessing are built, and no
+        checkpoint is restored, so it's considerably faster than instantiating
+        the network from its config. Batched predictions are not available.
+
+        Args:
+            path (str): Path to the frozen graph file.
+            session_config: Optional `tf.ConfigProto` to create the session
+                with.
+
+        Returns:
+            A `PredictorNetwork` instance.
+        """
+        if not tf.gfile.Exists(path):
+            raise ValueError('Could not find frozen graph in {}.'.format(path))
+
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+        network = cls.__new__(cls)
+        network.batch_size = 1
+        network.session = cls._create_session(graph, session_config)
+
+        metadata = json.loads(network.session.run(
+            graph.get_tensor_by_name('{}:0'.format(FROZEN_GRAPH_METADATA))
+        ).decode('utf-8'))
+
+        network.class_labels = metadata['class_labels']
+        network.num_classes = metadata['num_classes']
+        network.image_placeholder = graph.get_tensor_by_name(
+            metadata['input']
+        )
+        network.fetches = {
+            name: graph.get_tensor_by_name(tensor_name)
+            for name, tensor_name in metadata['outputs'].items()
+        }
+
+        return network
+
+    def export_frozen_graph(self, path):
+        """Writes the single image prediction graph into a frozen `GraphDef`.
+
+        Variables are replaced by constants holding their current values, and
+        only the operations needed to obtain the predictions are kept, so
+        summaries and debug outputs are stripped. The class labels are stored
+        within the graph, so the resulting file is self-contained.
+
+        Args:
+            path (str): Path of the file to write.
+        """
+        graph = self.session.graph
+        outputs = {
+            name: tensor for name, tensor in self.fetches.items()
+            if name != '_debug'
+        }
+
+        with graph.as_default():
+            if isinstance(outputs['scale_factor'], tuple):
+                # Different factors for height and width.
+                outputs['scale_factor'] = tf.stack(outputs['scale_factor'])
+
+            metadata = {
+                'input': self.image_placeholder.name,
+                'outputs': {
+                    name: tensor.name for name, tensor in outputs.items()
+                },
+                'class_labels': self.class_labels,
+                'num_classes': self.num_classes,
+            }
+            metadata_tf = tf.constant(
+                json.dumps(metadata), name=FROZEN_GRAPH_METADATA
+            )
+            if metadata_tf.op.name != FROZEN_GRAPH_METADATA:
+                raise ValueError('Network was already exported.')
+
+        output_node_names = [
+            tensor.op.name for tensor in outputs.values()
+        ] + [FROZEN_GRAPH_METADATA]
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            self.session, graph.as_graph_def(), output_node_names
+        )
+
+        with tf.gfile.GFile(path, 'wb') as f:
+            f.write(graph_def.SerializeToString())
+
+        tf.logging.info('Frozen graph with {} nodes written to {}.'.format(
+            len(graph_def.node), path
+        ))
+
+    @staticmethod
+    def _create_session(graph, session_config=None):
+        if session_config is None:
+            session_config = tf.ConfigProto()
+            session_config.gpu_options.allow_growth = True
+        return tf.Session(config=session_config, graph=graph)
+
+    def _get_fetches(self, config, pred_dict):
+        """Returns the objects, labels and probs tensors of a prediction."""
+        if config.model.type == 'ssd':
+            cls_prediction = pred_dict['classification_prediction']
+            objects_tf = cls_prediction['objects']
+            objects_labels_tf = cls_prediction['labels']
+            objects_labels_prob_tf = cls_prediction['probs']
+        elif config.model.type == 'fasterrcnn':
+            if config.model.network.get('with_rcnn', False):
                 cls_prediction = pred_dict['classification_prediction']
                 objects_tf = cls_prediction['objects']
                 objects_labels_tf = cls_prediction['labels']
                 objects_labels_prob_tf = cls_prediction['probs']
-            elif config.model.type == 'fasterrcnn':
-                if config.model.network.get('with_rcnn', False):
-                    cls_prediction = pred_dict['classification_prediction']
-                    objects_tf = cls_prediction['objects']
-                    objects_labels_tf = cls_prediction['labels']
-                    objects_labels_prob_tf = cls_prediction['probs']
-                else:
-                    rpn_prediction = pred_dict['rpn_prediction']
-                    objects_tf = rpn_prediction['proposals']
-                    objects_labels_prob_tf = rpn_prediction['scores']
-                    # All labels without RCNN are zero
-                    objects_labels_tf = tf.zeros(
-                        tf.shape(objects_labels_prob_tf), dtype=tf.int32
-                    )
             else:
-                raise ValueError(
-                    "Model type '{}' not supported".format(config.model.type)
+                rpn_prediction = pred_dict['rpn_prediction']
+                objects_tf = rpn_prediction['proposals']
+                objects_labels_prob_tf = rpn_prediction['scores']
+                # All labels without RCNN are zero
+                objects_labels_tf = tf.zeros(
+                    tf.shape(objects_labels_prob_tf), dtype=tf.int32
                 )
+        else:
+            raise ValueError(
+                "Model type '{}' not supported".format(config.model.type)
+            )
 
-            self.fetches = {
-                'objects': objects_tf,
-                'labels': objects_labels_tf,
-                'probs': objects_labels_prob_tf,
-                'scale_factor': process_meta['scale_factor']
-            }
+        return {
+            'objects': objects_tf,
+            'labels': objects_labels_tf,
+            'probs': objects_labels_prob_tf,
+        }
 
-            # If in debug mode, return the full prediction dictionary.
-            if config.train.debug:
-                self.fetches['_debug'] = pred_dict
+    def _build_batch(self, config, dataset, model):
+        """Builds the graph used for batched predictions.
+
+        Images are fed padded to the size of the largest one, along with their
+        original shapes. Each image is preprocessed on its own, and the results
+        are padded again (at the bottom and right) into a single batch. (The
+        model fills the padding so it's zero once the base network subtracts
+        the channel means, see `BaseNetwork.fill_padding`.)
+        """
+        self.batch_placeholder = tf.placeholder(
+            tf.float32, (self.batch_size, None, None, 3)
+        )
+        self.batch_shapes_placeholder = tf.placeholder(
+            tf.int32, (self.batch_size, 2)
+        )
+
+        images = []
+        scale_factors = []
+        for idx in range(self.batch_size):
+            height = self.batch_shapes_placeholder[idx, 0]
+            width = self.batch_shapes_placeholder[idx, 1]
+            image = self.batch_placeholder[idx, :height, :width, :]
+            image.set_shape((None, None, 3))
+
+            image, _, process_meta = dataset.preprocess(image)
+            images.append(image)
+            scale_factors.append(process_meta['scale_factor'])
+
+        image_shapes = tf.stack([tf.shape(image)[:2] for image in images])
+        max_shape = tf.reduce_max(image_shapes, axis=0)
+        batch = tf.stack([
+            tf.image.pad_to_bounding_box(
+                image, 0, 0, max_shape[0], max_shape[1]
+            )
+            for image in images
+        ])
 
-    def predict_image(self, image):
+        if config.model.type == 'fasterrcnn':
+            batch_pred = model(batch, image_shapes=image_shapes)
+        else:
+            batch_pred = model(batch)
+
+        self.batch_fetches = []
+        for pred_dict, scale_factor in zip(batch_pred, scale_factors):
+            fetches = self._get_fetches(config, pred_dict)
+            fetches['scale_factor'] = scale_factor
+            self.batch_fetches.append(fetches)
+
+    def predict_image(self, image, timings=None, columnar=False):
+        """Run an image through the network.
+
+        Args:
+            image: Image (or 3-D array) of arbitrary size.
+            timings (dict): If given, the seconds spent running the network
+                and processing its results are added to its `inference` and
+                `postprocess` keys.
+            columnar (bool): Return the objects as arrays (see below).
+
+        Returns:
+            List of objects, sorted by decreasing probability, each one with
+            the format::
+
+                {
+                    'bbox': [x_min, y_min, x_max, y_max],
+                    'label': label,
+                    'prob': prob
+                }
+
+            If `columnar` is set, a dict with the same objects as arrays
+            instead: `bboxes` (integers, of shape `(num_objects, 4)`),
+            `labels` and `probs`. They can be converted to the list of
+            objects with `columns_to_objects`.
+        """
+        start_time = time.time()
         fetched = self.session.run(self.fetches, feed_dict={
             self.image_placeholder: np.array(image)
         })
+        _add_time(timings, 'inference', start_time)
+
+        start_time = time.time()
+        objects = self._process_fetched(fetched, columnar=columnar)
+        _add_time(timings, 'postprocess', start_time)
 
+        return objects
+
+    def predict_images(self, images, timings=None, columnar=False):
+        """Run several images through the network.
+
+        Images are grouped into batches of `batch_size` images of similar
+        aspect ratio, in order to minimize the padding needed for each batch.
+
+        Args:
+            images: List of images (or 4-D array) of arbitrary sizes.
+            timings (dict): If given, the seconds spent running the network
+                and processing its results are added to its `inference` and
+                `postprocess` keys.
+            columnar (bool): Return the objects of each image as arrays.
+
+        Returns:
+            List with the predictions for each image, in the same order as
+            `images`, with the same format as `predict_image`.
+        """
+        images = [np.array(image) for image in images]
+        if self.batch_size == 1:
+            return [
+                self.predict_image(image, timings, columnar=columnar)
+                for image in images
+            ]
+
+        order = sorted(
+            range(len(images)),
+            key=lambda idx: images[idx].shape[0] / float(images[idx].shape[1])
+        )
+
+        predictions = [None] * len(images)
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            batch = [images[idx] for idx in indices]
+            if len(batch) == 1:
+                batch_predictions = [
+                    self.predict_image(batch[0], timings, columnar=columnar)
+                ]
+            else:
+                batch_predictions = self._predict_batch(
+                    batch, timings, columnar=columnar
+                )
+
+            for idx, prediction in zip(indices, batch_predictions):
+                predictions[idx] = prediction
+
+        return predictions
+
+    def predict_tiled(self, image, tile_size=600, overlap=100,
+                      merge_threshold=0.5):
+        """Runs a large image through the network in overlapping tiles.
+
+        The image is split into square tiles of `tile_size` pixels, which
+        are run through the network `batch_size` at a time, so memory usage
+        doesn't grow with the size of the image (besides the image itself).
+        Tiles are preprocessed just as whole images are, so `tile_size`
+        should be between the `min_size` and `max_size` of the
+        preprocessing to keep the original resolution.
+
+        Objects are moved back to the image's coordinates, and the ones
+        found in more than one tile (where they overlap) are merged. See
+        `merge_tiled_objects`.
+
+        Args:
+            image: Image of arbitrary size.
+            tile_size (int): Size of the tiles, in pixels.
+            overlap (int): Minimum overlap between consecutive tiles, in
+                pixels. Objects larger than this are never seen whole by any
+                tile, so they may be harder to detect.
+            merge_threshold (float): Objects with the same label, found in
+                different tiles, are considered the same when their
+                intersection covers more than this fraction of the smallest
+                one.
+
+        Returns:
+            List of objects, with the same format as `predict_image`.
+        """
+        if not 0 <= overlap < tile_size:
+            raise ValueError(
+                '`overlap` must be non-negative and smaller than '
+                '`tile_size`.'
+            )
+
+        image = np.asarray(image)
+        height, width = image.shape[:2]
+        tiles = [
+            (y, x)
+            for y in get_tile_starts(height, tile_size, overlap)
+            for x in get_tile_starts(width, tile_size, overlap)
+        ]
+
+        objects = []
+        tile_ids = []
+        for start in range(0, len(tiles), self.batch_size):
+            positions = tiles[start:start + self.batch_size]
+            predictions = self.predict_images([
+                image[y:y + tile_size, x:x + tile_size]
+                for y, x in positions
+            ])
+            for idx, (y, x), tile_objects in zip(
+                    range(start, start + len(positions)), positions,
+                    predictions):
+                for obj in tile_objects:
+                    obj['bbox'] = [
+                        obj['bbox'][0] + x, obj['bbox'][1] + y,
+                        obj['bbox'][2] + x, obj['bbox'][3] + y,
+                    ]
+                objects.extend(tile_objects)
+                tile_ids.extend([idx] * len(tile_objects))
+
+        if len(tiles) == 1:
+            return objects
+
+        return merge_tiled_objects(objects, tile_ids, merge_threshold)
+
+    def _predict_batch(self, images, timings=None, columnar=False):
+        # Fill incomplete batches by repeating the last image; their results
+        # are discarded.
+        total_images = len(images)
+        images = images + [images[-1]] * (self.batch_size - total_images)
+
+        shapes = np.array(
+            [image.shape[:2] for image in images], dtype=np.int32
+        )
+        max_height, max_width = shapes.max(axis=0)
+        batch = np.zeros(
+            (self.batch_size, max_height, max_width, 3), dtype=np.float32
+        )
+        for idx, image in enumerate(images):
+            batch[idx, :image.shape[0], :image.shape[1], :] = image
+
+        start_time = time.time()
+        fetched = self.session.run(self.batch_fetches, feed_dict={
+            self.batch_placeholder: batch,
+            self.batch_shapes_placeholder: shapes,
+        })
+        _add_time(timings, 'inference', start_time)
+
+        start_time = time.time()
+        predictions = [
+            self._process_fetched(image_fetched, columnar=columnar)
+            for image_fetched in fetched[:total_images]
+        ]
+        _add_time(timings, 'postprocess', start_time)
+
+        return predictions
+
+    def _process_fetched(self, fetched, columnar=False):
         objects = fetched['objects']
-        labels = fetched['labels'].tolist()
-        probs = fetched['probs'].tolist()
+        labels = fetched['labels']
         scale_factor = fetched['scale_factor']
 
-        if self.class_labels is not None:
-            labels = [self.class_labels[label] for label in labels]
-
         # Scale objects to original image dimensions
-        if isinstance(scale_factor, tuple):
-            # If scale factor is a tuple, it means we need to scale height and
-            # width by a different amount. In that case scale factor is:
+        if np.ndim(scale_factor) > 0:
+            # If scale factor is a tuple (or an array, when loaded from a
+            # frozen graph), it means we need to scale height and width by a
+            # different amount. In that case scale factor is:
             # (scale_factor_height, scale_factor_width)
             objects /= [scale_factor[1], scale_factor[0],
                         scale_factor[1], scale_factor[0]]
@@ -134,17 +618,19 @@ class PredictorNetwork(object):
             objects /= scale_factor
 
         # Cast to int to consistently return the same type in Python 2 and 3
-        objects = [
-            [int(round(coord)) for coord in obj]
-            for obj in objects.tolist()
-        ]
+        bboxes = np.round(objects).astype(np.int64).reshape(-1, 4)
+        probs = np.round(fetched['probs'].astype(np.float64), 4)
 
-        predictions = sorted([
-            {
-                'bbox': obj,
-                'label': label,
-                'prob': round(prob, 4),
-            } for obj, label, prob in zip(objects, labels, probs)
-        ], key=lambda x: x['prob'], reverse=True)
+        # Sort by decreasing probability, keeping the order of ties.
+        order = np.argsort(-probs, kind='mergesort')
+        bboxes = bboxes[order]
+        labels = labels[order]
+        probs = probs[order]
 
-        return predictions
+        if self.class_labels is not None:
+            labels = np.array(self.class_labels, dtype=object)[labels]
+
+        columns = {'bboxes': bboxes, 'labels': labels, 'probs': probs}
+        if columnar:
+            return columns
+        return columns_to_objects(columns)
@@ -0,0 +1,200 @@
+import numpy as np
+import os
+import tempfile
+import tensorflow as tf
+
+from luminoth.models.ssd import SSD
+from luminoth.utils.config import get_base_config
+from luminoth.utils.predicting import PredictorNetwork, columns_to_objects
+
+
+def process_fetched_loop(fetched, class_labels=None):
+    """Reference (non-vectorized) implementation of `_process_fetched`."""
+    labels = fetched['labels'].tolist()
+    if class_labels is not None:
+        labels = [class_labels[label] for label in labels]
+
+    objects = fetched['objects'].copy()
+    scale_factor = fetched['scale_factor']
+    if np.ndim(scale_factor) > 0:
+        objects /= [
+            scale_factor[1], scale_factor[0], scale_factor[1], scale_factor[0]
+        ]
+    else:
+        objects /= scale_factor
+
+    objects = [
+        [int(round(coord)) for coord in obj]
+        for obj in objects.tolist()
+    ]
+    return sorted([
+        {'bbox': obj, 'label': label, 'prob': round(prob, 4)}
+        for obj, label, prob in zip(
+            objects, labels, fetched['probs'].tolist()
+        )
+    ], key=lambda x: x['prob'], reverse=True)
+
+
+class PredictorNetworkTest(tf.test.TestCase):
+
+    def setUp(self):
+        self.config = get_base_config(SSD)
+        self.config.dataset.dir = ''
+        self.config.train.job_dir = ''
+        self.config.train.debug = False
+        self.config.model.network.num_classes = 3
+        self.config.model.base_network.download = False
+        # Keep every prediction, so results are comparable.
+        self.config.model.proposals.min_prob_threshold = 0.0
+
+    def testNoSummaries(self):
+        """Tests that the prediction graph doesn't include summary ops.
+        """
+        network = PredictorNetwork(self.config)
+        op_types = set(
+            op.type for op in network.session.graph.get_operations()
+        )
+        self.assertNotIn('HistogramSummary', op_types)
+        self.assertNotIn('ScalarSummary', op_types)
+
+    def testFrozenGraph(self):
+        """Tests that a frozen graph predicts the same as the original network.
+        """
+        network = PredictorNetwork(self.config)
+
+        path = os.path.join(tempfile.mkdtemp(), 'frozen_graph.pb')
+        network.export_frozen_graph(path)
+        frozen_network = PredictorNetwork.from_frozen_graph(path)
+
+        # No variables nor summaries are left in the frozen graph.
+        op_types = set(
+            op.type for op in frozen_network.session.graph.get_operations()
+        )
+        self.assertNotIn('VariableV2', op_types)
+        self.assertNotIn('HistogramSummary', op_types)
+        self.assertNotIn('ScalarSummary', op_types)
+
+        self.assertEqual(frozen_network.num_classes, 3)
+        self.assertIsNone(frozen_network.class_labels)
+
+        image = np.random.randint(0, 256, size=(200, 300, 3))
+        self.assertEqual(
+            network.predict_image(image),
+            frozen_network.predict_image(image)
+        )
+
+    def testTiledPrediction(self):
+        """Tests predicting in tiles, compared to predicting the whole image.
+        """
+        network = PredictorNetwork(self.config)
+        image = np.random.randint(0, 256, size=(300, 500, 3))
+
+        # A single tile is the same as the whole image.
+        self.assertEqual(
+            network.predict_tiled(image, tile_size=500),
+            network.predict_image(image)
+        )
+
+        objects = network.predict_tiled(image, tile_size=200, overlap=50)
+        self.assertGreater(len(objects), 0)
+        for obj in objects:
+            self.assertTrue(0 <= obj['bbox'][0] <= obj['bbox'][2] <= 500)
+            self.assertTrue(0 <= obj['bbox'][1] <= obj['bbox'][3] <= 300)
+        probs = [obj['prob'] for obj in objects]
+        self.assertEqual(probs, sorted(probs, reverse=True))
+
+        with self.assertRaises(ValueError):
+            network.predict_tiled(image, tile_size=200, overlap=200)
+
+    def testTiledPredictionMerge(self):
+        """Tests objects found in more than one tile are merged.
+        """
+        network = PredictorNetwork(self.config)
+
+        # Each pixel holds its coordinates, so tiles can be located.
+        rows, cols = np.meshgrid(
+            np.arange(300), np.arange(500), indexing='ij'
+        )
+        image = np.stack([rows, cols, np.zeros((300, 500))], axis=-1)
+        objects = [
+            {'bbox': [180, 100, 220, 140], 'label': 0, 'prob': 0.9},
+            {'bbox': [182, 102, 221, 140], 'label': 1, 'prob': 0.8},
+            {'bbox': [400, 200, 450, 250], 'label': 0, 'prob': 0.7},
+        ]
+
+        def predict_images(tiles):
+            predictions = []
+            for tile in tiles:
+                y, x = tile[0, 0, :2].astype(int)
+                height, width = tile.shape[:2]
+                # Objects (even partially) inside the tile, in its own
+                # coordinates.
+                predictions.append([
+                    {
+                        'bbox': [
+                            max(obj['bbox'][0] - x, 0),
+                            max(obj['bbox'][1] - y, 0),
+                            min(obj['bbox'][2] - x, width - 1),
+                            min(obj['bbox'][3] - y, height - 1),
+                        ],
+                        'label': obj['label'],
+                        'prob': obj['prob'],
+                    }
+                    for obj in objects
+                    if obj['bbox'][2] >= x and obj['bbox'][0] < x + width and
+                    obj['bbox'][3] >= y and obj['bbox'][1] < y + height
+                ])
+            return predictions
+
+        network.predict_images = predict_images
+        self.assertEqual(
+            network.predict_tiled(image, tile_size=200, overlap=100),
+            objects
+        )
+
+    def testProcessFetched(self):
+        """Tests the results are identical to the loop-based implementation.
+        """
+        # The session isn't needed to process its results.
+        network = PredictorNetwork.__new__(PredictorNetwork)
+
+        for class_labels in (None, ['cat', 'dog', 'person']):
+            network.class_labels = class_labels
+            for num_objects in (0, 1, 300):
+                for scale_factor in (np.float32(0.7), np.array([0.7, 1.3])):
+                    fetched = {
+                        'objects': np.random.uniform(
+                            0, 600, size=(num_objects, 4)
+                        ).astype(np.float32),
+                        'labels': np.random.randint(3, size=num_objects),
+                        # Rounded, so there are ties to keep in order.
+                        'probs': np.round(
+                            np.random.uniform(size=num_objects), 2
+                        ).astype(np.float32),
+                        'scale_factor': scale_factor,
+                    }
+                    expected = process_fetched_loop(fetched, class_labels)
+
+                    # Objects are scaled in place.
+                    self.assertEqual(
+                        network._process_fetched(
+                            dict(fetched, objects=fetched['objects'].copy())
+                        ),
+                        expected
+                    )
+                    columns = network._process_fetched(
+                        dict(fetched, objects=fetched['objects'].copy()),
+                        columnar=True
+                    )
+                    self.assertEqual(columns['bboxes'].shape, (num_objects, 4))
+                    self.assertEqual(columns_to_objects(columns), expected)
+
+    def testMissingFrozenGraph(self):
+        with self.assertRaises(ValueError):
+            PredictorNetwork.from_frozen_graph(
+                os.path.join(tempfile.mkdtemp(), 'missing.pb')
+            )
+
+
+if __name__ == '__main__':
+    tf.test.main()
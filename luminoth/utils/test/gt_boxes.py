@@ -2,7 +2,7 @@ import numpy as np
 
 
 def generate_gt_boxes(total_boxes, image_size, min_size=10,
-                      total_classes=None):
+                      total_classes=None, random_state=None):
     """
     Generate `total_boxes` fake (but consistent) ground-truth boxes for an
     image of size `image_size` (height, width).
@@ -10,11 +10,16 @@ def generate_gt_boxes(total_boxes, image_size, min_size=10,
     Args:
         total_boxes (int): The total number of boxes.
         image_size (tuple): Size of the fake image.
+        random_state (np.random.RandomState): Generator of the random
+            values. When not set, the global `np.random` one is used.
 
     Returns:
         gt_boxes (np.array): With shape [total_boxes, 4].
     """
 
+    if random_state is None:
+        random_state = np.random
+
     image_size = np.array(image_size)
 
     assert (image_size > min_size).all(), \
@@ -22,13 +27,13 @@ def generate_gt_boxes(total_boxes, image_size, min_size=10,
 
     # Generate random sizes for each boxes.
     max_size = np.min(image_size) - min_size
-    random_sizes = np.random.randint(
+    random_sizes = random_state.randint(
         low=min_size, high=max_size,
         size=(total_boxes, 2)
     )
 
     # Generate random starting points for boundind boxes (left top point)
-    random_leftop = np.random.randint(
+    random_leftop = random_state.randint(
         low=0, high=max_size, size=(total_boxes, 2)
     )
 
@@ -46,7 +51,7 @@ def generate_gt_boxes(total_boxes, image_size, min_size=10,
         'Gt boxes without consistent Ys'
 
     if total_classes:
-        random_classes = np.random.randint(
+        random_classes = random_state.randint(
             low=0, high=total_classes - 1, size=(total_boxes, 1))
         gt_boxes = np.column_stack((gt_boxes, random_classes))
 